@@ -0,0 +1,96 @@
+"""
+Asynchronous locking for flock.py, apart from it since Python 2 can't parse coroutines
+
+Use ``Flock.acquire_read_async()`` or ``Flock.acquire_write_async()``, which import it.
+"""
+
+import asyncio
+import logging
+import os
+from time import time
+from fcntl import LOCK_NB
+from errno import EACCES, EAGAIN
+
+
+class AsyncAcquire(object):
+    """
+    Asynchronous context manager for ``Flock.acquire_*_async()`` (``async with``).
+
+    Waiters make the same non-blocking attempts as ``Flock.lock_timeout()``, but
+    sleep on the event loop between them, so they're admitted in the lock's policy
+    order without blocking it, or a thread each.  A waiter cancelled while waiting
+    gives up its place in line, it never holds the lock without entering.
+
+    :param flock_obj: Flock instance to lock
+    :param op: LOCK_SH or LOCK_EX
+    :param name: Name of lock mode for logging and telemetry
+    :param timeout: Seconds to wait for the lock, None to wait forever
+    :param caller: Location of code acquiring the lock, for telemetry
+    """
+
+    lockfile = None
+    acquired = None
+
+    def __init__(self, flock_obj, op, name, timeout, caller):
+        self.flock = flock_obj
+        self.op = op
+        self.name = name
+        self.timeout = timeout
+        self.caller = caller
+
+    async def __aenter__(self):
+        start = time()
+        deadline = None if self.timeout is None else start + float(self.timeout)
+        self.flock.contended_by = None
+        try:
+            if self.flock._lockfile.closed:  # pylint: disable=W0212
+                lockfile = await self._lock_new(deadline)
+            else:  # Converting, a separate open file would deadlock with this one
+                lockfile = await self._lock_backoff(deadline)
+        finally:
+            self.flock.wait_time = time() - start
+        if lockfile is None:
+            logging.error("    %d timedout acquiring %s lock after %0.4fs",
+                          os.getpid(), self.name, self.flock.wait_time)
+            self.flock._record(self.name, self.caller, self.timeout, None)  # pylint: disable=W0212
+            return None
+        logging.info("    %d acquired %s lock asynchronously, waited %0.4fs",
+                     os.getpid(), self.name, self.flock.wait_time)
+        self.acquired = time()
+        self.lockfile = open(lockfile.name, 'rb')
+        return self.lockfile
+
+    async def _lock_new(self, deadline):
+        locking = self.flock._locking(self.op, deadline, False)  # pylint: disable=W0212
+        try:
+            for wait in locking:
+                await asyncio.sleep(wait)
+        finally:
+            locking.close()  # When cancelled, leaves the gate or queue
+        if self.flock._lockfile.closed:  # pylint: disable=W0212
+            return None
+        return self.flock._lockfile  # pylint: disable=W0212
+
+    async def _lock_backoff(self, deadline):
+        waits = self.flock._backoff(deadline)  # pylint: disable=W0212
+        while True:
+            try:
+                return self.flock.lock(self.op | LOCK_NB)
+            except IOError as xcept:
+                if xcept.errno not in [EACCES, EAGAIN]:
+                    raise
+            wait = next(waits, None)
+            if wait is None:
+                return None
+            await asyncio.sleep(wait)
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self.acquired is not None:
+            self.flock.unlock()
+            self.lockfile.close()
+            logging.debug("    %d %s lock released, held for %0.4fs",
+                          os.getpid(), self.name, time() - self.acquired)
+            self.flock._record(self.name, self.caller, self.timeout,  # pylint: disable=W0212
+                               time() - self.acquired)
+            self.acquired = None
+        return False  # Don't suppress exceptions
@@ -21,16 +21,24 @@ import sys
 import os
 import os.path
 import logging
+import json
 import random
+import re
 from importlib import import_module
 from imp import find_module
 import time
 import argparse
 import subprocess
 from base64 import b64encode
+from collections import deque
+from urllib import quote
 import shutil
+import threading
+from functools import partial
+from StringIO import StringIO
+from email.utils import parsedate_tz, mktime_tz
 import virtualenv
-from flock import Flock
+from flock import Flock, LockManager
 
 # Operation is discovered by symlink name used to execute script
 ONLY_CREATE_NAME = 'openstack_exclusive_create.py'
@@ -119,6 +127,28 @@ HELP_EXIT_CODE = 127
 
 DEFAULT_TIMEOUT = 300
 
+# Seconds a hung lock holder may block other jobs, it renews after each request,
+# or line of pip output
+DEFAULT_LOCK_LEASE = 60
+
+# How TimeoutAction spaces checks for completion, a key of SCHEDULES.  Fixed, as
+# before --schedule, the others are opted into until they've proven themselves.
+DEFAULT_SCHEDULE = 'fixed'
+
+# Historical durations of TimeoutAction subclasses, for the learned schedule
+DURATIONS_FILENAME = '.crap_durations.json'
+
+# Keystone tokens and service catalogs, by credentials, re-used by later jobs
+AUTH_STATE_FILENAME = '.crap_auth_state.json'
+
+# Number of VMs handled at the same time with --batch
+DEFAULT_WORKERS = 10
+
+# --batch YAML keys which may override options for a VM, to create() argument names
+BATCH_KEYS = dict(image='image', flavor='flavor', router='router_name',
+                  private='private', size='size', userdata='userdata_filepath',
+                  pubkey='pub_key_files')
+
 # Must use format dictionary w/ keys: name, ip_addr, and uuid
 OUTPUT_FORMAT = """---
 ansible_host: {ip_addr}
@@ -168,18 +198,47 @@ class Singleton(object):
         cls._singleton = None
 
 
-class OpenstackLock(Singleton, Flock):
+class OpenstackLocks(Singleton, LockManager):
     """
-    Singleton security around critical (otherwise) non-atomic Openstack operations
+    Singleton security around critical (otherwise) non-atomic Openstack operations,
+    locking only the resources (e.g. server, network) involved.
     """
 
     # Only initialize singleton once
     # pylint: disable=W0231
-    def __init__(self, lockfilepath=None):
-        del lockfilepath
+    def __init__(self, lockdir=None, prefix=None, lease=None):
+        del lockdir
+        del prefix
+        del lease
 
-    def __new__init__(self, lockfilepath=None):
-        super(OpenstackLock, self).__init__(lockfilepath)
+    def __new__init__(self, lockdir=None, prefix=None, lease=None):
+        super(OpenstackLocks, self).__init__(lockdir, prefix, lease=lease)
+
+    @staticmethod
+    def renew(held):
+        """
+        Renew leases of held locks, before changing the resources they guard.
+
+        :param held: List of Flock instances, from an ``acquire_*()`` context
+        :raises IOError: If a lease was broken, the resources are no longer locked.
+        """
+        for lock in held:
+            lock.renew()
+
+
+def thread_local(name):
+    """
+    Return property storing attribute name per-thread, in the instance's ``_local``.
+
+    :param name: Attribute name within ``_local``
+    """
+    def fget(self):
+        return getattr(self._local, name, None)  # pylint: disable=W0212
+
+    def fset(self, value):
+        setattr(self._local, name, value)  # pylint: disable=W0212
+
+    return property(fget, fset)
 
 
 class OpenstackREST(Singleton):
@@ -191,12 +250,36 @@ class OpenstackREST(Singleton):
                              (from os-client-config cloud instance)
     """
 
-    # Cache of current and previous response instances and json() return.
-    response_json = None
-    response_obj = None
-    response_code = None
-    # Useful for debugging purposes
-    previous_responses = None
+    # Cache of current response instance and json() return, for the calling thread.
+    _local = threading.local()
+    response_json = thread_local('response_json')
+    response_obj = thread_local('response_obj')
+    response_code = thread_local('response_code')
+    # Useful for debugging purposes, summaries of current and previous responses
+    response_history = None
+    # Threads append to it, read it with ``history()``
+    _history_lock = threading.Lock()
+
+    #: Number of response summaries kept in ``response_history``
+    history_length = 100
+
+    #: Characters of each response body kept in ``response_history``, bodies
+    #: fitting are also kept as parsed JSON (if they are).
+    history_body = 2000
+
+    #: Seconds a GET response may be re-used, by service and URI prefix (first match).
+    #: Server TTL must be shorter than any ``TimeoutAction.sleep``, so polls see changes.
+    cache_ttls = (('compute', '/flavors', 3600),
+                  ('image', '/v2/images', 3600),
+                  ('network', '/v2.0/routers', 600),
+                  ('compute', '/servers', 0.5))
+
+    # Re-usable GET responses, by (service, uri): (expiration, response_obj, json)
+    response_cache = None
+    cache_hits = 0
+    cache_misses = 0
+    # Threads share the cache
+    _cache_lock = threading.RLock()
 
     float_ip_selector = staticmethod(random.choice)
 
@@ -210,8 +293,10 @@ class OpenstackREST(Singleton):
 
     def __init__(self, service_sessions=None):
         del service_sessions
-        if self.previous_responses is None:
-            self.previous_responses = []
+        if self.response_history is None:
+            self.response_history = deque(maxlen=self.history_length)
+        if self.response_cache is None:
+            self.response_cache = {}
 
     def raise_if(self, true_condition, xception, msg):
         """
@@ -220,20 +305,13 @@ class OpenstackREST(Singleton):
         if not true_condition:
             return None
 
-        if self.previous_responses:
-            responses = self.previous_responses + [self.response_obj]
-        elif self.response_obj:
-            responses = [self.response_obj]
-        else:
-            responses = []
-
         logging.debug("Response History:")
-        for response in responses:
-            logging.debug('  (%s) %s:', response.request.method, response.request.url)
-            try:
-                logging.debug('    %s', response.json())
-            except ValueError:
-                pass
+        for summary in self.history():
+            logging.debug('  (%s) %s: %s in %0.3fs%s', summary['method'], summary['url'],
+                          summary['status_code'], summary['latency'],
+                          ' (cached)' if summary['cached'] else '')
+            if summary['body']:
+                logging.debug('    %s%s', summary['body'], '...' if summary['truncated'] else '')
             logging.debug('')
 
         if callable(xception):  # Exception not previously raised
@@ -258,13 +336,19 @@ class OpenstackREST(Singleton):
         :returns: json instance
         """
         session = self.service_sessions[service]
-        if self.response_obj is not None:
-            self.previous_responses.append(self.response_obj)
+        start = time.time()
+        cached = None
         if method == 'get':
-            self.response_obj = session.get(uri)
+            cached = self.cached(service, uri)
+            if cached is None:
+                self.response_obj = session.get(uri)
+            else:
+                self.response_obj, self.response_json = cached
         elif method == 'post':
+            self.invalidate(service, uri)
             self.response_obj = session.post(uri, json=post_json)
         elif method == 'delete':
+            self.invalidate(service, uri)
             self.response_obj = session.delete(uri)
         else:
             self.raise_if(True,
@@ -272,14 +356,18 @@ class OpenstackREST(Singleton):
                           "Unknown method %s" % method)
 
         self.response_code = int(self.response_obj.status_code)
+        self.summarize(time.time() - start, cached is not None)
         self.raise_if(self.response_code not in [200, 201, 202, 204],
                       ValueError, "Failed: %s request to %s: %s" % (method, uri,
                                                                     self.response_code))
 
-        try:
-            self.response_json = self.response_obj.json()
-        except ValueError:  # Not every request has a JSON response
-            self.response_json = None
+        if cached is None:
+            try:
+                self.response_json = self.response_obj.json()
+            except ValueError:  # Not every request has a JSON response
+                self.response_json = None
+            if method == 'get':
+                self.cache(service, uri)
 
         # All responses encode the object under it's name.
         if unwrap:
@@ -291,6 +379,93 @@ class OpenstackREST(Singleton):
         else:  # return it as-is
             return self.response_json
 
+    def history(self):
+        """
+        Return a list of summaries in ``response_history``, oldest first.
+        """
+        with self._history_lock:
+            return list(self.response_history)
+
+    def summarize(self, latency, cached=False):
+        """
+        Append a summary of the current response to ``response_history``
+
+        :param latency: Seconds the response took
+        :param cached: True if the response was re-used from the cache
+        """
+        content = self.response_obj.content or ''
+        truncated = len(content) > self.history_body
+        body = content[:self.history_body].decode('utf-8', 'replace')
+        parsed = None
+        if body and not truncated:
+            try:
+                parsed = json.loads(body)
+            except ValueError:
+                pass  # Not JSON, only the body is kept
+        summary = dict(method=self.response_obj.request.method,
+                       url=self.response_obj.request.url,
+                       status_code=self.response_code,
+                       latency=latency, cached=cached, body=body,
+                       json=parsed, truncated=truncated)
+        with self._history_lock:
+            self.response_history.append(summary)
+
+    def cached(self, service, uri):
+        """
+        Return unexpired (response_obj, json) from a previous GET of uri, or None.
+
+        :param service: Name of service uri was requested from
+        :param uri: service URI of get operation
+        """
+        with self._cache_lock:
+            entry = self.response_cache.get((service, uri))
+            if entry is not None and entry[0] > time.time():
+                self.cache_hits += 1
+                return entry[1:]
+            self.cache_misses += 1
+            return None
+
+    def cache(self, service, uri):
+        """
+        Record current response to GET of uri, for re-use within its ``cache_ttls``.
+
+        :param service: Name of service uri was requested from
+        :param uri: service URI of get operation
+        """
+        with self._cache_lock:
+            now = time.time()
+            for key, entry in list(self.response_cache.items()):
+                if entry[0] <= now:  # Keep memory bounded too
+                    del self.response_cache[key]
+            for ttl_service, prefix, ttl in self.cache_ttls:
+                if service == ttl_service and uri.startswith(prefix):
+                    self.response_cache[(service, uri)] = (now + ttl,
+                                                           self.response_obj,
+                                                           self.response_json)
+                    return
+
+    def invalidate(self, service=None, uri=None):
+        """
+        Forget cached responses of service (or all), within the collection of uri (or all).
+
+        :param service: Optional, name of service, None for every service
+        :param uri: Optional, service URI, its first (after any version) path
+                    element names the collection
+        """
+        collection = None
+        if uri is not None:
+            elements = uri.split('?', 1)[0].strip('/').split('/')
+            while len(elements) > 1 and re.match(r'v[0-9.]+$', elements[0]):
+                elements = elements[1:]
+            collection = uri[:uri.index(elements[0]) + len(elements[0])]
+        with self._cache_lock:
+            for key in list(self.response_cache):
+                if service is not None and key[0] != service:
+                    continue
+                if collection is not None and not key[1].startswith(collection):
+                    continue
+                del self.response_cache[key]
+
     def compute_request(self, uri, unwrap=None, method='get', post_json=None):
         """
         Short-hand for ``service_request('compute', uri, unwrap, method, post_json)``
@@ -335,39 +510,73 @@ class OpenstackREST(Singleton):
                      if key in child]
             return found
 
-    def server_list(self, key='name'):
+    def server_list(self, key='name', name=None, uuid=None):
         """
         Cache list of servers and return list of values for key
 
         :param key: key to list values for (e.g. 'id')
+        :param name: Optional, only list servers with this name (see ``servers()``)
+        :param uuid: Optional, only list server with this ID (see ``servers()``)
         :returns: List of values for key
         """
-        self.compute_request('/servers', 'servers')
+        if name or uuid:
+            self.servers(name=name, uuid=uuid)
+        else:
+            self.compute_request('/servers', 'servers')
         try:
             return self.child_search(key)
         except IndexError:
             return []
 
-    def server(self, name=None, uuid=None):
+    def servers(self, name=None, uuid=None):
         """
-        Cache and return details about server name or uuid
+        Cache and return list of details about servers with name, or ID uuid
+
+        Filtering is done by the API, so the cost doesn't depend on the number of
+        servers in the tenant.
 
         :param name: Optional, exclusive of uuid, name of server
         :param uuid: Optional, exclusive of name, ID of server
-        :returns: dictionary of server details
+        :returns: List of server details dictionaries, empty if none were found
         """
         self.raise_if(not name and not uuid,
                       ValueError,
                       "Must provide either name or uuid")
-        if name:
-            self.compute_request('/servers', 'servers')
-            server_details = self.child_search(key='name', value=name)
-            uri = '/servers/%s' % server_details['id']
-        elif uuid:
-            uri = '/servers/%s' % uuid
-        return self.compute_request(uri, unwrap='server')
+        if uuid:
+            try:
+                self.response_json = [self.compute_request('/servers/%s' % uuid, 'server')]
+            except ValueError:
+                if self.response_code != 404:
+                    raise
+                self.response_json = []
+            return self.response_json
+        # The name filter is a regular expression
+        pattern = '^%s$' % re.sub(r'([.^$*+?{}\[\]\\|()])', r'\\\1', name)
+        found = self.compute_request('/servers/detail?name=%s' % quote(pattern, safe=''),
+                                     'servers')
+        self.response_json = [details for details in found if details.get('name') == name]
+        return self.response_json
 
-    def server_ip(self, name=None, uuid=None, net_name=None, net_type='floating'):
+    def server(self, name=None, uuid=None):
+        """
+        Cache and return details about server name or uuid
+
+        :param name: Optional, exclusive of uuid, name of server
+        :param uuid: Optional, exclusive of name, ID of server
+        :returns: dictionary of server details
+        :raises IndexError: No server found with name
+        :raises ValueError: No server found with uuid
+        """
+        found = self.servers(name=name, uuid=uuid)
+        if uuid:
+            self.raise_if(not found, ValueError, "No server with ID %s" % uuid)
+        else:
+            self.raise_if(not found, IndexError, "No server named %s" % name)
+        self.response_json = found[0]
+        return self.response_json
+
+    def server_ip(self, name=None, uuid=None, net_name=None, net_type='floating',
+                  server_details=None):
         """
         Cache details about server, return ip address of server
 
@@ -375,11 +584,13 @@ class OpenstackREST(Singleton):
         :param uuid: Optional, exclusive of name, ID of server
         :param net_name: Optional, name of network or None for first-found
         :param net_type: Type of interface to return (e.g. 'fixed')
+        :param server_details: Optional, details from ``servers()``, instead of name/uuid
         :returns: IPv4 address for server or None if none are assigned
         :raises RuntimeError: Server does not exist
         """
         try:
-            server_details = self.server(name=name, uuid=uuid)
+            if server_details is None:
+                server_details = self.server(name=name, uuid=uuid)
         except (ValueError, IndexError, KeyError), xcept:  # Very bad, should never happen
             # Assume caller is not catching RuntimeError, so this gets noticed
             self.raise_if(True, RuntimeError,
@@ -404,7 +615,7 @@ class OpenstackREST(Singleton):
         # This can fail for any number of reasons, let caller deal with them
         except Exception, xcept:
             logging.warning("server_delete(%s) raised %s", uuid, xcept)
-        return self.server_list(key='id')
+        return self.server_list(key='id', uuid=uuid)
 
     def floating_ip(self):
         """
@@ -418,12 +629,17 @@ class OpenstackREST(Singleton):
             search_list = self.response_json
             self.raise_if(search_list is None,
                           TypeError, "No requests have been made/cached")
-            found = [child for child in search_list if child.get('status') == 'DOWN']
+            found = [child for child in search_list if self._unassigned(child)]
             self.raise_if(not found, IndexError, 'Could not find available floating IP')
             return self.float_ip_selector(found).get('floating_ip_address')
         except (KeyError, IndexError):
             return None
 
+    @staticmethod
+    def _unassigned(floatingip):
+        # Status lags behind association, port_id does not
+        return floatingip.get('status') == 'DOWN' and not floatingip.get('port_id')
+
     def create_floating_ip(self, net_id):
         """
         Create, and cache details about a new floating ip routed to net_id"""
@@ -433,16 +649,19 @@ class OpenstackREST(Singleton):
                              post_json=dict(floatingip=floatingip))
         return self.response_json['floating_ip_address']
 
-    def attachments(self, name=None, uuid=None):
+    def attachments(self, name=None, uuid=None, server_details=None):
         """
         Cache details about server, return list of attached volume IDs
 
         :param name: Optional, exclusive of uuid, name of server
         :param uuid: Optional, exclusive of name, ID of server
+        :param server_details: Optional, details from ``servers()``, instead of name/uuid
         :returns: List of volume IDs currently attached
         """
         long_key = 'os-extended-volumes:volumes_attached'
-        return self.child_search('id', alt_list=self.server(name, uuid)[long_key])
+        if server_details is None:
+            server_details = self.server(name, uuid)
+        return self.child_search('id', alt_list=server_details[long_key])
 
     def volume_list(self):
         """
@@ -460,12 +679,371 @@ class OpenstackREST(Singleton):
         return self.volume_request('/volumes/%s' % uuid, 'volume')
 
 
+class ServiceSessions(dict):
+    """
+    Map of service names to session clients, each created on first use.
+
+    :param cloud: os-client-config cloud instance
+    :param service_names: Names of services which may be used
+    """
+
+    def __init__(self, cloud, service_names):
+        super(ServiceSessions, self).__init__()
+        self.cloud = cloud
+        self.service_names = service_names
+        self._lock = threading.Lock()  # Threads share sessions
+
+    def __missing__(self, service):
+        if service not in self.service_names:
+            raise KeyError("Service %s not in %s" % (service, self.service_names))
+        with self._lock:
+            if service not in self:
+                logging.debug("Initializing openstack service: %s", service)
+                self[service] = self.cloud.get_session_client(service)
+            return dict.__getitem__(self, service)
+
+
+class AuthStateCache(object):
+    """
+    Keystone token and service catalog, kept in an owner-only file between jobs.
+
+    States are stored by the auth plugin's cache ID, a hash of its credentials,
+    so changed credentials or clouds never receive another's token.
+
+    :param filepath: Path to JSON file of auth states
+    :param stale: Seconds before expiration a cached token is no longer used
+    """
+
+    def __init__(self, filepath=AUTH_STATE_FILENAME, stale=DEFAULT_TIMEOUT):
+        self.filepath = filepath
+        self.stale = stale
+        self.loaded = None
+
+    def states(self):
+        """
+        Return dictionary of cache IDs to auth states, empty if not safely stored
+        """
+        try:
+            with open(self.filepath, 'rb') as states_file:
+                stat = os.fstat(states_file.fileno())
+                if stat.st_uid != os.getuid() or stat.st_mode & 0077:
+                    logging.warning("Ignoring auth state %s, not owner-only", self.filepath)
+                    return {}
+                return json.load(states_file)
+        except (IOError, ValueError):
+            return {}
+
+    def load(self, auth):
+        """
+        Set auth plugin's state from the cache, when found and not about to expire.
+
+        :returns: True if auth will not need to authenticate, False otherwise
+        """
+        try:
+            cache_id = auth.get_cache_id()
+        except AttributeError:  # Not supported by plugin
+            return False
+        state = self.states().get(cache_id) if cache_id else None
+        if state is None:
+            return False
+        auth.set_auth_state(state)
+        if auth.auth_ref is None or auth.auth_ref.will_expire_soon(self.stale):
+            logging.debug("Cached auth state expiring, will re-authenticate")
+            auth.invalidate()
+            return False
+        self.loaded = state
+        logging.debug("Using cached auth state, expires %s", auth.auth_ref.expires)
+        return True
+
+    def save(self, auth):
+        """
+        Store auth plugin's current state, if it authenticated since ``load()``
+        """
+        try:
+            cache_id = auth.get_cache_id()
+            state = auth.get_auth_state()
+        except AttributeError:  # Not supported by plugin
+            return
+        if not cache_id or state is None or state == self.loaded:
+            return
+        states = self.states()
+        states[cache_id] = state
+        temp_filepath = '%s.%d' % (self.filepath, os.getpid())
+        try:
+            # Owner-only from creation, token must never be readable by others
+            temp_fd = os.open(temp_filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+            os.fchmod(temp_fd, 0600)  # Left by a previous process, with its mode
+            with os.fdopen(temp_fd, 'wb') as states_file:
+                json.dump(states, states_file)
+            os.rename(temp_filepath, self.filepath)
+        except (IOError, OSError), xcept:  # Only costs authenticating next time
+            logging.warning("Caching auth state failed: %s", xcept)
+        else:
+            self.loaded = state
+
+
+class ServerPoller(Singleton):
+    """
+    Details of every tracked server, refreshed for all of them by one request per interval.
+
+    Only servers changed since the previous poll are requested, including deleted
+    servers, so the cost depends on tenant activity, not on its size or the number
+    of servers tracked.
+    """
+
+    #: Seconds between polls
+    interval = 2
+
+    #: Seconds the first poll looks back, covering clock differences with the API
+    first_overlap = 300
+
+    #: Intervals after which details not confirmed by a poll are ignored
+    stale_intervals = 2
+
+    #: Number of polls completed
+    polls = 0
+
+    # pylint: disable=W0231
+    def __init__(self):
+        pass
+
+    def __new__init__(self):
+        self._condition = threading.Condition()
+        self._tracked = {}  # uuid: number of trackers
+        self._details = {}  # uuid: details of tracked servers, once seen
+        self._polled = {}  # uuid: time a poll last confirmed its details
+        self._seen = {}  # uuid: name, of every undeleted server seen
+        self._since = None
+        self._thread = None
+
+    def track(self, uuid):
+        """
+        Begin polling details of server uuid, until ``untrack()`` is called as many times.
+        """
+        with self._condition:
+            self._tracked[uuid] = self._tracked.get(uuid, 0) + 1
+            if self._since is None:
+                self._since = time.time() - self.first_overlap
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ServerPoller')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def untrack(self, uuid):
+        """
+        Stop polling details of server uuid, once every tracker is done.
+        """
+        with self._condition:
+            self._tracked[uuid] -= 1
+            if not self._tracked[uuid]:
+                del self._tracked[uuid]
+                self._details.pop(uuid, None)
+                self._polled.pop(uuid, None)
+
+    def details(self, uuid):
+        """
+        Return most recently polled details of tracked server uuid, None if not seen,
+        or polls failed for ``stale_intervals``, so they may be out of date.
+        """
+        with self._condition:
+            if time.time() - self._polled.get(uuid, 0) > self.stale_intervals * self.interval:
+                return None
+            return self._details.get(uuid)
+
+    def named(self, name):
+        """
+        Return IDs of undeleted servers with name, seen by any poll.
+        """
+        with self._condition:
+            return [uuid for uuid, seen_name in self._seen.items() if seen_name == name]
+
+    def wait(self, timeout):
+        """
+        Return when the next poll completes, or timeout seconds pass.
+        """
+        with self._condition:
+            polls = self.polls
+            deadline = time.time() + timeout
+            while self.polls == polls and time.time() < deadline:
+                self._condition.wait(deadline - time.time())
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._tracked:
+                    self._thread = None
+                    return
+            start = time.time()
+            try:
+                self.poll()
+            except Exception, xcept:  # Waiters fall back to their own requests
+                logging.warning("Polling servers failed: %s", xcept)
+            time.sleep(max(0, self.interval - (time.time() - start)))
+
+    def poll(self):
+        """
+        Request details of servers changed since the previous poll, wake waiters.
+        """
+        os_rest = OpenstackREST()
+        since = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self._since))
+        found = os_rest.compute_request('/servers/detail?changes-since=%s' % quote(since),
+                                        'servers')
+        # API's clock, looking back far enough to not miss slow transactions
+        date = parsedate_tz(os_rest.response_obj.headers.get('Date', ''))
+        now = mktime_tz(date) if date else time.time()
+        with self._condition:
+            self._since = now - 2 * self.interval
+            for details in found:
+                if details.get('status') == 'DELETED':
+                    self._seen.pop(details['id'], None)
+                else:
+                    self._seen[details['id']] = details.get('name')
+                if details['id'] in self._tracked:
+                    self._details[details['id']] = details
+            # Details not found are unchanged, so just as current
+            polled = time.time()
+            for uuid in self._details:
+                self._polled[uuid] = polled
+            self.polls += 1
+            self._condition.notify_all()
+
+
+class PollSchedule(object):
+    """
+    ABC for the seconds a TimeoutAction waits before each call to ``am_done()``
+    """
+
+    def delays(self, action):
+        """
+        Return iterator of seconds to wait, starting when action is called.
+
+        :param action: A TimeoutAction instance, its ``sleep`` is the shortest wait
+        """
+        raise NotImplementedError
+
+    def record(self, action, duration):
+        """
+        Note action completed after duration seconds.
+        """
+        pass
+
+
+class FixedSchedule(PollSchedule):
+    """
+    Wait the action's ``sleep`` seconds every time
+    """
+
+    def delays(self, action):
+        while True:
+            yield action.sleep
+
+
+class BackoffSchedule(PollSchedule):
+    """
+    Wait ``factor`` times longer each time, up to ``maximum``, less random ``jitter``
+
+    :param factor: Multiplier of successive waits, starting with action's ``sleep``
+    :param maximum: Longest wait in seconds
+    :param jitter: Fraction of each wait randomly shortened, spreads out concurrent jobs
+    """
+
+    def __init__(self, factor=1.5, maximum=30, jitter=0.5):
+        self.factor = factor
+        self.maximum = maximum
+        self.jitter = jitter
+
+    def delays(self, action):
+        delay = action.sleep
+        while True:
+            yield max(action.sleep * (1 - self.jitter),
+                      delay * random.uniform(1 - self.jitter, 1))
+            delay = min(self.maximum, delay * self.factor)
+
+
+class LearnedSchedule(PollSchedule):
+    """
+    Check at quantiles of the durations recorded for an action, backoff after that
+
+    Durations are kept per TimeoutAction subclass in a JSON file, shared by every
+    job in the workspace.
+
+    :param filepath: JSON file of durations, by action class name
+    :param fallback: PollSchedule used once quantiles are exhausted, or with too few samples
+    """
+
+    #: Fractions of recorded durations finished when checking
+    quantiles = (0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+
+    #: Most recent durations kept per action
+    samples = 50
+
+    #: Fewest durations needed before learning from them
+    minimum = 5
+
+    #: Seconds to wait for other jobs recording, before skipping a duration
+    lock_timeout = 10
+
+    def __init__(self, filepath=DURATIONS_FILENAME, fallback=None):
+        self.filepath = filepath
+        if fallback is None:
+            fallback = BackoffSchedule()
+        self.fallback = fallback
+        self._lock = threading.Lock()
+
+    def durations(self):
+        """
+        Return dictionary of action class names to lists of recorded durations
+        """
+        try:
+            with open(self.filepath, 'rb') as durations_file:
+                return json.load(durations_file)
+        except (IOError, ValueError):
+            return {}
+
+    def delays(self, action):
+        start = time.time()
+        durations = sorted(self.durations().get(action.__class__.__name__, []))
+        if len(durations) >= self.minimum:
+            for quantile in self.quantiles:
+                duration = durations[int(quantile * (len(durations) - 1))]
+                delay = duration - (time.time() - start)
+                if delay >= action.sleep:
+                    yield delay
+        for delay in self.fallback.delays(action):
+            yield delay
+
+    def record(self, action, duration):
+        name = action.__class__.__name__
+        try:
+            with self._lock:  # Threads and other jobs
+                lock = Flock(self.filepath + '.lock')
+                with lock.timeout_acquire_write(self.lock_timeout) as locked:
+                    if locked is None:
+                        logging.warning("Not recording %s duration, timed out locking %s",
+                                        name, self.filepath)
+                        return
+                    durations = self.durations()
+                    recorded = durations.get(name, []) + [round(duration, 2)]
+                    durations[name] = recorded[-self.samples:]
+                    temp_filepath = '%s.%d' % (self.filepath, os.getpid())
+                    with open(temp_filepath, 'wb') as durations_file:
+                        json.dump(durations, durations_file)
+                    os.rename(temp_filepath, self.filepath)
+        except Exception, xcept:  # Only costs future schedules, the action succeeded
+            logging.warning("Recording %s duration failed: %s", name, xcept)
+
+
+# Choices for --schedule, to PollSchedule
+SCHEDULES = dict(fixed=FixedSchedule, backoff=BackoffSchedule, learned=LearnedSchedule)
+
+
 class TimeoutAction(object):
     """
     ABC callable, raises an exception on timeout, or returns non-None value of done()
     """
 
-    sleep = 1  # Sleep time per iteration, avoids busy-waiting.
+    sleep = 1  # Shortest sleep time per iteration, avoids busy-waiting.
+    schedule = FixedSchedule()  # Spacing of iterations
     # N/B: timeout value referenced outside of class (I know I'm lazy)
     timeout = DEFAULT_TIMEOUT  # (seconds)
     time_out_at = None  # absolute
@@ -493,13 +1071,19 @@ class TimeoutAction(object):
         start = time.time()
         if self.time_out_at is None:
             self.time_out_at = start + self.timeout
+        delays = self.schedule.delays(self)
         while result is None:
             if time.time() >= self.time_out_at:
                 raise self.timeout_exception(str(self))
-            time.sleep(self.sleep)
+            self.wait(min(next(delays), max(0, self.timeout_remaining())))
             result = self.am_done(*self._args, **self._dargs)
+        self.schedule.record(self, time.time() - start)
         return result
 
+    def wait(self, delay):
+        """Pause between calls to ``am_done()``"""
+        time.sleep(delay)
+
     def timeout_remaining(self):
         """Return the amount of time in seconds remaining before timeout"""
         if self.time_out_at is None:
@@ -513,7 +1097,29 @@ class TimeoutAction(object):
         raise NotImplementedError
 
 
-class TimeoutDelete(TimeoutAction):
+class TimeoutServerAction(TimeoutAction):
+    """
+    ABC callable like TimeoutAction, with ``server_id`` tracked by ServerPoller meanwhile
+    """
+
+    server_id = None
+
+    def __call__(self):
+        poller = ServerPoller()
+        poller.track(self.server_id)
+        try:
+            return super(TimeoutServerAction, self).__call__()
+        finally:
+            poller.untrack(self.server_id)
+
+    def wait(self, delay):
+        """Pause for delay, then until the server's details are polled again"""
+        poller = ServerPoller()
+        time.sleep(max(0, delay - poller.interval))
+        poller.wait(min(delay, poller.interval))
+
+
+class TimeoutDelete(TimeoutServerAction):
     """
     Helper class to ensure server is deleted within timeout window
 
@@ -526,11 +1132,18 @@ class TimeoutDelete(TimeoutAction):
     def __init__(self, server_id):
         self.os_rest = OpenstackREST()
         self.os_rest.server_delete(uuid=server_id)
+        self.server_id = server_id
         super(TimeoutDelete, self).__init__(server_id)
 
     def am_done(self, server_id):
         """Return remaining ids when server_id not found, None if still present."""
-        server_ids = self.os_rest.server_list(key='id')
+        server_details = ServerPoller().details(server_id)
+        if server_details is None:  # Not polled yet
+            server_ids = self.os_rest.server_list(key='id', uuid=server_id)
+        elif server_details.get('status') == 'DELETED':
+            server_ids = []
+        else:
+            server_ids = [server_id]
         if server_id in server_ids:
             logging.info("    Deleting %s", server_id)
             return None
@@ -539,11 +1152,14 @@ class TimeoutDelete(TimeoutAction):
             return server_ids
 
 
-class TimeoutCreate(TimeoutAction):
+class TimeoutCreate(TimeoutServerAction):
     """Helper class to ensure server creation and state within timeout window"""
 
     sleep = 2  # Creating takes a while
 
+    #: Checks of ServerPoller between searching the API for servers sharing the name
+    name_checks = 5
+
     POWERSTATES = {
         0: 'NOSTATE',
         1: 'RUNNING',
@@ -614,24 +1230,34 @@ class TimeoutCreate(TimeoutAction):
         )
 
         # Immediatly bail out if somehow another server exists with name
-        if self.os_rest.server_list().count(name) > 1:
+        if self.os_rest.server_list(name=name).count(name) > 1:
             raise RuntimeError("More than one server %s found during creation", name)
 
         logging.info("Submitting creation request for %s", name)
         self.os_rest.compute_request('/servers', 'server',
                                      'post', post_json=dict(server=server_json))
         server_id = self.os_rest.response_json['id']
+        self.server_id = server_id
+        self.checks = 0
         super(TimeoutCreate, self).__init__(name, server_id)
 
     def am_done(self, name, server_id):
         """Return server_id if active and powered up, None otherwise"""
-        # Immediatly bail out if somehow another server exists with name
-        if self.os_rest.server_list().count(name) > 1:
+        poller = ServerPoller()
+        # Immediatly bail out if somehow another server exists with name.  The
+        # poller only saw servers changed recently, so the API is searched too.
+        duplicated = len(poller.named(name)) > 1
+        if not duplicated and self.checks % self.name_checks == 0:
+            duplicated = self.os_rest.server_list(name=name).count(name) > 1
+        self.checks += 1
+        if duplicated:
             raise RuntimeError("More than one server %s found during creation", name)
-        try:
-            server_details = self.os_rest.server(uuid=server_id)
-        except ValueError:   # Doesn't exist yet
-            return None
+        server_details = poller.details(server_id)
+        if server_details is None:  # Not polled yet
+            try:
+                server_details = self.os_rest.server(uuid=server_id)
+            except ValueError:   # Doesn't exist yet
+                return None
         vm_state = server_details['OS-EXT-STS:vm_state']
         power_state = self.POWERSTATES.get(server_details['OS-EXT-STS:power_state'],
                                            'UNKNOWN')
@@ -666,24 +1292,30 @@ class TimeoutAssignFloatingIP(TimeoutAction):
 
     def _am_done(self, server_id, net_name, net_id):
         # Assigned IPs can be stolen if two processes issue the assign-action
-        # for the same IP at close to the same time.  This is only
-        # only partly mitigated by locking between processes of this job.
-        # For complete protection, all provisioners, across all jobs should use
-        # a global file-lock, provided for here by --lockdir.  If unspecified
-        # only a job-local lock is used.
+        # for the same IP at close to the same time, and IPs leak when several
+        # find none dis-used, and each creates one.  This is only partly
+        # mitigated by locking the server and network between processes of
+        # this job, while selecting, creating and assigning.  For complete
+        # protection, all provisioners, across all jobs should use global
+        # file-locks, provided for here by --lockdir.  If unspecified only
+        # job-local locks are used.
+        server_lock = 'server_%s' % server_id
         try:
-            with OpenstackLock().timeout_acquire_read(self.timeout_remaining()) as osl:
+            with OpenstackLocks().timeout_acquire_read(self.timeout_remaining(), server_lock):
                 ip_addr = self.os_rest.server_ip(uuid=server_id, net_name=net_name)
                 logging.info("    IP %s assigned", ip_addr)
                 return ip_addr
         except (ValueError, IndexError, KeyError):
-            with OpenstackLock().timeout_acquire_write(self.timeout_remaining()) as osl:
+            with OpenstackLocks().timeout_acquire_write(self.timeout_remaining(), server_lock,
+                                                        'network_%s' % net_id) as osl:
                 if osl is None:
                     raise self.timeout_exception("Timeout acquiring lock")
                 floating_ip = self.os_rest.floating_ip()  # Get dis-used IP
                 if not floating_ip:  # Didn't get one, must create new
+                    OpenstackLocks.renew(osl)
                     logging.info("    creating new floating IP to %s", net_name)
                     floating_ip = self.os_rest.create_floating_ip(net_id)
+                OpenstackLocks.renew(osl)
                 logging.info("    Assigning %s to server id %s",
                              floating_ip, server_id)
                 addfloatingip = dict(address=floating_ip)
@@ -809,13 +1441,14 @@ class TimeoutDeleteVolume(TimeoutAction):
             return None  # try again
 
 
-def discover(name=None, uuid=None, router_name=None, private=False, **dargs):
+def discover(name=None, uuid=None, router_name=None, private=False, stream=None, **dargs):
     """
     Write ansible host_vars to stdout if a VM name exists with a floating IP.
 
     :param name: Name of the VM to search for
     :param uuid: Optional, search by uuid instead of name
     :param router_name: Name of router for address lookup (if more than one)
+    :param stream: Optional, file-like object to write to instead of stdout
     :param dargs: Completely ignored
     :raise RuntimeError: Severe conditions which must result in script exit
     :raise IndexError: No server found with name
@@ -833,21 +1466,23 @@ def discover(name=None, uuid=None, router_name=None, private=False, **dargs):
 
     logging.info("Trying to discover server %s", thing)
 
-    nr_found = os_rest.server_list().count(name)
+    found = os_rest.servers(name=name, uuid=uuid)
+    nr_found = len(found)
     if nr_found == 1:
         if private:
             net_type = 'fixed'
         else:
             net_type = 'floating'
 
-        # Throws exception if neither name or uuid are set
-        ip_addr = os_rest.server_ip(name=name, uuid=uuid,
-                                    net_name=router_name, net_type=net_type)
+        ip_addr = os_rest.server_ip(name=name, uuid=uuid, net_name=router_name,
+                                    net_type=net_type, server_details=found[0])
         if name is None:
-            name = os_rest.response_json['name']  # Cached by server_ip()
+            name = found[0]['name']
         if uuid is None:
-            uuid = os_rest.response_json['id']
-        sys.stdout.write(OUTPUT_FORMAT.format(name=name, uuid=uuid, ip_addr=ip_addr))
+            uuid = found[0]['id']
+        if stream is None:
+            stream = sys.stdout
+        stream.write(OUTPUT_FORMAT.format(name=name, uuid=uuid, ip_addr=ip_addr))
     elif nr_found > 1:
         raise RuntimeError("More than one server %s found", name)
     else:
@@ -891,7 +1526,7 @@ def destroy(name=None, uuid=None, **dargs):
         thing = uuid
     elif name:
         thing = name
-        if os_rest.server_list().count(name) > 1:
+        if os_rest.server_list(name=name).count(name) > 1:
             raise RuntimeError("More than one server %s found", name)
     else:
         raise ValueError("Must pass name and/or uuid to destroy()")
@@ -915,7 +1550,7 @@ def destroy(name=None, uuid=None, **dargs):
 # Arguments come from argparse, listing them all for clarity of intent
 def create(name, pub_key_files, image, flavor,  # pylint: disable=R0913
            private=False, router_name=None, size=None,
-           userdata_filepath=None, **dargs):
+           userdata_filepath=None, stream=None, **dargs):
     """
     Create a new VM with name and authorized_keys containing pub_key_files.
 
@@ -928,6 +1563,7 @@ def create(name, pub_key_files, image, flavor,  # pylint: disable=R0913
     :param size: Optional size (gigabytes) volume to attach to VM
     :param userdata_filepath: Optional full path to YAML file containing userdata and,
                               optional ``{auth_key_lines}`` token (JSON).
+    :param stream: Optional, file-like object to write host_vars to instead of stdout
     :param dargs: Additional parsed arguments, possibly not relevant.
     """
     del dargs  # not used
@@ -954,7 +1590,8 @@ def create(name, pub_key_files, image, flavor,  # pylint: disable=R0913
         if not private:
             logging.info("Attempting to assign floating ip on network %s", router_name)
             TimeoutAssignFloatingIP(server_id, router_name)()
-        discover(name=name, uuid=server_id, router_name=router_name, private=private)
+        discover(name=name, uuid=server_id, router_name=router_name, private=private,
+                 stream=stream)
 
     # Must not leak servers or volumes, original exception will be re-raised
     except Exception, xcept:
@@ -964,6 +1601,113 @@ def create(name, pub_key_files, image, flavor,  # pylint: disable=R0913
         finally:
             raise
 
+
+def _batch_spec(spec):
+    # Copy of one VM of a batch() file, with lists where one string may stand for
+    # them, raising ValueError if a value isn't usable as its create() argument.
+    spec = dict(spec)
+    for key in ('pubkey', 'join_groups'):
+        if isinstance(spec.get(key), basestring):
+            spec[key] = [spec[key]]
+    for key, value in spec.items():
+        if key in ('name', 'image', 'flavor', 'router', 'userdata'):
+            valid = isinstance(value, basestring) and bool(value)
+        elif key in ('pubkey', 'join_groups'):
+            valid = (isinstance(value, list) and (bool(value) or key != 'pubkey')
+                     and all(isinstance(item, basestring) for item in value))
+        elif key == 'private':
+            valid = isinstance(value, bool)
+        elif key == 'size':
+            valid = value is None or (isinstance(value, int) and not isinstance(value, bool)
+                                      and value > 0)
+        else:
+            continue  # Not used
+        if not valid:
+            raise ValueError("Invalid %s %r for VM %s in batch" % (key, value, spec.get('name')))
+    return spec
+
+
+def _batch_one(dargs, spec):
+    # Operate on one VM of batch(), return its host_vars and if it was created, or
+    # the exception raised.
+    vm_dargs = dict(dargs)
+    vm_dargs['name'] = spec['name']
+    for key, darg in BATCH_KEYS.items():
+        if key in spec:
+            vm_dargs[darg] = spec[key]
+    try:
+        if dargs['operation'] == 'destroy':
+            destroy(**vm_dargs)
+            return None, False, None
+        import yaml  # Only available in the virtualenv
+        stream = StringIO()
+        created = False
+        try:
+            discover(stream=stream, **vm_dargs)
+            if dargs['operation'] == 'exclusive':
+                raise RuntimeError("Found existing vm %s, refusing to re-create!"
+                                   % spec['name'])
+        except IndexError:
+            logging.info('Attempting to create new VM %s.', spec['name'])
+            create(stream=stream, **vm_dargs)
+            created = True
+        host_vars = yaml.safe_load(stream.getvalue())
+        host_vars['inventory_hostname'] = spec['name']
+        if 'join_groups' in spec:
+            host_vars['join_groups'] = spec['join_groups']
+        return host_vars, created, None
+    except Exception, xcept:  # Reported after all VMs are done
+        logging.error("VM %s failed: %s", spec['name'], xcept)
+        return None, False, xcept
+
+
+def batch(name, workers=None, **dargs):
+    """
+    Discover/create, or destroy (per operation) every VM listed in YAML file name
+
+    VMs are handled concurrently by a pool of threads, sharing one session.  Unless
+    destroying, a YAML list of host_vars, each with ``inventory_hostname``, is
+    written to stdout.  If any VM fails, those created are destroyed.
+
+    :param name: Path to YAML list of dictionaries, each with the VM ``name``, and
+                 optionally any of ``BATCH_KEYS``, overriding command-line options.
+                 A ``join_groups`` list is passed through to the host_vars.  A
+                 single ``pubkey`` or ``join_groups`` may be given as a string.
+    :param workers: Optional, number of VMs to handle at the same time
+    :param dargs: Parsed command-line arguments, for every VM
+    :raises ValueError: If the file isn't a list of dictionaries with names, or
+                        any ``BATCH_KEYS`` value has the wrong type.
+    :raises RuntimeError: If any VM failed
+    """
+    import yaml  # Only available in the virtualenv
+    with open(name, 'rb') as batch_file:
+        specs = yaml.safe_load(batch_file)
+    if (not isinstance(specs, list)
+            or not all(isinstance(spec, dict) and spec.get('name') for spec in specs)):
+        raise ValueError("Expecting %s to be a YAML list of dictionaries, each with a name"
+                         % name)
+    specs = [_batch_spec(spec) for spec in specs]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(workers or DEFAULT_WORKERS, len(specs)) or 1)
+    try:
+        results = pool.map(partial(_batch_one, dargs), specs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    failed = [spec['name'] for spec, (_, _, xcept) in zip(specs, results)
+              if xcept is not None]
+    if failed:
+        created = [host_vars for host_vars, was_created, _ in results if was_created]
+        for host_vars in created:
+            logging.error("Destroying VM %s created in failed batch",
+                          host_vars['inventory_hostname'])
+            destroy(uuid=host_vars['host_uuid'])
+        raise RuntimeError("Batch operation failed for VMs: %s" % ', '.join(failed))
+    if dargs['operation'] != 'destroy':
+        sys.stdout.write(yaml.safe_dump([host_vars for host_vars, _, _ in results],
+                                        default_flow_style=False, explicit_start=True))
+
+
 def parse_args(argv, operation='help'):
     """
     Examine command line arguments, show usage info if inappropriate for operation
@@ -1019,6 +1763,38 @@ def parse_args(argv, operation='help'):
                         help=('Major operations timeout (default %s) in seconds'
                               ' (Optional).' % DEFAULT_TIMEOUT))
 
+    parser.add_argument('--lock-policy', default=Flock.WRITERS, dest='lock_policy',
+                        choices=Flock.POLICIES,
+                        help=('Order in which waiting lock readers and writers'
+                              ' acquire, "%s" (default), "%s", or first-come'
+                              ' first-served "%s" (Optional).'
+                              % (Flock.WRITERS, Flock.READERS, Flock.FIFO)))
+
+    parser.add_argument('--lock-lease', default=DEFAULT_LOCK_LEASE, dest='lock_lease',
+                        type=float,
+                        help=('Seconds without progress (default %s) before a'
+                              ' lock holder is considered hung, and the'
+                              ' lock is broken, 0 to never break locks (Optional).'
+                              % DEFAULT_LOCK_LEASE))
+
+    parser.add_argument('--schedule', default=DEFAULT_SCHEDULE, choices=sorted(SCHEDULES),
+                        help=('How long to wait between checks for completion of'
+                              ' operations, "fixed" at a constant interval, "backoff"'
+                              ' increasingly far apart, or "learned" around times'
+                              ' recent operations completed (default "%s", Optional).'
+                              % DEFAULT_SCHEDULE))
+
+    parser.add_argument('--batch', '-b', default=False, action='store_true',
+                        help=('Instead of a VM name, NAME is the path to a YAML list'
+                              ' of VMs, each a dictionary with a "name", and optionally'
+                              ' any of %s, to handle concurrently.  Unless destroying,'
+                              ' a YAML list of host_vars is output (Optional).'
+                              % ', '.join(sorted(BATCH_KEYS))))
+
+    parser.add_argument('--workers', '-w', default=DEFAULT_WORKERS, type=int,
+                        help=('With --batch, the number of VMs to handle at the'
+                              ' same time (default %s) (Optional).' % DEFAULT_WORKERS))
+
     parser.add_argument('name',
                         help='The VM name to search for, create, or destroy (required)')
 
@@ -1066,7 +1842,11 @@ def main(argv, dargs, service_sessions):
     :returns: Exit code integer
     """
     random.seed()
-    if dargs['operation'] in ('discover', 'create', 'exclusive'):
+    if dargs.get('batch'):
+        OpenstackREST(service_sessions)
+        logging.info("Handling batch of VMs from %s", dargs['name'])
+        batch(**dargs)
+    elif dargs['operation'] in ('discover', 'create', 'exclusive'):
         logging.info('Attempting to find VM %s.', dargs['name'])
         # The general exception is re-raised on secondary exception
         try:
@@ -1103,16 +1883,19 @@ def api_debug_dump():
     lines = []
     os_rest = OpenstackREST()
     seq_num = 0
-    for response in os_rest.previous_responses + [os_rest.response_obj]:
-        try:
-            lines.append({response.request.method: response.request.url})
-            lines[-1]['response'] = response.json()
-            lines[-1]['status_code'] = response.status_code
-            # These are useful for creating unitest data + debugging unittests
-            lines[-1]['sequence_number'] = seq_num
-            seq_num += 10
-        except (ValueError, AttributeError):
-            pass
+    for summary in os_rest.history():
+        lines.append({summary['method']: summary['url']})
+        if summary['json'] is not None:
+            lines[-1]['response'] = summary['json']
+        else:  # Too long, or not JSON
+            lines[-1]['response'] = summary['body']
+        lines[-1]['truncated'] = summary['truncated']
+        lines[-1]['status_code'] = summary['status_code']
+        lines[-1]['latency'] = summary['latency']
+        lines[-1]['cached'] = summary['cached']
+        # These are useful for creating unitest data + debugging unittests
+        lines[-1]['sequence_number'] = seq_num
+        seq_num += 10
     _basename = os.path.basename(sys.argv[0])
     prefix = _basename.split('.', 1)[0]
     filepath = os.path.join(workspace, '.virtualenv',
@@ -1122,9 +1905,30 @@ def api_debug_dump():
     with open(filepath, 'wb') as debugf:
         simplejson.dump(lines, debugf, indent=2, sort_keys=True)
     logging.info("Recorded all response JSONs into: %s", filepath)
+    logging.info("Response cache: %d hits, %d misses",
+                 os_rest.cache_hits, os_rest.cache_misses)
+
+
+def _pip(pargs, lockfile):
+    # Like subprocess.check_output(), renewing lockfile's lease on each line of
+    # output, so a hung pip doesn't block other jobs for longer than the lease.
+    proc = subprocess.Popen(pargs, close_fds=True, env=os.environ,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        output = []
+        for line in iter(proc.stdout.readline, ''):
+            output.append(line)
+            lockfile.renew()
+        if proc.wait():
+            raise subprocess.CalledProcessError(proc.returncode, pargs, ''.join(output))
+        return ''.join(output)
+    finally:
+        if proc.poll() is None:  # Lease was broken
+            proc.kill()
+            proc.wait()
 
 
-def _pip_upgrade_install(venvdir, requirements, onlybin, nobin):
+def _pip_upgrade_install(venvdir, requirements, onlybin, nobin, lockfile):
     bindir = os.path.join(venvdir, 'bin')
     # Otherwise, quoting and line-length become a big problem
     reqs_path = os.path.join(venvdir, 'requirements.txt')
@@ -1134,9 +1938,7 @@ def _pip_upgrade_install(venvdir, requirements, onlybin, nobin):
     # Need a new-ish version that supports --require-hashes
     pargs = [os.path.join(bindir, 'pip'), 'install',
              '--upgrade', '--force-reinstall']
-    logging.debug(subprocess.check_output(pargs + ['pip>=8.0.2'],
-                                          close_fds=True, env=os.environ,
-                                          stderr=subprocess.STDOUT))
+    logging.debug(_pip(pargs + ['pip>=8.0.2'], lockfile))
     pargs += ['--require-hashes']
     pargs += ['--only-binary', ','.join(onlybin)]
     pargs += ['--no-binary', ','.join(nobin)]
@@ -1146,9 +1948,7 @@ def _pip_upgrade_install(venvdir, requirements, onlybin, nobin):
     for tries in xrange(3):
         logging.info("Installing packages (try %d): %s", tries, ' '.join(pargs))
         try:
-            logging.debug(subprocess.check_output(pargs,
-                                                  close_fds=True, env=os.environ,
-                                                  stderr=subprocess.STDOUT))
+            logging.debug(_pip(pargs, lockfile))
         # last exception will be raised after 3 tries
         except:  # pylint: disable=W0702
             continue
@@ -1187,7 +1987,7 @@ def _activate(namespace, venvdir):
     os.environ['PYTHONHOME'] = os.environ['VIRTUAL_ENV'] = venvdir
 
 
-def _setup(venvdir, requirements, onlybin, nobin):
+def _setup(venvdir, requirements, onlybin, nobin, lockfile):
     try:
         _, pathname, _ = find_module('os_client_config')
     except ImportError:
@@ -1195,10 +1995,10 @@ def _setup(venvdir, requirements, onlybin, nobin):
     if pathname.startswith(venvdir):
         return import_module('os_client_config')
     else:
-        return _pip_upgrade_install(venvdir, requirements, onlybin, nobin)
+        return _pip_upgrade_install(venvdir, requirements, onlybin, nobin, lockfile)
 
 
-def activate_and_setup(namespace, venvdir, requirements, onlybin, nobin):
+def activate_and_setup(namespace, venvdir, requirements, onlybin, nobin, lease=None):
     """
     Create, activate, and install isolated python virtual environment
 
@@ -1208,9 +2008,11 @@ def activate_and_setup(namespace, venvdir, requirements, onlybin, nobin):
     :param onlybin: List of pip packages to only install pre-built binaries or
                     magic item ':all:' wildcard (overriden by ``nobin``)
     :param nobin: List of pip packages to build and install (overrides onlybin)
+    :param lease: Optional, seconds without progress before other jobs break the
+                  workspace lock, renewed on each line of pip output.
     """
     fmt = "Timeout acquiring %s lock"
-    lockfile = Flock()  # Only need a local-workspace lock
+    lockfile = Flock(lease=lease)  # Only need a local-workspace lock
     with lockfile.timeout_acquire_write(TimeoutAction.timeout) as vlock:
         if vlock is None:
             raise RuntimeError(fmt, "write")
@@ -1232,7 +2034,7 @@ def activate_and_setup(namespace, venvdir, requirements, onlybin, nobin):
             with lockfile.timeout_acquire_write(TimeoutAction.timeout) as vlock:
                 if vlock is None:
                     raise RuntimeError(fmt, "read")
-                return _setup(venvdir, requirements, onlybin, nobin)
+                return _setup(venvdir, requirements, onlybin, nobin, lockfile)
 
 
 # N/B: Any/All names used here are in the global scope
@@ -1264,16 +2066,18 @@ if __name__ == '__main__':  # pylint: disable=C0103
 
     # initialize default values for all locks
     TimeoutAction.timeout = _dargs['timeout']  # locks cheat and use this
+    TimeoutAction.schedule = SCHEDULES[_dargs['schedule']]()
     Flock.def_path = workspace
     Flock.def_prefix = WORKSPACE_LOCKFILE_PREFIX
+    Flock.policy = _dargs['lock_policy']  # Don't let readers starve writers
 
-    # initialize global lock singleton
-    if bool(_dargs.get('lockldir')):
-        OpenstackLock(os.path.join(_dargs['lockdir'],
-                                   '%s.lock' % WORKSPACE_LOCKFILE_PREFIX))
+    # initialize global lock singleton, --lockdir may be shared over NFS
+    if bool(_dargs.get('lockdir')):
+        OpenstackLocks(_dargs['lockdir'], '%s_' % WORKSPACE_LOCKFILE_PREFIX,
+                       _dargs['lock_lease'] or None)
     else:
-        OpenstackLock(os.path.join(workspace,
-                                   '%s.lock' % GLOBAL_LOCKFILE_PREFIX))
+        OpenstackLocks(workspace, '%s_' % GLOBAL_LOCKFILE_PREFIX,
+                       _dargs['lock_lease'] or None)
 
     # Allow early debugging/verbose mode
     logger = logging.getLogger()
@@ -1288,7 +2092,8 @@ if __name__ == '__main__':  # pylint: disable=C0103
                                           os.path.join(workspace, '.virtualenv'),
                                           PIP_REQUIREMENTS,
                                           PIP_ONLY_BINARY,
-                                          PIP_NO_BINARY)
+                                          PIP_NO_BINARY,
+                                          _dargs['lock_lease'] or None)
     logging.info("Loaded %s", os.path.dirname(os_client_config.__file__))
     # Shut down the most noisy loggers
     for noisy_logger in ('stevedore.extension',
@@ -1316,13 +2121,14 @@ if __name__ == '__main__':  # pylint: disable=C0103
 
     cloud = osc.get_one_cloud(os_cloud_name)
     del os_cloud_name  # keep global namespace clean
-    service_names = cloud.get_services()
-    logging.debug("Initializing openstack services: %s", service_names)
-    sessions = dict([(svc, cloud.get_session_client(svc))
-                     for svc in service_names])
-    del cloud  # keep global namespace clean
+    # Token and catalog from a previous job, saves authenticating again
+    auth_state_cache = AuthStateCache(stale=_dargs['timeout'])
+    auth_state_cache.load(cloud.get_auth())
+    sessions = ServiceSessions(cloud, cloud.get_services())
     try:
         main(sys.argv, _dargs, sessions)
     finally:
+        auth_state_cache.save(cloud.get_auth())
+        OpenstackLocks().cleanup()
         if _dargs['verbose']:
             api_debug_dump()
@@ -2,17 +2,30 @@
 
 """
 Module of locking-related classes and functions not available in the standard library
+
+With $FLOCK_TELEMETRY set, lock and release events are recorded in a JSON-lines
+file beside each lock file, ``flock.py --report <lockfile>...`` summarizes them.
+Otherwise, running ``flock.py`` benchmarks contention between processes, per
+lock policy (see ``--help``).
 """
 
 import sys
 import os
 import os.path
+import json
 import logging
 import random
+import socket
+import zlib
 from time import time, sleep
 from fcntl import flock, LOCK_UN, LOCK_SH, LOCK_EX, LOCK_NB
-from errno import EACCES, EAGAIN
+from errno import EACCES, EAGAIN, ENOENT, ENOLCK, ESRCH
 from contextlib import contextmanager
+from glob import glob
+try:
+    import asyncio
+except ImportError:  # Python 2
+    asyncio = None
 
 
 random.seed(os.urandom(64))
@@ -22,12 +35,21 @@ class Flock(object):
     """
     A reader/writer lock object, with locking tightly bound to instance scope.
 
-    :Note: This implementation gives reader-lock requests priority over writers.
+    :Note: By default, reader-lock requests have priority over writers, see ``policy``.
     :Ref: https://en.wikipedia.org/wiki/Readers%E2%80%93writer_lock#Priority_policies
 
     :param name: Optional path/filename of lock file.  Safely generated if None.
+    :param policy: Optional, one of ``POLICIES``, instead of the ``policy`` default.
+    :param lease: Optional, seconds, instead of the ``lease`` default.
     """
 
+    #: Lock policies: readers may starve writers, writers may starve readers,
+    #: or first-come first-served (readers arriving together still share).
+    READERS = 'reader'
+    WRITERS = 'writer'
+    FIFO = 'fifo'
+    POLICIES = (READERS, WRITERS, FIFO)
+
     # Internal, do not use
     _lockfile = None
 
@@ -49,7 +71,43 @@ class Flock(object):
     #: When no lock file name is specified, use this suffix
     def_suffix = '.lock'
 
-    def __init__(self, lockfilepath=None):
+    #: Seconds the most recent locking operation waited, None if never attempted
+    wait_time = None
+
+    #: Maximum seconds between retries, when waiting with a timeout or lease
+    max_poll = 0.1
+
+    #: Order of acquiring a lock not already held, one of ``POLICIES``.
+    policy = READERS
+
+    #: When True, context managers append JSON-lines events to ``<lockfile>.jsonl``
+    telemetry = bool(os.environ.get('FLOCK_TELEMETRY'))
+
+    #: Processes holding the lock when the most recent acquisition had to wait
+    contended_by = None
+
+    #: Kernel's table of held and awaited locks
+    proc_locks = '/proc/locks'
+
+    #: Seconds a holder's lease lasts without ``renew()``, None to disable.
+    #: Waiters break the lock when every holder is stale, so it must exceed the
+    #: longest a holder goes between renewals, plus clock differences between hosts.
+    lease = None
+
+    #: Set True when ``renew()`` found another process broke this one's lease
+    broken = None
+
+    # Internal, do not use
+    _leasepath = None
+
+    def __init__(self, lockfilepath=None, policy=None, lease=None):
+        if policy is not None:
+            if policy not in self.POLICIES:
+                raise ValueError("Unknown lock policy %r, expecting one of %s"
+                                 % (policy, self.POLICIES))
+            self.policy = policy
+        if lease is not None:
+            self.lease = float(lease)
         if lockfilepath is None:
             lockfilepath = os.path.join(self.def_path, self.def_prefix + self.def_suffix)
         self._lockfile = open(lockfilepath, 'a+b', 0)  # No truncate existing
@@ -75,13 +133,22 @@ class Flock(object):
         :param op: Bitwise OR of LOCK_SH, LOCK_EX, LOCK_NB
         :returns: File-like object representing data under lock
         """
-        # Allow double-locking by _this_ process only
-        if self._lockfile.closed:
-            # File must remain open for process to continue holding lock
-            self._lockfile = open(self._lockfile.name, 'wb', 0)
-        self.lock_f(self._lockfile, op)
-        self.is_read = bool(op & LOCK_SH)
-        return self._lockfile
+        start = time()
+        self.contended_by = None
+        try:
+            # Allow double-locking by _this_ process only
+            if not self._lockfile.closed:
+                self.lock_f(self._lockfile, op)
+                self.is_read = bool(op & LOCK_SH)
+                return self._lockfile
+            if op & LOCK_NB:
+                lockfile = self._lock_new(op & ~LOCK_NB, start)  # Try once
+                if lockfile is None:
+                    raise IOError(EAGAIN, "Lock %s is held" % self._lockfile.name)
+                return lockfile
+            return self._lock_new(op, None)
+        finally:
+            self.wait_time = time() - start
 
     def lock_timeout(self, timeout, op):
         """
@@ -93,21 +160,330 @@ class Flock(object):
         """
         timeout = float(timeout)
         logging.debug("(Timeing after %0.4f seconds)", timeout)
-        timedout = time() + timeout
-        while time() < timedout:
+        start = time()
+        self.contended_by = None
+        op &= ~LOCK_NB
+        if self._lockfile.closed:
+            lockfile = self._lock_new(op, start + timeout)
+        else:  # Converting, a separate open file would deadlock with this one
+            lockfile = self._lock_backoff(start + timeout, op)
+        self.wait_time = time() - start
+        if lockfile is None:
+            logging.debug("(Timed out)")
+        return lockfile
+
+    def _lock_new(self, op, deadline):
+        # Acquire lock not already held, sleeping between attempts.
+        for wait in self._locking(op, deadline, True):
+            sleep(wait)
+        return None if self._lockfile.closed else self._lockfile
+
+    def _locking(self, op, deadline, blocking):
+        # Generator acquiring lock not already held, in the order given by policy.
+        # It yields seconds to wait before its next attempt (see _waiting()), and
+        # leaves the lock file open in _lockfile if it was acquired.  Closing it
+        # early gives up the place in line, releasing the gate or queue file.
+        if self.policy not in self.POLICIES:
+            raise ValueError("Unknown lock policy %r, expecting one of %s"
+                             % (self.policy, self.POLICIES))
+        gate = queuefile = previous = lockfile = None
+        try:
+            # The READERS policy needs no admission, flock() itself favours readers
+            if self.policy == self.WRITERS:
+                # Everyone passes through a gate, but writers hold it while waiting
+                # (for readers to finish), so no new readers can start.
+                while True:
+                    gate = open(self._lockfile.name + '.gate', 'ab', 0)
+                    for wait in self._waiting(gate, LOCK_EX, deadline, blocking):
+                        yield wait
+                    if gate.closed:
+                        return
+                    if not self._unlinked(gate):
+                        break
+                    self.unlock_f(gate, LOCK_UN)  # Removed by LockManager.cleanup()
+                    gate.close()
+            elif self.policy == self.FIFO:
+                queuefile, previous = self._ticket()
+                if previous is not None:
+                    for wait in self._waiting(previous, LOCK_SH, deadline, blocking):
+                        yield wait
+                    if previous.closed:
+                        return  # Leaving the queue lets the next ticket proceed
+                    self.unlock_f(previous, LOCK_UN)
+                    previous.close()
+            while True:
+                lockfile = open(self._lockfile.name, 'ab', 0)  # No truncate existing
+                for wait in self._waiting(lockfile, op, deadline, blocking):
+                    yield wait
+                if lockfile.closed:
+                    if deadline is not None and deadline <= time():
+                        return
+                    continue  # Broke a stale lease, the lock file was replaced
+                if self._leased(lockfile):
+                    break
+                # Removed while waiting (e.g. LockManager.cleanup()), the lock
+                # is on an orphan nobody else will see, try the new file.
+                self.unlock_f(lockfile, LOCK_UN)
+                lockfile.close()
+            self._lockfile = lockfile  # File must remain open to continue holding lock
+            self.is_read = bool(op & LOCK_SH)
+        finally:
+            # Waits closed early leave files open, closing them removes any lock
+            if lockfile is not None and lockfile is not self._lockfile:
+                lockfile.close()
+            if previous is not None:
+                previous.close()
+            if gate is not None and not gate.closed:
+                self.unlock_f(gate, LOCK_UN)
+                gate.close()
+            if queuefile is not None:
+                self._dequeue(queuefile)
+
+    @staticmethod
+    def _unlinked(lockfile):
+        # True if lockfile's path no longer names the open file
+        try:
+            return os.stat(lockfile.name).st_ino != os.fstat(lockfile.fileno()).st_ino
+        except OSError as xcept:
+            if xcept.errno != ENOENT:
+                raise
+            return True
+
+    def _backoff(self, deadline):
+        # Yield seconds to wait between non-blocking attempts, at random intervals
+        # growing exponentially to max_poll, until deadline (if any) passes.
+        delay = 0.001
+        while True:
+            remaining = None if deadline is None else deadline - time()
+            if remaining is not None and remaining <= 0:
+                return
+            wait = random.uniform(0, delay)
+            yield wait if remaining is None else min(wait, remaining)
+            delay = min(delay * 2, self.max_poll)
+
+    def _waiting(self, lockfile, op, deadline, blocking):
+        # Generator locking private open lockfile, which is left open if locked,
+        # and closed otherwise.  If blocking, it blocks in flock() forever when
+        # deadline is None and there's no lease.  Otherwise it tries non-blocking,
+        # yielding seconds to wait before retrying (see _backoff()), so nothing is
+        # left queued on lockfile after the deadline.  It tries once if that's
+        # passed.  With leases, the holders are checked while waiting, and it stops
+        # if they were stale, and the lock file was replaced.
+        leased = bool(self.lease) and lockfile.name == self._lockfile.name
+        blocking = blocking and deadline is None and not leased
+        checked = None  # When holders were last checked
+        waits = self._backoff(deadline)
+        locked = False
+        try:
+            while True:
+                try:
+                    self.lock_f(lockfile, op | (0 if blocking else LOCK_NB))
+                    locked = True
+                    return
+                except IOError as xcept:
+                    if blocking or xcept.errno not in [EACCES, EAGAIN]:
+                        raise
+                wait = next(waits, None)
+                if wait is None:  # Deadline passed
+                    return
+                now = time()
+                if checked is None and lockfile.name == self._lockfile.name:
+                    self.contended_by = self.holders()
+                if checked is None or (leased and now - checked >= self.lease / 2.0):
+                    checked = now
+                    if leased and self._break_stale(lockfile):
+                        return
+                yield wait
+        finally:
+            if not locked:
+                lockfile.close()
+
+    def _leased(self, lockfile):
+        # Return True if newly locked lockfile is still current, and its lease
+        # (if any) is recorded.
+        if not self.lease:
+            return not self._unlinked(lockfile)
+        self._leasepath = '%s.lease.%s.%d.%x' % (lockfile.name, socket.gethostname(),
+                                                 os.getpid(), id(self))
+        if not self._record_lease(lockfile):
+            self._leasepath = None
+            return False
+        self.broken = False
+        return True
+
+    def _record_lease(self, lockfile):
+        # Write lease on locked lockfile, False if it was broken.  Breakers hold
+        # .break exclusively while checking leases, so they either see this one,
+        # or this sees their replacement.
+        with open(lockfile.name + '.break', 'ab', 0) as breaker:
+            self.lock_f(breaker, LOCK_SH)
+            try:
+                if self._unlinked(lockfile):
+                    return False
+                lease = dict(pid=os.getpid(), host=socket.gethostname(), lease=self.lease,
+                             inode=os.fstat(lockfile.fileno()).st_ino, renewed=time())
+                try:
+                    with open(self._leasepath, 'w') as leasefile:
+                        leasefile.write(json.dumps(lease))
+                except IOError as xcept:
+                    logging.warning("Failed recording lease %s: %s", self._leasepath, xcept)
+                return True
+            finally:
+                self.unlock_f(breaker, LOCK_UN)
+
+    def renew(self):
+        """
+        Extend this process's lease on the held lock, call after making progress.
+
+        Waiters break the lock once a ``lease`` passes without renewal, so a hung
+        holder doesn't block them forever.  Call this before changing anything the
+        lock guards, it's a no-op without a lease.
+
+        :raises IOError: ENOLCK if the lease was broken, the lock is no longer held.
+        """
+        if self._leasepath is None or self._lockfile.closed:
+            return
+        if not self._record_lease(self._lockfile):
+            self.broken = True
+            logging.error("    %d lease on %s was broken, lock no longer held",
+                          os.getpid(), self._lockfile.name)
+            raise IOError(ENOLCK, "Lease on lock %s was broken" % self._lockfile.name)
+
+    def _lease_end(self):
+        if self._leasepath is None:
+            return
+        path = self._leasepath
+        self._leasepath = None
+        try:
+            os.unlink(path)
+        except OSError as xcept:
+            if xcept.errno != ENOENT:
+                raise
+
+    def _leases(self, path):
+        # Leases of holders of path's current lock file, None if it's gone
+        try:
+            inode = os.stat(path).st_ino
+        except OSError as xcept:
+            if xcept.errno != ENOENT:
+                raise
+            return None
+        leases = []
+        for lease_path in glob(path + '.lease.*'):
             try:
-                lockfile = self.lock(op | LOCK_NB)
-                timedout = 0
+                with open(lease_path) as leasefile:
+                    lease = json.loads(leasefile.read())
+            except IOError as xcept:
+                if xcept.errno != ENOENT:
+                    raise
+                continue  # Released
+            except ValueError:  # Being written, holder is alive
+                lease = dict(inode=inode, renewed=time(), pid=None, host=None, lease=0)
+            if lease['inode'] == inode:
+                lease['path'] = lease_path
+                leases.append(lease)
+        return leases
+
+    @staticmethod
+    def _stale(lease):
+        # True if lease's holder stopped renewing it, or is a dead local process
+        if time() - lease['renewed'] > lease['lease']:
+            return True
+        if lease['host'] == socket.gethostname():
+            try:
+                os.kill(lease['pid'], 0)
+            except OSError as xcept:
+                return xcept.errno == ESRCH
+        return False
+
+    def _break_stale(self, lockfile):
+        # Replace lockfile's path if every holder's lease is stale, True if it was.
+        # A separate lock serializes breakers, so a replacement isn't broken again.
+        path = lockfile.name
+        try:
+            leases = self._leases(path)
+            if not leases or not all(self._stale(lease) for lease in leases):
+                return False
+            with open(path + '.break', 'ab', 0) as breaker:
+                self.lock_f(breaker, LOCK_EX)
+                try:
+                    if self._unlinked(lockfile):
+                        return True  # Another waiter broke it
+                    leases = self._leases(path)
+                    if not leases or not all(self._stale(lease) for lease in leases):
+                        return False
+                    logging.warning("    %d breaking lock %s, stale leases of %s",
+                                    os.getpid(), path,
+                                    ', '.join('%s:%s' % (lease['host'], lease['pid'])
+                                              for lease in leases))
+                    os.unlink(path)
+                    for lease in leases:
+                        try:
+                            os.unlink(lease['path'])
+                        except OSError as xcept:
+                            if xcept.errno != ENOENT:
+                                raise
+                    return True
+                finally:
+                    self.unlock_f(breaker, LOCK_UN)
+        except (IOError, OSError) as xcept:
+            logging.warning("Failed checking leases of %s: %s", path, xcept)
+            return False
+
+    def _ticket(self):
+        # Take a numbered ticket, and lock a queue file named by it, returning it
+        # and the previous ticket holder's queue file to wait on (None if they're
+        # done).  The queue file is released after trying the lock, so readers
+        # still share it, but nobody is overtaken.
+        while True:
+            ticketfile = open(self._lockfile.name + '.ticket', 'a+b', 0)
+            self.lock_f(ticketfile, LOCK_EX)  # Only held to read and increment
+            if not self._unlinked(ticketfile):
                 break
-            except IOError, xcept:
+            self.unlock_f(ticketfile, LOCK_UN)  # Removed by LockManager.cleanup()
+            ticketfile.close()
+        with ticketfile:
+            try:
+                ticketfile.seek(0)
+                ticket = int(ticketfile.read() or 0)
+                ticketfile.seek(0)
+                ticketfile.truncate()
+                ticketfile.write(str(ticket + 1).encode('ascii'))
+                queuefile = open('%s.%d' % (self._lockfile.name, ticket), 'ab', 0)
+                self.lock_f(queuefile, LOCK_EX)  # Nobody can have it yet
+            finally:
+                self.unlock_f(ticketfile, LOCK_UN)
+        try:
+            return queuefile, open('%s.%d' % (self._lockfile.name, ticket - 1), 'rb')
+        except IOError as xcept:
+            if xcept.errno != ENOENT:
+                self._dequeue(queuefile)
+                raise
+            return queuefile, None  # Already done
+
+    def _dequeue(self, queuefile):
+        # Leave the queue, letting the next ticket holder proceed
+        try:
+            os.unlink(queuefile.name)  # Before releasing, so late comers don't wait
+        except OSError as xcept:
+            if xcept.errno != ENOENT:
+                raise
+        self.unlock_f(queuefile, LOCK_UN)
+        queuefile.close()
+
+    def _lock_backoff(self, deadline, op):
+        # Retry converting the held lock non-blocking, until deadline (see _backoff())
+        waits = self._backoff(deadline)
+        while True:
+            try:
+                return self.lock(op | LOCK_NB)
+            except IOError as xcept:
                 if xcept.errno not in [EACCES, EAGAIN]:
                     raise
-            # Don't busy wait for fixed times (avoids clashes)
-            sleep(0.01 + (random.randrange(0, 100) / 100))
-        if bool(timedout):
-            logging.debug("(Timed out)")
-            return None
-        return lockfile
+            wait = next(waits, None)
+            if wait is None:
+                return None
+            sleep(wait)
 
     def unlock(self):
         """
@@ -117,6 +493,7 @@ class Flock(object):
         """
         if self._lockfile.closed:
             return  False  # Lock was not held by this process
+        self._lease_end()
         self.unlock_f(self._lockfile, LOCK_UN)
         self._lockfile.close()
         self.is_read = None
@@ -127,15 +504,18 @@ class Flock(object):
         """
         Return True/False if any lock is currently held by this or another process.
         """
-        if self.is_read is None:  # maintained by lock()/unlock()
+        if not self._lockfile.closed:  # maintained by lock()/unlock()
             return True  # Lock is held by this process
-        # If non-blocking lock can be acquired, lock is not held by any process
+        holders = self.holders()
+        if holders is not None:
+            return bool(holders)
+        # No /proc/locks, if non-blocking lock can be acquired, lock is not held
         locked = False
         try:
             logging.debug("Test-acquiring to check locked state...")
             self.lock(LOCK_EX | LOCK_NB)
             locked = False
-        except IOError, xcept:
+        except IOError as xcept:
             if xcept.errno not in [EACCES, EAGAIN]:
                 raise
             locked = True
@@ -144,13 +524,49 @@ class Flock(object):
             logging.debug("...test-acquire complete.")
         return locked
 
+    def holders(self):
+        """
+        Return processes holding the lock, without affecting it, from ``proc_locks``.
+
+        :returns: List of (pid, 'read' or 'write') tuples, or None if unavailable.
+        """
+        try:
+            stat = os.stat(self._lockfile.name)
+            with open(self.proc_locks) as proc_locks:
+                lines = proc_locks.readlines()
+        except (IOError, OSError):
+            return None
+        # e.g. "1: FLOCK  ADVISORY  WRITE 1234 fe:00:13533187 0 EOF"
+        # Waiters are listed as "1: -> FLOCK ...", so don't match.
+        device = '%02x:%02x:%d' % (os.major(stat.st_dev), os.minor(stat.st_dev),
+                                   stat.st_ino)
+        holders = []
+        for fields in (line.split() for line in lines):
+            if len(fields) >= 6 and fields[5] == device:
+                holders.append((int(fields[4]), 'read' if fields[3] == 'READ' else 'write'))
+        return holders
+
+    def _record(self, name, caller, timeout, hold):
+        # Append an event for --report, if enabled
+        if not self.telemetry:
+            return
+        event = dict(time=time(), lock=self._lockfile.name, pid=os.getpid(),
+                     mode=name, caller=caller, timeout=timeout, wait=self.wait_time,
+                     hold=hold, timedout=hold is None, holders=self.contended_by)
+        try:
+            with open(self._lockfile.name + '.jsonl', 'a') as events:
+                events.write(json.dumps(event) + '\n')  # One write, appends are atomic
+        except IOError as xcept:
+            logging.warning("Failed recording lock telemetry: %s", xcept)
+
     @contextmanager
-    def _acquire(self, op, name):
+    def _acquire(self, op, name, caller=None):
         # __enter__
         start = time()
         lockfile = self.lock(op)
+        acquired = time()
         logging.info("    %d acquired %s lock in %0.4fs",
-                     os.getpid(), name, time() - start)
+                     os.getpid(), name, self.wait_time)
         try:
             yield open(lockfile.name, 'rb')
         finally:
@@ -159,6 +575,7 @@ class Flock(object):
             lockfile.close()
             logging.debug("    %d %s lock released, held for %0.4fs",
                           os.getpid(), name, time() - start)
+            self._record(name, caller, None, time() - acquired)
 
     def acquire_read(self):
         """
@@ -166,7 +583,7 @@ class Flock(object):
 
         :returns: Read-only file-like binary-mode object
         """
-        return self._acquire(LOCK_SH, "read")
+        return self._acquire(LOCK_SH, "read", _caller())
 
     def acquire_write(self):
         """
@@ -174,27 +591,31 @@ class Flock(object):
 
         :returns: Read/Write file-like binary-mode object
         """
-        return self._acquire(LOCK_EX, "write")
+        return self._acquire(LOCK_EX, "write", _caller())
 
     @contextmanager
-    def _timeout_acquire(self, timeout, op, name):
+    def _timeout_acquire(self, timeout, op, name, caller=None):
         # __enter__
         start = time()
         lockfile = self.lock_timeout(timeout, op)
-        logging.info("    %d acquired %s lock before timeout, waited %0.4fs",
-                     os.getpid(), name, time() - start)
-        if lockfile:
-            yield open(lockfile.name, 'rb')
-        else:
+        acquired = time()
+        if not lockfile:
             logging.error("    %d timedout acquiring %s lock after %0.4fs",
-                          os.getpid(), name, time() - start)
+                          os.getpid(), name, self.wait_time)
+            self._record(name, caller, timeout, None)
             yield None
-        # __exit__
-        if lockfile:
+            return
+        logging.info("    %d acquired %s lock before timeout, waited %0.4fs",
+                     os.getpid(), name, self.wait_time)
+        try:
+            yield open(lockfile.name, 'rb')
+        finally:
+            # __exit__
             self.unlock()
             lockfile.close()
             logging.debug("    %d %s lock released, held for %0.4fs",
                           os.getpid(), name, time() - start)
+            self._record(name, caller, timeout, time() - acquired)
 
     def timeout_acquire_read(self, timeout):
         """
@@ -202,7 +623,7 @@ class Flock(object):
 
         :returns: Read-only file-like object if successful, None if not.
         """
-        return self._timeout_acquire(timeout, LOCK_SH, "read")
+        return self._timeout_acquire(timeout, LOCK_SH, "read", _caller())
 
     def timeout_acquire_write(self, timeout):
         """
@@ -210,38 +631,413 @@ class Flock(object):
 
         :returns: Read/Write file-like object if successful, None if not.
         """
-        return self._timeout_acquire(timeout, LOCK_EX, "write")
+        return self._timeout_acquire(timeout, LOCK_EX, "write", _caller())
 
+    def acquire_read_async(self, timeout=None):
+        """
+        Asynchronous context manager wrapping a read-lock, within an optional timeout.
 
-def _umpa_lumpa(n):
-    # Don't all try to do locking all at once
-    sleep(1 + float(random.randrange(0, 100) / 100))
-    _flock = Flock('/tmp/doopitydoo.lock')
-    method = random.choice([_flock.acquire_read, _flock.acquire_write])
-    with method():
-        logging.info("    %d(%d) is doing some important work", n, os.getpid())
-        sleep(1 + float(random.randrange(0, 100) / 100))
+        :Note: Python 3 only, see ``async_flock.AsyncAcquire``.
+        :returns: Read-only file-like object if successful, None if not.
+        """
+        return _async_acquire(self, LOCK_SH, "read", timeout, _caller())
+
+    def acquire_write_async(self, timeout=None):
+        """
+        Asynchronous context manager wrapping a write-lock, within an optional timeout.
+
+        :Note: Python 3 only, see ``async_flock.AsyncAcquire``.
+        :returns: Read/Write file-like object if successful, None if not.
+        """
+        return _async_acquire(self, LOCK_EX, "write", timeout, _caller())
+
+
+class LockManager(object):
+    """
+    Reader/writer locks on named resources, sharing a bounded set of lock files.
+
+    Each name hashes onto one of ``stripes`` lock files, so resources don't
+    contend unless they share a stripe, and lock files don't accumulate.  Names
+    are locked in stripe order, so processes locking several can't deadlock.
 
+    :Note: Lock every name needed in one call, a stripe already held by this
+           process deadlocks when acquired again through the same manager.
+
+    :param lockdir: Optional, directory for lock files, ``Flock.def_path`` if None.
+    :param prefix: Optional, lock file name prefix, ``Flock.def_prefix`` if None.
+    :param stripes: Optional, number of lock files, instead of the ``stripes`` default.
+    :param policy: Optional, one of ``Flock.POLICIES``, instead of Flock's default.
+    :param lease: Optional, seconds of each lock's ``Flock.lease``, instead of Flock's default.
+    """
+
+    #: Number of lock files names are spread across
+    stripes = 64
+
+    #: Lock files unused for this many seconds are removed by ``cleanup()``
+    idle_time = 3600
+
+    def __init__(self, lockdir=None, prefix=None, stripes=None, policy=None, lease=None):
+        if lockdir is None:
+            lockdir = Flock.def_path
+        if prefix is None:
+            prefix = Flock.def_prefix
+        if stripes is not None:
+            self.stripes = int(stripes)
+        self.lockdir = lockdir
+        self.prefix = prefix
+        self.policy = policy
+        self.lease = lease
+
+    def __repr__(self):
+        return 'LockManager(%s)' % os.path.join(self.lockdir, self.prefix)
+
+    def stripe(self, name):
+        """
+        Return the stripe number of resource name, the same in every process.
+        """
+        return (zlib.crc32(name.encode('utf-8')) & 0xffffffff) % self.stripes
+
+    def lockfilepath(self, name):
+        """
+        Return the path of the lock file guarding resource name.
+        """
+        return self._stripepath(self.stripe(name))
+
+    def _stripepath(self, stripe):
+        return os.path.join(self.lockdir, '%s%d%s' % (self.prefix, stripe, Flock.def_suffix))
+
+    def flock(self, name):
+        """
+        Return a new Flock instance, guarding resource name.
+        """
+        return Flock(self.lockfilepath(name), self.policy, self.lease)
+
+    @contextmanager
+    def _acquire(self, names, op, name, timeout=None, caller=None):
+        # __enter__
+        stripes = sorted(set(self.stripe(resource) for resource in names))
+        deadline = None if timeout is None else time() + float(timeout)
+        held = []
+        acquired = []
+        try:
+            for stripe in stripes:
+                lock = Flock(self._stripepath(stripe), self.policy, self.lease)
+                if deadline is None:
+                    lock.lock(op)
+                elif lock.lock_timeout(max(0, deadline - time()), op) is None:
+                    logging.error("    %d timedout acquiring %s locks on %s",
+                                  os.getpid(), name, ', '.join(names))
+                    lock._record(name, caller, timeout, None)  # pylint: disable=W0212
+                    break
+                held.append(lock)
+                acquired.append(time())
+                os.utime(lock._lockfile.name, None)  # Mark in use, for cleanup()
+            else:
+                logging.debug("    %d acquired %s locks on %s",
+                              os.getpid(), name, ', '.join(names))
+                yield held
+                return
+            yield None
+        finally:
+            # __exit__
+            for lock, start in reversed(list(zip(held, acquired))):
+                lock.unlock()
+                lock._record(name, caller, timeout, time() - start)  # pylint: disable=W0212
+
+    def acquire_read(self, *names):
+        """
+        Context manager wrapping read-locks on every named resource.
+
+        :returns: List of Flock instances held
+        """
+        return self._acquire(names, LOCK_SH, "read", caller=_caller())
+
+    def acquire_write(self, *names):
+        """
+        Context manager wrapping write-locks on every named resource.
 
-def _make_candy():
+        :returns: List of Flock instances held
+        """
+        return self._acquire(names, LOCK_EX, "write", caller=_caller())
+
+    def timeout_acquire_read(self, timeout, *names):
+        """
+        Context manager wrapping read-locks on every named resource, within a timeout period.
+
+        :returns: List of Flock instances held if successful, None if not.
+        """
+        return self._acquire(names, LOCK_SH, "read", timeout, _caller())
+
+    def timeout_acquire_write(self, timeout, *names):
+        """
+        Context manager wrapping write-locks on every named resource, within a timeout period.
+
+        :returns: List of Flock instances held if successful, None if not.
+        """
+        return self._acquire(names, LOCK_EX, "write", timeout, _caller())
+
+    def cleanup(self, idle_time=None):
+        """
+        Remove stripe lock files nobody has used within idle_time seconds.
+
+        Anyone waiting on a removed file notices once they acquire it, and retries
+        on its replacement.  Lock files with queued FIFO waiters, or with policy
+        files in use, are left alone, as are telemetry files.
+
+        :param idle_time: Optional, seconds, instead of the ``idle_time`` default.
+        :returns: List of lock file paths removed
+        """
+        if idle_time is None:
+            idle_time = self.idle_time
+        removed = []
+        pattern = os.path.join(self.lockdir, '%s[0-9]*%s' % (self.prefix, Flock.def_suffix))
+        for path in glob(pattern):
+            try:
+                if time() - os.stat(path).st_mtime < idle_time:
+                    continue
+                lockfile = open(path, 'ab', 0)
+            except (IOError, OSError) as xcept:
+                if xcept.errno != ENOENT:
+                    raise
+                continue  # Another process cleaned it up
+            try:
+                self._remove_idle(lockfile, idle_time)
+                removed.append(path)
+            except IOError as xcept:
+                if xcept.errno not in [EACCES, EAGAIN, ENOENT]:
+                    raise  # Otherwise it's in use, or gone
+            finally:
+                lockfile.close()
+        if removed:
+            logging.debug("Removed %d idle lock files from %s", len(removed), self.lockdir)
+        return removed
+
+    @staticmethod
+    def _remove_idle(lockfile, idle_time):
+        # Unlink lockfile and its policy files while holding them all, IOError if
+        # in use.  FIFO waiters hold queue files, their tickets must stay numbered.
+        flock(lockfile, LOCK_EX | LOCK_NB)
+        policyfiles = []
+        try:
+            stat = os.fstat(lockfile.fileno())
+            if Flock._unlinked(lockfile) or time() - stat.st_mtime < idle_time:
+                raise IOError(EAGAIN, "Lock %s was used" % lockfile.name)
+            for suffix in ('.gate', '.ticket', '.break'):
+                try:
+                    policyfiles.append(open(lockfile.name + suffix, 'rb'))
+                except IOError as xcept:
+                    if xcept.errno != ENOENT:
+                        raise
+                    continue
+                flock(policyfiles[-1], LOCK_EX | LOCK_NB)
+            if glob(lockfile.name + '.[0-9]*'):
+                raise IOError(EAGAIN, "Lock %s has queued waiters" % lockfile.name)
+            for policyfile in policyfiles:
+                os.unlink(policyfile.name)
+            os.unlink(lockfile.name)
+        finally:
+            for policyfile in policyfiles:
+                policyfile.close()  # Releasing its lock
+            flock(lockfile, LOCK_UN)
+
+
+def _caller(depth=2):
+    # Location of code calling the function calling this one
+    frame = sys._getframe(depth)  # pylint: disable=W0212
+    return '%s:%d %s' % (os.path.basename(frame.f_code.co_filename),
+                         frame.f_lineno, frame.f_code.co_name)
+
+
+def _async_acquire(flock_obj, op, name, timeout, caller):
+    # Python 2 can't parse coroutines, so they're in a module only Python 3 imports
+    if asyncio is None:
+        raise RuntimeError("Asynchronous locking requires asyncio (python 3)")
+    from async_flock import AsyncAcquire  # pylint: disable=C0415
+    return AsyncAcquire(flock_obj, op, name, timeout, caller)
+
+
+def _report(paths):
+    # Summarize telemetry of lock files, or their .jsonl files, in paths
+    stats = {}
+    pid_callers = {}
+    for path in paths:
+        if not path.endswith('.jsonl'):
+            path += '.jsonl'
+        with open(path) as events:
+            for line in events:
+                event = json.loads(line)
+                key = (event['lock'], event['caller'], event['mode'])
+                stat = stats.setdefault(key, dict(wait=[], hold=[], timedout=0, holders={}))
+                stat['wait'].append(event['wait'])
+                if event['timedout']:
+                    stat['timedout'] += 1
+                else:
+                    stat['hold'].append(event['hold'])
+                pid_callers[(event['lock'], event['pid'])] = event['caller']
+                for pid, mode in event['holders'] or []:
+                    holder = (pid, mode)
+                    stat['holders'][holder] = stat['holders'].get(holder, 0) + 1
+    lines = []
+    for (lock, caller, mode), stat in sorted(stats.items()):
+        lines.append('%s %s lock by %s: %d acquired, %d timed out'
+                     % (lock, mode, caller, len(stat['hold']), stat['timedout']))
+        for name in ('wait', 'hold'):
+            lines.append('    %s p50 %0.4fs p95 %0.4fs p99 %0.4fs max %0.4fs'
+                         % (name, _percentile(stat[name], 50), _percentile(stat[name], 95),
+                            _percentile(stat[name], 99), max(stat[name] or [float('nan')])))
+        contenders = sorted(stat['holders'].items(), key=lambda item: -item[1])
+        for (pid, holder_mode), count in contenders[:5]:
+            lines.append('    waited %d times on %s lock of pid %d (%s)'
+                         % (count, holder_mode, pid,
+                            pid_callers.get((lock, pid), 'caller unknown')))
+    return '\n'.join(lines) + '\n'
+
+
+def _percentile(values, percent):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+#: Lock classes the benchmark can compare, by name, each presenting the Flock API
+BACKENDS = dict(file=Flock)
+
+
+def _distribution(spec):
+    # Function returning random seconds, from "fixed:S", "uniform:LOW,HIGH" or "exp:MEAN"
+    kind, _, args = spec.partition(':')
+    try:
+        values = [float(value) for value in args.split(',')]
+    except ValueError:
+        values = []
+    if kind == 'fixed' and len(values) == 1:
+        return lambda: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'exp' and len(values) == 1 and values[0] > 0:
+        return lambda: random.expovariate(1.0 / values[0])
+    raise ValueError("Expecting fixed:SECONDS, uniform:LOW,HIGH or exp:MEAN, not %r" % spec)
+
+
+def _bench_worker(options, policy, write, until, results):
+    # Acquire, hold, think, repeat until the time passes, then report on the queue
+    import resource
+    hold = _distribution(options.hold)
+    think = _distribution(options.think)
+    lock = BACKENDS[options.backend](options.lockfile, policy)
+    if write:
+        method = lock.timeout_acquire_write
+    else:
+        method = lock.timeout_acquire_read
+    waits = []
+    longest = 0.0
+    waiting = 0.0
+    start = resource.getrusage(resource.RUSAGE_SELF)
+    while time() < until:
+        waited = time()
+        with method(max(0, until - time())) as lockfile:
+            waited = time() - waited
+            waiting += waited
+            longest = max(longest, waited)
+            if lockfile is not None:
+                waits.append(lock.wait_time)
+                sleep(max(0, hold()))
+        sleep(max(0, think()))
+    end = resource.getrusage(resource.RUSAGE_SELF)
+    # Holding and thinking sleep, so CPU is (nearly) all spent waiting/locking
+    cpu = end.ru_utime + end.ru_stime - start.ru_utime - start.ru_stime
+    results.put(dict(write=write, waits=waits, longest=longest, waiting=waiting, cpu=cpu))
+
+
+def _benchmark(options, policy):
+    # Run one policy's contention, return lines summarizing it
     import multiprocessing
-    procs = [multiprocessing.Process(target=_umpa_lumpa, args=(n,))
-             for n in xrange(20)]
-    random.shuffle(procs)
+    writers = int(round(options.processes * options.writers))
+    if options.writers and not writers:
+        writers = 1
+    results = multiprocessing.Queue()
+    until = time() + options.seconds
+    procs = [multiprocessing.Process(target=_bench_worker,
+                                     args=(options, policy, n < writers, until, results))
+             for n in range(options.processes)]
     for proc in procs:
         proc.start()
-    random.shuffle(procs)
+    reports = [results.get() for _ in procs]
     for proc in procs:
         proc.join()
-    logging.info("MOARRRSUGARRRRR!")
+    lines = ['%s backend, %s policy: %d processes (%d writing), %0.1fs, hold %s, think %s'
+             % (options.backend, policy, options.processes, writers, options.seconds,
+                options.hold, options.think)]
+    for write, name in ((False, 'read'), (True, 'write')):
+        if not [report for report in reports if report['write'] == write]:
+            continue
+        waits = [wait for report in reports if report['write'] == write
+                 for wait in report['waits']]
+        lines.append('    %5s locks: %6d acquired, %8.1f/s, wait p50 %0.6fs p99 %0.6fs'
+                     ' max %0.6fs' % (name, len(waits), len(waits) / options.seconds,
+                                      _percentile(waits, 50), _percentile(waits, 99),
+                                      max(waits or [float('nan')])))
+    if writers:
+        starved = [report for report in reports if report['write'] and not report['waits']]
+        longest = max(report['longest'] for report in reports if report['write'])
+        lines.append('    writer starvation: longest wait %0.4fs, %d of %d writers never'
+                     ' acquired' % (longest, len(starved), writers))
+    cpu = sum(report['cpu'] for report in reports)
+    waiting = sum(report['waiting'] for report in reports)
+    acquired = sum(len(report['waits']) for report in reports)
+    lines.append('    waiter CPU: %0.3fs over %0.1fs waiting, %0.1fus per acquisition'
+                 % (cpu, waiting, cpu * 1e6 / max(1, acquired)))
+    return lines
+
+
+def _parse_args(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description=('Benchmark lock contention between'
+                                                  ' processes, or summarize telemetry.'))
+    parser.add_argument('--report', nargs='+', metavar='LOCKFILE', default=None,
+                        help=('Summarize events recorded while $FLOCK_TELEMETRY'
+                              ' was set, instead of benchmarking.'))
+    parser.add_argument('--processes', '-p', default=20, type=int,
+                        help='Number of contending processes (default 20).')
+    parser.add_argument('--writers', '-w', default=0.1, type=float,
+                        help='Fraction of processes taking write locks (default 0.1).')
+    parser.add_argument('--hold', default='uniform:0.001,0.02',
+                        help=('Seconds each lock is held: fixed:S, uniform:LOW,HIGH'
+                              ' or exp:MEAN (default uniform:0.001,0.02).'))
+    parser.add_argument('--think', default='uniform:0,0.05',
+                        help=('Seconds between releasing and acquiring, same'
+                              ' forms as --hold (default uniform:0,0.05).'))
+    parser.add_argument('--seconds', '-s', default=5.0, type=float,
+                        help='Duration of each run (default 5).')
+    parser.add_argument('--policy', default=None, choices=Flock.POLICIES,
+                        help='Only benchmark this policy (default all of them).')
+    parser.add_argument('--backend', default='file', choices=sorted(BACKENDS),
+                        help='Lock implementation to benchmark (default file).')
+    parser.add_argument('--lockfile', default='/tmp/doopitydoo.lock',
+                        help='Lock file path (default /tmp/doopitydoo.lock).')
+    options = parser.parse_args(argv)
+    for spec in (options.hold, options.think):
+        try:
+            _distribution(spec)
+        except ValueError as xcept:
+            parser.error(str(xcept))
+    return options
 
 
 if __name__ == '__main__':
+    OPTIONS = _parse_args(sys.argv[1:])
+    if OPTIONS.report:
+        # Summarize events recorded while $FLOCK_TELEMETRY was set
+        sys.stdout.write(_report(OPTIONS.report))
+        sys.exit()
+    # Timeouts at the end of each run are expected
+    logging.getLogger().setLevel(logging.CRITICAL)
     try:
-        LOGGER = logging.getLogger()
-        # Lower to DEBUG for massively detailed output
-        LOGGER.setLevel(logging.DEBUG)
-        logging.info("Charlie?")
-        _make_candy()
+        for _policy in [OPTIONS.policy] if OPTIONS.policy else Flock.POLICIES:
+            sys.stdout.write('\n'.join(_benchmark(OPTIONS, _policy)) + '\n')
     finally:
-        os.unlink('/tmp/doopitydoo.lock')
+        _PATH = BACKENDS[OPTIONS.backend](OPTIONS.lockfile)._lockfile.name  # pylint: disable=W0212
+        for _path in [_PATH] + glob(_PATH + '.*'):
+            if not _path.endswith('.jsonl'):  # Keep telemetry for --report
+                os.unlink(_path)
@@ -9,21 +9,53 @@ into the play or role's 'action_plugins' directory as: 'ic_add.py', 'ic_delete.p
 ic_reset.py', and 'ic_update.py'.  It may also be called directly, with the
 assumption it's execution environment is identical to future ansible-playbook
 commands.  Add/Update input may include a 'join_groups' list, which will be acted upon
-but not stored.  Cache file placement via env. var $WORKSPACE or $ARTIFACTS is also
-possible (see source).
+but not stored.  Similarly a 'ttl' number of seconds, stored as an 'expires_at' time
+(which may also be given directly), after which the host is ignored and eventually
+removed.  Import input is a stream of records like Add input, each also including
+an 'inventory_hostname' key, as JSON-lines or a YAML sequence.  Cache file placement via
+env. var $WORKSPACE or $ARTIFACTS is also possible (see source), as is write
+durability via $INVCACHE_DURABILITY.
+
+Alternatively, symlinked into an 'inventory_plugins' directory, it's read in-process
+by an inventory source file named 'invcache.yml', containing 'plugin: invcache' (and
+optionally 'cachefile: /path/to/file').
+
+One cache may lead replicas on other control nodes over TCP (--lead), each following
+it (--follow) and serving reads locally, while writes are sent to the leader
+(--leader).  All are authenticated by a secret in $INVCACHE_SECRET.
 """
 
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 import argparse
+import atexit
+import binascii
+import bisect
 import errno
+import hashlib
+import hmac
 import json
 import os
+import random
+import socket
+import time
+from collections import deque
 from contextlib import contextmanager
+from itertools import islice
 import fcntl
 import sys
 import tempfile
+import threading
 from copy import deepcopy
+try:
+    import socketserver
+except ImportError:  # Python 2
+    import SocketServer as socketserver
+try:
+    import asyncio
+    import concurrent.futures
+except ImportError:  # Python 2, AsyncInvCache is unavailable
+    asyncio = None
 try:
     import yaml
     try:
@@ -37,6 +69,7 @@ except ImportError:
 from ansible.module_utils.six import iteritems, string_types
 from ansible.module_utils.parsing.convert_bool import boolean
 from ansible.plugins.action import ActionBase
+from ansible.plugins.inventory import BaseInventoryPlugin
 from ansible.utils.vars import isidentifier
 
 USAGE = "\n".join(__doc__.splitlines()[2:])
@@ -45,6 +78,8 @@ class InvCache(object):
     """
     Represents a single-source, on-disk cache of Ansible inventory details
 
+    Instances are shared per cache file, and safe for use by multiple threads.
+
     :param cachefile_basedir: Existing directory path where persistent cache
                               file should live.  If None, ``tempfile.gettempdir()``
                               is used.
@@ -59,56 +94,105 @@ class InvCache(object):
     DEFAULT_CACHE = None
 
     # Private, do not use
-    _singleton = None
+    _instances = {}
+    _instances_lock = threading.Lock()
     _invcache = None
     _filename = None
     _basedir = None
+    _pid = None
+    _lock = None
+    _mode = None
+    _durability = None
+    _dirty = False
+    _synced = 0
+    _dirsynced = False
+    _timer = None
+    _observers = None
+    _verified = None
 
 
     # Special meta-variables for localhost - undeleteable/unoverwritable.
     RESERVED = ('invcachevers', 'invcachefile')
 
-    def __new__(cls, cachefile_basedir=None, cachefile_name=None):
-        if getattr(cls, '_singleton', None) is None:
-            if cachefile_basedir:
-                cls._basedir = cachefile_basedir
-            else:
-                # lookup "/tmp" in case elsewhere
-                cls._basedir = tempfile.gettempdir()
-            if cachefile_name:
-                cls._filename = cachefile_name
+    # Optimistic (compare-and-swap) attempts before falling back to holding the
+    # exclusive lock across an entire read-modify-write cycle.
+    CAS_ATTEMPTS = 5
+
+    # Default number of records to commit at once, by importhosts()
+    IMPORT_CHUNK = 500
+
+    # Write durability: 'none' leaves it to the OS, 'batch' fsync()s at most every
+    # BATCH_INTERVAL seconds and at exit, 'always' fsync()s a new file for every
+    # write, then atomically renames it over the cache file.
+    DURABILITIES = ('none', 'batch', 'always')
+    DURABILITY = 'none'
+    BATCH_INTERVAL = 0.1
+
+    # Hostvar holding time (seconds since epoch) after which host is ignored & removed
+    EXPIRES = 'expires_at'
+
+    # Most expired hosts removed during every write, soonest expiring first
+    GC_LIMIT = 80
 
+    # Hostvars commonly used by query(), indexed by value
+    INDEXED_HOSTVARS = ('cloud_group', 'subject_created', 'collective_created',
+                        'ansible_connection')
+
+    # Suffix of the file beside the cache holding its indexes, maintained by
+    # transaction().  A line of JSON identifying the cache contents they're for,
+    # then another of the indexes, so readers not needing them never parse them.
+    # Contents written by commit() were validated, so matching them is trusted.
+    INDEX_SUFFIX = '.index'
+
+    def __new__(cls, cachefile_basedir=None, cachefile_name=None):
+        self = super(InvCache, cls).__new__(cls)
+        if cachefile_basedir:
+            self._basedir = cachefile_basedir
+        else:
+            # lookup "/tmp" in case elsewhere
+            self._basedir = tempfile.gettempdir()
+        if cachefile_name:
+            self._filename = cachefile_name
+        self.durability = os.environ.get('INVCACHE_DURABILITY', cls.DURABILITY)
+        with cls._instances_lock:
+            try:
+                return cls._instances[self.filepath]  # __init__ runs next
+            except KeyError:
+                cls._instances[self.filepath] = self
+            # Serializes threads using this instance, in addition to flock() between processes
+            self._lock = threading.RLock()
+            self._observers = []
+            # Version stamps of contents known to match their digest
+            self._verified = deque(maxlen=16)
             DEFAULT_CACHE = dict(_meta=dict(hostvars={}))
             for group in cls.DEFAULT_GROUPS:
                 DEFAULT_CACHE[group] = dict(hosts=[], vars={})
             DEFAULT_CACHE['all']['hosts'].append('localhost')
-            self = cls._singleton = super(InvCache, cls).__new__(cls)
             self.DEFAULT_CACHE = DEFAULT_CACHE
             # Provide details into Ansible for reference
-            hostvars = dict(localhost=dict(invcachefile=self._singleton.filepath,
+            hostvars = dict(localhost=dict(invcachefile=self.filepath,
                                            invcachevers=self.VERSION))
             self.DEFAULT_CACHE['_meta']['hostvars'] = hostvars
-        return cls._singleton  # __init__ runs next
+        return self  # __init__ runs next
 
     def __init__(self, cachefile_basedir=None, cachefile_name=None):
         del cachefile_basedir,cachefile_name  # consumed by __new__
-        with self.locked() as inventory:
-            # Validate basic structure
-            for group in inventory:
-                if group == '_meta':
-                    continue
-                for crit_sub_key in ('hosts', 'vars'):
-                    assert crit_sub_key in inventory[group]
-            assert '_meta' in inventory
-            assert 'hostvars' in inventory['_meta']
-            assert 'localhost' in inventory['_meta']['hostvars']
-            for reserved in self.RESERVED:
-                assert reserved in inventory['_meta']['hostvars']['localhost']
-            # Write cache out to file
-            self(inventory)
+        # Only (re)open/create the file, it's validated when read, never written here.
+        with self.flocked(fcntl.LOCK_SH):
+            pass
 
     def __str__(self):
-        return "{0}\n".format(json.dumps(self(), indent=4, separators=(',', ': ')))
+        # Trusted contents with no expired hosts are written out exactly as read
+        with self.flocked(fcntl.LOCK_SH):
+            raw = self._read_raw()
+            header, _ = self._read_index()
+        version = self.stamp(raw)
+        header = self._header(header, version)
+        expires = header.get('expires')
+        if header and (expires is None or expires > time.time()):
+            return raw
+        inventory, _ = self._parse(raw, version, header)
+        return self._dumps(self._unexpired(inventory))
 
     def __call__(self, new_obj=None):
         """
@@ -117,44 +201,163 @@ class InvCache(object):
         :param new_obj: When not None, replaces current cache.
         :returns: Current cache object or dummy
         """
+        with self._lock:
+            return self._call(new_obj)
+
+    def _call(self, new_obj=None):
         if new_obj:
-            try:
-                self.cachefile.seek(0)
-                self.cachefile.truncate()
-            except IOError:
-                pass  # Some file types don't support seek or truncate
-            json.dump(new_obj, self.cachefile, indent=2, sort_keys=True)
-            self.cachefile.write('\n')  # dump leaves this off :(
-            return self()  # N/B: Recursive
+            self._write_raw(self._dumps(new_obj))
+            return self._call()  # N/B: Recursive
         else:
             self.cachefile.seek(0)
             try:
                 loaded_cache = json.load(self.cachefile)
             except ValueError as xcpt:  # Could be empty, unparseable, unwritable
                 try:
-                    loaded_cache = self(deepcopy(self.DEFAULT_CACHE)) # N/B: Recursive
+                    loaded_cache = self._call(deepcopy(self.DEFAULT_CACHE)) # N/B: Recursive
                 except RecursionError:
                     raise ValueError("Error loading or parsing default 'empty' cache"
                                      " after writing to disk: {}".format(str(self.DEFAULT_CACHE)))
             return loaded_cache
 
+    def _read_raw(self):
+        self.cachefile.seek(0)
+        return self.cachefile.read()
+
+    def _write_raw(self, raw):
+        if self._durability == 'always' and self._isfile():
+            self._replace_raw(raw)
+        else:
+            try:
+                self.cachefile.seek(0)
+                self.cachefile.truncate()
+            except IOError:
+                pass  # Some file types don't support seek or truncate
+            self.cachefile.write(raw)
+            self.cachefile.flush()
+        self._written()
+
+    def _isfile(self):
+        try:
+            self.cachefile.fileno()
+        except (AttributeError, ValueError):
+            return False  # Not a real file
+        return True
+
+    def _replace_raw(self, raw):
+        # Write a complete new file, then rename it over the old, so a crash can't
+        # leave a torn cache.  Any lock held on the old file is first taken on the new.
+        old = self.cachefile
+        fd, temppath = tempfile.mkstemp(dir=self._basedir, prefix='.{0}.'.format(self.filename))
+        try:
+            os.fchmod(fd, os.fstat(old.fileno()).st_mode & 0o7777)
+            new = os.fdopen(fd, 'w+')
+            new.write(raw)
+            new.flush()
+            os.fsync(new.fileno())
+            if self._mode is not None:
+                fcntl.flock(new, self._mode)
+            os.rename(temppath, self.filepath)
+        except BaseException:
+            os.unlink(temppath)
+            raise
+        self._invcache = new
+        old.close()
+        self._dirsynced = False  # The rename isn't durable until _fsync()
+
+    @property
+    def durability(self):
+        """Represents the write durability mode, one of ``DURABILITIES``"""
+        return self._durability
+
+    @durability.setter
+    def durability(self, value):
+        if value not in self.DURABILITIES:
+            raise ValueError("Unknown durability '{0}', expecting one of {1}"
+                             "".format(value, self.DURABILITIES))
+        self._durability = value
+
+    def _written(self):
+        # Apply durability mode after every write, self._lock is held.
+        if self._durability == 'always':
+            self._fsync()
+        elif self._durability == 'batch':
+            self._dirty = True
+            delay = self._synced + self.BATCH_INTERVAL - time.time()
+            if delay <= 0:
+                self._fsync()
+            elif self._timer is None:
+                self._timer = threading.Timer(delay, self._sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _sync(self):
+        with self._lock:
+            self._timer = None
+            if self._dirty and self._invcache and not self._invcache.closed:
+                self._fsync()
+
+    @classmethod
+    def _sync_all(cls):
+        # Pending 'batch' writes must not outlive the process
+        with cls._instances_lock:
+            instances = list(cls._instances.values())
+        for instance in instances:
+            instance._sync()
+
+    def _fsync(self):
+        try:
+            fileno = self._invcache.fileno()
+        except (AttributeError, ValueError):
+            return  # Not a real file
+        os.fsync(fileno)
+        if not self._dirsynced:
+            # A newly created file's directory entry isn't durable otherwise
+            dirfd = os.open(self._basedir, os.O_RDONLY)
+            try:
+                os.fsync(dirfd)
+            finally:
+                os.close(dirfd)
+            self._dirsynced = True
+        self._dirty = False
+        self._synced = time.time()
+
+    @staticmethod
+    def _dumps(obj):
+        return "{0}\n".format(json.dumps(obj, indent=2, sort_keys=True))
+
+    @staticmethod
+    def stamp(raw):
+        """Return version stamp string identifying serialized cache contents raw"""
+        if not isinstance(raw, bytes):
+            raw = raw.encode('utf-8')
+        return hashlib.sha1(raw).hexdigest()
+
     @property
     def cachefile(self):
         """Represents the active file backing the cache"""
-        if self._invcache and not self._invcache.closed:
+        # A forked child must not share flock()s with parent through an inherited file
+        if self._invcache and not self._invcache.closed and self._pid == os.getpid():
             return self._invcache
         # Truncate if new, open for r/w otherwise
         self._invcache = open(self.filepath, 'a+')
+        self._pid = os.getpid()
+        self._dirsynced = False
         return self._invcache
 
+    def _replaced(self):
+        # Another process may have reset (unlinked) the file since it was opened
+        try:
+            return (os.fstat(self._invcache.fileno()).st_ino !=
+                    os.stat(self.filepath).st_ino)
+        except OSError as xcept:
+            return xcept.errno == errno.ENOENT
+        except (AttributeError, ValueError):
+            return False  # Not a real file
+
     @property
     def filepath(self):
         """Represents complete path to on-disk cache file"""
-        if self._invcache:  # Might not be open yet
-            if hasattr(self._invcache, 'name'):
-                return self._invcache.name
-            else:
-                return str(self._invcache)
         return os.path.join(self._basedir,
                             self.filename)
 
@@ -162,34 +365,92 @@ class InvCache(object):
     def filename(self):
         """Represents the filename component of the on-disk cache file"""
         if not self._filename:
-            # The script always exists inside a sub-directory of a repository or
-            # playbook with a meaningful name.  Use that as a distinguishing
-            # feature.  More control, comes by way of artifacts_dirpath().
-            script_filename = os.path.basename(os.path.realpath(sys.argv[0]))
-            script_shortname = script_filename.split('.',1)[0]
-            script_dirpath = os.path.dirname(os.path.realpath(sys.argv[0]))
-            script_parent_dirpath = os.path.dirname(script_dirpath)
-            script_parent_dirname = os.path.basename(script_parent_dirpath)
-            # Must be canonical filename for current user and self._basedir for ALL processes
-            self._filename = "{}_{}.json".format(script_parent_dirname, script_shortname)
+            self._filename = self.script_filename(sys.argv[0])
         return self._filename
 
+    @property
+    def indexpath(self):
+        """Represents complete path to on-disk indexes of the cache file"""
+        return self.filepath + self.INDEX_SUFFIX
+
+    @staticmethod
+    def script_filename(script_path):
+        """Return the default cache filename, when running from script_path"""
+        # The script always exists inside a sub-directory of a repository or
+        # playbook with a meaningful name.  Use that as a distinguishing
+        # feature.  More control, comes by way of artifacts_dirpath().
+        script_filename = os.path.basename(os.path.realpath(script_path))
+        script_shortname = script_filename.split('.',1)[0]
+        script_dirpath = os.path.dirname(os.path.realpath(script_path))
+        script_parent_dirpath = os.path.dirname(script_dirpath)
+        script_parent_dirname = os.path.basename(script_parent_dirpath)
+        # Must be canonical filename for current user and self._basedir for ALL processes
+        return "{}_{}.json".format(script_parent_dirname, script_shortname)
+
     @classmethod
-    def reset(cls):
+    def reset(cls, filepath=None):
         """
         Wipe-out current cache state, including on-disk file
+
+        :param filepath: Only reset instance using this cache file, or all if None.
         """
-        if cls._singleton and cls._singleton._invcache:
-            try:
-                cls._singleton._invcache.close()
-            except IOError:
-                pass
+        with cls._instances_lock:
+            if filepath is None:
+                filepaths = list(cls._instances.keys())
+            else:
+                filepaths = [filepath]
+            for _filepath in filepaths:
+                self = cls._instances.pop(_filepath, None)
+                if self is None or not self._invcache:
+                    continue
+                with self._lock:
+                    if self._timer is not None:
+                        self._timer.cancel()
+                        self._timer = None
+                    self._dirty = False  # File is going away
+                    try:
+                        self._invcache.close()
+                    except IOError:
+                        pass
+                    try:
+                        os.unlink(self.filepath)
+                    except IOError:
+                        pass
+                    try:
+                        os.unlink(self.indexpath)
+                    except (IOError, OSError):
+                        pass  # Never written
+                    self._invcache = None
+
+    @contextmanager
+    def flocked(self, mode=fcntl.LOCK_EX):
+        """
+        Context manager holding mode lock on the cache file, without reading it
+
+        :param mode: A value accepted by ``fcntl.flock()``'s ``op`` parameter.
+        :returns: File-like object backing the cache
+        """
+        with self._lock:
+            # Nesting must not release the outer lock, upgrade if needed.
+            outer_mode = self._mode
             try:
-                os.unlink(cls._singleton.filepath)
-            except IOError:
-                pass
-            cls._singleton._invcache = None
-        cls._singleton = None
+                if outer_mode is None:
+                    fcntl.flock(self.cachefile, mode)  # __enter__
+                    while self._replaced():
+                        fcntl.flock(self.cachefile, fcntl.LOCK_UN)
+                        self._invcache.close()  # cachefile reopens it
+                        fcntl.flock(self.cachefile, mode)
+                    self._mode = mode
+                elif outer_mode != mode and mode == fcntl.LOCK_EX:
+                    fcntl.flock(self.cachefile, mode)
+                    self._mode = mode
+                yield self.cachefile
+            finally:
+                if outer_mode is None:
+                    fcntl.flock(self.cachefile, fcntl.LOCK_UN) # __exit__
+                elif outer_mode != self._mode:
+                    fcntl.flock(self.cachefile, outer_mode)
+                self._mode = outer_mode
 
     @contextmanager
     def locked(self, mode=fcntl.LOCK_EX):
@@ -199,11 +460,339 @@ class InvCache(object):
         :param mode: A value accepted by ``fcntl.flock()``'s ``op`` parameter.
         :returns: Standard Ansible inventory dictionary
         """
-        try:
-            fcntl.flock(self.cachefile, mode)  # __enter__
+        with self.flocked(mode):
             yield self()
-        finally:
-            fcntl.flock(self.cachefile, fcntl.LOCK_UN) # __exit__
+
+    def snapshot(self):
+        """
+        Return a private copy of the cache, and it's version stamp.
+
+        Only reading the file happens under a shared lock, parsing does not.
+
+        :returns: Tuple of standard Ansible inventory dictionary and version stamp
+        """
+        inventory, version, _ = self._snapshot()
+        return inventory, version
+
+    def _snapshot(self, indexed=False):
+        # Same as snapshot(), plus a private copy of the indexes if indexed, or None.
+        with self.flocked(fcntl.LOCK_SH):
+            raw = self._read_raw()
+            header, rawindex = self._read_index(indexed)
+        version = self.stamp(raw)
+        header = self._header(header, version)
+        inventory, parsed = self._parse(raw, version, header)
+        if not indexed:
+            return inventory, version, None
+        return inventory, version, self._loadindex(header, rawindex, inventory, parsed)
+
+    def _parse(self, raw, version, header):
+        # Return inventory from raw, validated unless trusted, and if it was parsed
+        try:
+            inventory = json.loads(raw)
+        except ValueError:  # Empty or unparseable, next commit() replaces it
+            return deepcopy(self.DEFAULT_CACHE), False
+        if not header and version not in self._verified:
+            self._validate(inventory)
+            self._verified.append(version)  # Only once per process
+        return inventory, True
+
+    def _read_index(self, indexed=False):
+        # First line of the index file, and the second if indexed, empty if
+        # missing.  The cache file is locked.
+        try:
+            with open(self.indexpath) as indexfile:
+                return indexfile.readline(), indexfile.readline() if indexed else ''
+        except (IOError, OSError):
+            return '', ''
+
+    def _header(self, line, version):
+        # Decoded first line of the index file, if it's for version of the cache,
+        # as written by this version of the code, empty otherwise.
+        try:
+            header = json.loads(line)
+            if header['version'] == version and header['invcachevers'] == self.VERSION:
+                return header
+        except (TypeError, KeyError, ValueError):
+            pass  # Missing, or written by other code
+        return {}
+
+    def _loadindex(self, header, rawindex, inventory, parsed):
+        # Indexes of inventory from rawindex if header is trusted, built otherwise.
+        if header and parsed:
+            try:
+                index = json.loads(rawindex)
+                if index['names'] == list(self.INDEXED_HOSTVARS):
+                    return index
+            except (TypeError, KeyError, ValueError):
+                pass  # Torn by a crash while writing
+        return self._buildindex(inventory)
+
+    def _dumps_index(self, index, version):
+        expiring = index['expiring']
+        header = dict(version=version, invcachevers=self.VERSION,
+                      expires=expiring[0][0] if expiring else None)
+        return "{0}\n{1}\n".format(json.dumps(header), json.dumps(index))
+
+    def _write_index(self, rawindex):
+        # Replace index file with _dumps_index() output, the cache file is locked.
+        try:
+            with open(self.indexpath, 'w') as indexfile:
+                indexfile.write(rawindex)
+        except (IOError, OSError):
+            pass  # Only costs rebuilding them, as long as they're not for version
+
+    def _validate(self, inventory, changed=None):
+        # Raise ValueError if structure is bad, for the changed hosts or all of it.
+        try:
+            localhost = inventory['_meta']['hostvars']['localhost']
+            missing = [reserved for reserved in self.RESERVED if reserved not in localhost]
+        except (KeyError, TypeError):
+            missing = ['_meta', 'hostvars', 'localhost']
+        if missing:
+            raise ValueError("Cache file '{0}' is missing {1}".format(self.filepath, missing))
+        if changed is None:
+            groups = [group for group in inventory if group != '_meta']
+            hostnames = list(inventory['_meta']['hostvars'])
+        else:
+            groups = set()
+            hostnames = []
+            for hostname, hostvars_groups in changed.items():
+                if hostvars_groups is not None:
+                    groups.update(hostvars_groups[1])
+                    hostnames.append(hostname)
+        for group in groups:
+            value = inventory.get(group)
+            if (not isinstance(value, dict) or not isinstance(value.get('hosts'), list)
+                    or not isinstance(value.get('vars'), dict)):
+                raise ValueError("Group '{0}' in cache file '{1}' is not a dictionary of"
+                                 " 'hosts' list and 'vars'".format(group, self.filepath))
+        for hostname in hostnames:
+            if not isinstance(inventory['_meta']['hostvars'].get(hostname), dict):
+                raise ValueError("Hostvars for '{0}' in cache file '{1}' are not a"
+                                 " dictionary".format(hostname, self.filepath))
+
+    def commit(self, inventory, version):
+        """
+        Replace cache with inventory, only if it's still identified by version.
+
+        Serializing happens before the exclusive lock is taken, so it only
+        covers re-reading the file for comparison, and writing it.  Indexes
+        are rebuilt, since changes are unknown, ``transaction()`` avoids that.
+
+        :param inventory: Standard Ansible inventory dictionary to store.
+        :param version: Version stamp returned by ``snapshot()``.
+        :returns: New version stamp, or None if the cache was changed by another writer.
+        """
+        return self._commit(inventory, self._buildindex(inventory), version)
+
+    def _commit(self, inventory, index, version):
+        raw = self._dumps(inventory)
+        new_version = self.stamp(raw)
+        rawindex = self._dumps_index(index, new_version)
+        with self.flocked(fcntl.LOCK_EX):
+            if self.stamp(self._read_raw()) != version:
+                return None
+            self._write_raw(raw)
+            self._write_index(rawindex)
+        self._verified.append(new_version)
+        return new_version
+
+    def transaction(self, mutator, changes=None):
+        """
+        Apply mutator to a private copy of the cache, then commit it, retrying on conflict.
+
+        :param mutator: Callable accepting an inventory dictionary to modify in-place.
+                        Must not modify anything else, it may be called more than once.
+        :param changes: Optional, callable given the committed mutator's return value,
+                        returning a dictionary of every changed hostname, to it's new
+                        (hostvars, groups) tuple, or None if deleted.  Allows updating
+                        indexes incrementally, instead of rebuilding them.
+        :returns: Value returned by the mutator call which was committed
+        """
+        for attempt in range(self.CAS_ATTEMPTS):
+            committed, result = self._attempt(mutator, changes)
+            if committed:
+                return result
+            # Don't all retry at the same instant
+            time.sleep(random.uniform(0, 0.001 * 2 ** attempt))
+        # Heavily contended, guarantee progress by holding the lock throughout
+        with self.flocked(fcntl.LOCK_EX):
+            committed, result = self._attempt(mutator, changes)
+        if not committed:  # Nothing else should be able to write
+            raise RuntimeError("Cache file '{0}' changed while exclusively locked"
+                               "".format(self.filepath))
+        return result
+
+    def _attempt(self, mutator, changes):
+        inventory, version, index = self._snapshot(indexed=True)
+        result = mutator(inventory)
+        if changes is not None:
+            changed = changes(result)
+        else:
+            changed = None  # Unknown, validate and index everything
+        self._validate(inventory, changed)
+        self._reindex(index, inventory, changed)
+        collected = dict.fromkeys(self._collect(inventory, index))
+        self._reindex(index, inventory, collected)
+        if changed is not None:
+            changed.update(collected)
+        new_version = self._commit(inventory, index, version)
+        if new_version is None:
+            return False, None
+        if changed is not None:
+            for observer in self._observers:
+                observer(version, new_version, changed)
+        return True, result
+
+    def observe(self, observer):
+        """
+        Call observer after every transaction committed through this instance
+
+        :param observer: Callable given the former and new version stamps, and
+                         the dictionary of changed hostnames as passed to
+                         ``transaction()``'s ``changes``.
+        """
+        self._observers.append(observer)
+
+    def _expired(self, hostvars, now):
+        try:
+            return float(hostvars[self.EXPIRES]) <= now
+        except (KeyError, TypeError, ValueError):
+            return False  # Never expires
+
+    def _collect(self, inventory, index):
+        # Remove expired hosts, and groups left empty, soonest expiring first by
+        # the index.  Never examines hosts which haven't expired.
+        all_hostvars = inventory['_meta']['hostvars']
+        now = time.time()
+        expired = set()
+        for expires_at, hostname in index['expiring'][:self.GC_LIMIT]:
+            if expires_at > now:
+                break
+            hostvars = all_hostvars.pop(hostname, None)
+            if hostvars is not None and not self._expired(hostvars, now):
+                all_hostvars[hostname] = hostvars
+                index.update(self._buildindex(inventory))  # Wrong, rebuild it
+                break
+            for group in index['hosts'][hostname]['groups']:
+                value = inventory.get(group)
+                if value is None or hostname not in value['hosts']:
+                    continue
+                value['hosts'].remove(hostname)
+                if not value['hosts'] and not value['vars'] and group not in self.DEFAULT_GROUPS:
+                    del inventory[group]
+            expired.add(hostname)
+        return expired
+
+    def _unexpired(self, inventory):
+        # Hide expired hosts from readers, only writes remove them.
+        now = time.time()
+        expired = set(hostname for hostname, hostvars in inventory['_meta']['hostvars'].items()
+                      if self._expired(hostvars, now))
+        if not expired:
+            return inventory
+        for key, value in inventory.items():
+            if key == '_meta':
+                for hostname in expired:
+                    del value['hostvars'][hostname]
+            else:
+                value['hosts'] = [host for host in value.get('hosts', []) if host not in expired]
+        return inventory
+
+    @staticmethod
+    def _index_key(value):
+        # Hostvar values may be unhashable
+        return json.dumps(value, sort_keys=True)
+
+    def _index_add(self, index, hostname, hostvars, groups):
+        keys = dict((name, self._index_key(hostvars[name]))
+                    for name in self.INDEXED_HOSTVARS if name in hostvars)
+        entry = index['hosts'][hostname] = dict(groups=sorted(groups), vars=keys)
+        for name, key in keys.items():
+            index['vars'].setdefault(name, {}).setdefault(key, {})[hostname] = 1
+        try:
+            entry['expires'] = float(hostvars[self.EXPIRES])
+        except (KeyError, TypeError, ValueError):
+            return  # Never expires
+        bisect.insort(index['expiring'], [entry['expires'], hostname])
+
+    def _index_discard(self, index, hostname):
+        entry = index['hosts'].pop(hostname, None)
+        if entry is None:
+            return
+        for name, key in entry['vars'].items():
+            hostnames = index['vars'].get(name, {}).get(key, {})
+            hostnames.pop(hostname, None)
+            if not hostnames:
+                index['vars'].get(name, {}).pop(key, None)
+        if 'expires' in entry:
+            expiring = index['expiring']
+            position = bisect.bisect_left(expiring, [entry['expires'], hostname])
+            if expiring[position:position + 1] == [[entry['expires'], hostname]]:
+                del expiring[position]
+
+    def _buildindex(self, inventory):
+        # Sets of hostnames are dictionaries, JSON has no such thing.  Hosts are
+        # ordered by expiration time, and know their groups, for _collect().
+        index = dict(names=list(self.INDEXED_HOSTVARS), hosts={}, vars={}, expiring=[])
+        host_groups = {}
+        for key, value in inventory.items():
+            if key != '_meta':
+                for hostname in value.get('hosts', []):
+                    host_groups.setdefault(hostname, []).append(key)
+        for hostname, hostvars in inventory['_meta']['hostvars'].items():
+            self._index_add(index, hostname, hostvars, host_groups.get(hostname, []))
+        return index
+
+    def _reindex(self, index, inventory, changed):
+        # Update indexes for hosts changed as passed to transaction(), or all if None.
+        if changed is None:
+            index.update(self._buildindex(inventory))
+        for hostname, hostvars_groups in (changed or {}).items():
+            self._index_discard(index, hostname)
+            if hostvars_groups is not None:
+                self._index_add(index, hostname, *hostvars_groups)
+
+    def query(self, groups=None, equals=None, exists=None):
+        """
+        Return names of hosts matching all group membership and hostvar predicates.
+
+        Indexes are stored beside the cache, updated by every transaction, so
+        matching hosts are found by intersecting indexed sets and group members,
+        without examining the rest of the inventory.
+
+        :param groups: Optional, list of groups all matching hosts are members of.
+        :param equals: Optional, dictionary of hostvar names to values for matching hosts.
+        :param exists: Optional, list of hostvar names all matching hosts define.
+        :returns: Sorted list of matching hostnames
+        """
+        inventory, _, index = self._snapshot(indexed=True)
+        all_hostvars = inventory['_meta']['hostvars']
+        candidates = [inventory[group]['hosts'] if group in inventory and group != '_meta'
+                      else () for group in groups or ()]
+        filters = []
+        for name, value in (equals or {}).items():
+            key = self._index_key(value)
+            if name in self.INDEXED_HOSTVARS:
+                candidates.append(index['vars'].get(name, {}).get(key, {}))
+            else:
+                filters.append(lambda hostvars, name=name, key=key:
+                               name in hostvars and self._index_key(hostvars[name]) == key)
+        for name in exists or ():
+            if name in self.INDEXED_HOSTVARS:
+                candidates.append(set().union(*index['vars'].get(name, {}).values()))
+            else:
+                filters.append(lambda hostvars, name=name: name in hostvars)
+        if candidates:
+            candidates.sort(key=len)  # Smallest first, bounds intersection cost
+            hostnames = set(candidates[0]).intersection(*candidates[1:])
+        else:
+            hostnames = all_hostvars
+        now = time.time()
+        return sorted(hostname for hostname in hostnames
+                      if not self._expired(all_hostvars.get(hostname, {}), now)
+                      and all(_filter(all_hostvars.get(hostname, {})) for _filter in filters))
 
     def gethost(self, hostname):
         """
@@ -212,19 +801,24 @@ class InvCache(object):
         :param hostname: Name of host to retrieve.
         :returns: Tuple containing a dictionary of host variables,
                   and a list of groups.  None if host not
-                  found.
-        """
-        with self.locked(fcntl.LOCK_SH) as inventory:
-            groups = []
-            hostvars = {}
-            for key, value in inventory.items():
-                if key == '_meta':
-                    hostvars = value.get('hostvars', {}).get(hostname, {})
-                else:
-                    hosts = value.get("hosts", [])
-                    if hostname in hosts:
-                        groups.append(key)
-            groups = list(set(groups))
+                  found or expired.
+        """
+        inventory, _ = self.snapshot()
+        return self._gethost(inventory, hostname)
+
+    def _gethost(self, inventory, hostname):
+        groups = []
+        hostvars = {}
+        for key, value in inventory.items():
+            if key == '_meta':
+                hostvars = value.get('hostvars', {}).get(hostname, {})
+            else:
+                hosts = value.get("hosts", [])
+                if hostname in hosts:
+                    groups.append(key)
+        groups = list(set(groups))
+        if self._expired(hostvars, time.time()):
+            return None
         if hostvars != {} or groups != []:
             return (hostvars, groups)
         else:
@@ -239,34 +833,46 @@ class InvCache(object):
         :param groups: A list of groups for the host to join.
         :returns: Tuple containing a dictionary of host variables, and a list of groups.
         """
-        with self.locked(fcntl.LOCK_EX) as inventory:
-            self.delhost(hostname, keep_empty=True)
-            if hostname != 'localhost':
-                if not groups:
-                    groups = self.DEFAULT_GROUPS
-                if not hostvars:
-                    hostvars = {}
-            else: # localhost
-                if not groups:
-                    groups = ["all"]
-                if not hostvars:
-                    hostvars = {}
-                # These must always exist, not be overwritten
-                hostvars.update(self.DEFAULT_CACHE['_meta']['hostvars']['localhost'])
-            meta = inventory.get("_meta", dict(hostvars=dict()))
-            # 'join_groups' treated specially, don't actually add it as a variable
-            groups = list(groups) + list(hostvars.pop('join_groups', [])) + ['all']
-            # Prune any duplicate groups
-            groups = list(set(groups))
-            meta["hostvars"][hostname] = hostvars
-            for group in groups:
-                inv_group = inventory.get(group, dict(hosts=[], vars={}))
-                hosts = set(inv_group.get("hosts", []))
-                hosts.add(hostname)
-                inv_group['hosts'] = list(hosts)
-                inventory[group] = inv_group
-            # Update and write cache to disk
-            self(inventory)
+        return self.transaction(lambda inventory: self._addhost(inventory, hostname,
+                                                                 hostvars, groups),
+                                lambda result: {hostname: result})
+
+    def _normalize(self, hostname, hostvars=None, groups=None):
+        # Never modify caller's objects, this may run more than once.
+        hostvars = deepcopy(hostvars)
+        if hostname != 'localhost':
+            if not groups:
+                groups = self.DEFAULT_GROUPS
+            if not hostvars:
+                hostvars = {}
+        else: # localhost
+            if not groups:
+                groups = ["all"]
+            if not hostvars:
+                hostvars = {}
+            # These must always exist, not be overwritten
+            hostvars.update(self.DEFAULT_CACHE['_meta']['hostvars']['localhost'])
+        # 'join_groups' treated specially, don't actually add it as a variable
+        groups = list(groups) + list(hostvars.pop('join_groups', [])) + ['all']
+        # Likewise 'ttl', but remember when it runs out
+        ttl = hostvars.pop('ttl', None)
+        if ttl is not None and hostname != 'localhost':
+            hostvars[self.EXPIRES] = time.time() + float(ttl)
+        # Prune any duplicate groups
+        groups = list(set(groups))
+        return hostvars, groups
+
+    def _addhost(self, inventory, hostname, hostvars=None, groups=None):
+        self._delete(inventory, hostname)
+        hostvars, groups = self._normalize(hostname, hostvars, groups)
+        meta = inventory.get("_meta", dict(hostvars=dict()))
+        meta["hostvars"][hostname] = hostvars
+        for group in groups:
+            inv_group = inventory.get(group, dict(hosts=[], vars={}))
+            hosts = set(inv_group.get("hosts", []))
+            hosts.add(hostname)
+            inv_group['hosts'] = list(hosts)
+            inventory[group] = inv_group
         return hostvars, groups
 
     def updatehost(self, hostname, hostvars=None, groups=None):
@@ -278,16 +884,20 @@ class InvCache(object):
         :param groups: A list of new groups for the host to belong.
         :returns: Tuple containing a dictionary of host variables, and a list of groups.
         """
-        with self.locked(fcntl.LOCK_EX) as inventory:
-            try:
-                _hostvars, _groups = self.gethost(hostname)
-                if hostvars:
-                    _hostvars.update(hostvars)
-                if groups:
-                    _groups += groups
-                return self.addhost(hostname, _hostvars, _groups)
-            except TypeError:
-                return self.addhost(hostname, hostvars, groups)
+        return self.transaction(lambda inventory: self._updatehost(inventory, hostname,
+                                                                    hostvars, groups),
+                                lambda result: {hostname: result})
+
+    def _updatehost(self, inventory, hostname, hostvars=None, groups=None):
+        try:
+            _hostvars, _groups = deepcopy(self._gethost(inventory, hostname))
+            if hostvars:
+                _hostvars.update(hostvars)
+            if groups:
+                _groups += groups
+            return self._addhost(inventory, hostname, _hostvars, _groups)
+        except TypeError:
+            return self._addhost(inventory, hostname, hostvars, groups)
 
     def _dellocalhost(self, inventory):
         hostvars = {}
@@ -312,13 +922,12 @@ class InvCache(object):
     def _delhost(self, inventory, hostname):
         hostvars = {}
         groups = []
-        for key, value in deepcopy(inventory).items():
+        for key, value in list(inventory.items()):
             inv_item = inventory[key]
             if key == '_meta':
                 if hostname not in value['hostvars']:
                     continue
-                hostvars = deepcopy(inv_item['hostvars'][hostname])
-                del inv_item['hostvars'][hostname]
+                hostvars = inv_item['hostvars'].pop(hostname)
             else:  # Regular group
                 if hostname in value['hosts']:
                     groups.append(key)
@@ -327,7 +936,7 @@ class InvCache(object):
 
     def _prunegroups(self, inventory):
         hosts = set()
-        for key, value in deepcopy(inventory).items():
+        for key, value in list(inventory.items()):
             if key == '_meta':
                 continue
             if not value['hosts'] and not value['vars'] and key not in self.DEFAULT_GROUPS:
@@ -337,6 +946,13 @@ class InvCache(object):
         hosts.remove('localhost')
         return len(hosts)
 
+    def _delete(self, inventory, hostname):
+        if hostname == 'localhost':
+            hostvars, groups = self._dellocalhost(inventory)
+        else:
+            hostvars, groups = self._delhost(inventory, hostname)
+        return hostvars, groups, self._prunegroups(inventory)
+
     def delhost(self, hostname, keep_empty=False):
         """
         Remove hostname from inventory, return tuple of host vars. dict and group list
@@ -346,22 +962,118 @@ class InvCache(object):
         :returns: Tuple containing a former dictionary of host variables, and a list of
                   groups or None
         """
-        host_count = 0
-        with self.locked(fcntl.LOCK_EX) as inventory:
-            if hostname == 'localhost':
-                hostvars, groups = self._dellocalhost(inventory)
-            else:
-                hostvars, groups = self._delhost(inventory, hostname)
-            host_count = self._prunegroups(inventory)
-            # Write out to disk
-            self(inventory)
+        if hostname == 'localhost':  # Never completely deleted
+            remains = (self.DEFAULT_CACHE['_meta']['hostvars']['localhost'], ['all'])
+        else:
+            remains = None
+        hostvars, groups, host_count = self.transaction(
+            lambda inventory: self._delete(inventory, hostname),
+            lambda result: {hostname: remains})
         if not keep_empty and not host_count:
-            self.reset()  # removes file
+            self.reset(self.filepath)  # removes file
         if hostvars != {} or groups != []:
             return (hostvars, groups)
         else:
             return None
 
+    def _importhosts(self, inventory, records):
+        # Same as _addhost() for each record, but group membership is
+        # handled as sets, so cost doesn't grow with size of inventory.
+        localhost_records = []
+        changed = {}
+        meta = inventory.get("_meta", dict(hostvars=dict()))
+        members = dict((key, set(value.get('hosts', [])))
+                       for key, value in inventory.items() if key != '_meta')
+        for hostname, hostvars, groups in records:
+            if hostname == 'localhost':  # Rare and special
+                localhost_records.append((hostname, hostvars, groups))
+                continue
+            hostvars, groups = self._normalize(hostname, hostvars, groups)
+            for hosts in members.values():
+                hosts.discard(hostname)
+            meta["hostvars"][hostname] = hostvars
+            for group in groups:
+                members.setdefault(group, set()).add(hostname)
+            changed[hostname] = (hostvars, groups)
+        for group, hosts in members.items():
+            inv_group = inventory.get(group, dict(hosts=[], vars={}))
+            inv_group['hosts'] = list(hosts)
+            inventory[group] = inv_group
+        self._prunegroups(inventory)
+        for hostname, hostvars, groups in localhost_records:
+            changed[hostname] = self._addhost(inventory, hostname, hostvars, groups)
+        return changed
+
+    def _replicate(self, inventory, changed):
+        # Apply another cache's changes, as passed to a transaction's observers.
+        deleted = [hostname for hostname, hostvars_groups in changed.items()
+                   if hostvars_groups is None]
+        for hostname in deleted:
+            self._delete(inventory, hostname)
+        result = self._importhosts(inventory, [(hostname, hostvars_groups[0], hostvars_groups[1])
+                                               for hostname, hostvars_groups in changed.items()
+                                               if hostvars_groups is not None])
+        result.update(dict.fromkeys(deleted))
+        return result
+
+    def _replace(self, inventory, other):
+        # Become a copy of other cache's inventory, keeping our own reserved hostvars.
+        inventory.clear()
+        inventory.update(other)
+        localhost = inventory['_meta']['hostvars'].setdefault('localhost', {})
+        localhost.update(self.DEFAULT_CACHE['_meta']['hostvars']['localhost'])
+
+    def importhosts(self, records, chunk_size=None):
+        """
+        Add hosts from an iterable of records, overwriting hostvars and all groups.
+
+        :param records: Iterable of (hostname, hostvars, groups) tuples, each
+                        as the parameters to ``addhost()``.  It is consumed and
+                        committed chunk_size records at a time.
+        :param chunk_size: Optional, maximum number of records per commit,
+                           ``IMPORT_CHUNK`` when None.
+        :returns: Number of records imported.
+        """
+        if not chunk_size:
+            chunk_size = self.IMPORT_CHUNK
+        records = iter(records)
+        count = 0
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                return count
+            self.transaction(lambda inventory: self._importhosts(inventory, chunk),
+                             lambda changed: changed)
+            count += len(chunk)
+
+    def exporthosts(self):
+        """
+        Generate an ``importhosts()`` compatible record for every host except localhost.
+
+        Records are made one at a time, so they may be written out as they're made,
+        but the snapshot they're made from is read whole.  Every record names the
+        host's groups, which can't be known without reading all of them, and the
+        standard library has no incremental JSON parser.
+
+        :returns: Generator of dictionaries of host variables, plus the
+                  'inventory_hostname' and 'join_groups' (except 'all') keys.
+        """
+        inventory, _ = self.snapshot()
+        inventory = self._unexpired(inventory)
+        host_groups = {}
+        for key, value in inventory.items():
+            if key in ('_meta', 'all'):
+                continue
+            for hostname in value.get('hosts', []):
+                host_groups.setdefault(hostname, []).append(key)
+        for hostname, hostvars in inventory['_meta']['hostvars'].items():
+            if hostname == 'localhost':
+                continue
+            record = dict(hostvars)
+            record['inventory_hostname'] = hostname
+            record['join_groups'] = sorted(host_groups.get(hostname, []))
+            yield record
+
     @staticmethod
     def make_hostvars(host, connection=None, port=None,
                       user=None, priv_key_file=None,
@@ -384,10 +1096,420 @@ class InvCache(object):
         hostvars, groups = self.gethost(hostname)
         if hostvars == groups == None:
             raise ValueError("Host '{0}' not found in cache file"
-                             " '{1}'".format(hostname, self.cachefile.name))
+                             " '{1}'".format(hostname, self.filepath))
         del groups  # not used
         return "{0}\n".format(json.dumps(hostvars, indent=4, separators=(',', ': ')))
 
+atexit.register(InvCache._sync_all)
+
+
+class AsyncInvCache(object):
+    """
+    Awaitable interface to an InvCache, for use by asyncio coroutines
+
+    Lock waits, parsing and serializing all happen in executor threads, never
+    blocking the event loop.  Every method returns an awaitable future.
+
+    :param invcache: InvCache instance to use.
+    :param executor: Optional ``concurrent.futures.Executor``, or None for the
+                     one shared by all instances (see ``lock_executor()``).
+    """
+
+    # Threads of the shared executor, each mostly blocked waiting on a lock
+    EXECUTOR_WORKERS = 32
+
+    # Private, do not use
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self, invcache, executor=None):
+        if asyncio is None:
+            raise RuntimeError("AsyncInvCache requires asyncio (python 3)")
+        self.invcache = invcache
+        self.executor = self.lock_executor(executor)
+
+    @classmethod
+    def lock_executor(cls, executor=None):
+        """
+        Return executor, or if None, the one shared by all instances.
+
+        Waiting on locks ties up a thread each, so they're kept out of the event
+        loop's default executor, where they'd starve unrelated work.
+        """
+        if executor is not None:
+            return executor
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = concurrent.futures.ThreadPoolExecutor(cls.EXECUTOR_WORKERS)
+            return cls._executor
+
+    @classmethod
+    def open(cls, cachefile_basedir=None, cachefile_name=None, executor=None):
+        """Return future AsyncInvCache, opening the InvCache without blocking"""
+        return cls._run_in(cls.lock_executor(executor),
+                           lambda: cls(InvCache(cachefile_basedir, cachefile_name), executor))
+
+    @staticmethod
+    def _run_in(executor, func, *args):
+        return asyncio.get_event_loop().run_in_executor(executor, func, *args)
+
+    def _run(self, func, *args):
+        return self._run_in(self.executor, func, *args)
+
+    def snapshot(self):
+        """Future of ``InvCache.snapshot()``"""
+        return self._run(self.invcache.snapshot)
+
+    def gethost(self, hostname):
+        """Future of ``InvCache.gethost()``"""
+        return self._run(self.invcache.gethost, hostname)
+
+    def addhost(self, hostname, hostvars=None, groups=None):
+        """Future of ``InvCache.addhost()``"""
+        return self._run(self.invcache.addhost, hostname, hostvars, groups)
+
+    def updatehost(self, hostname, hostvars=None, groups=None):
+        """Future of ``InvCache.updatehost()``"""
+        return self._run(self.invcache.updatehost, hostname, hostvars, groups)
+
+    def delhost(self, hostname, keep_empty=False):
+        """Future of ``InvCache.delhost()``"""
+        return self._run(self.invcache.delhost, hostname, keep_empty)
+
+    def transaction(self, mutator, changes=None):
+        """Future of ``InvCache.transaction()``, mutator runs in the executor"""
+        return self._run(self.invcache.transaction, mutator, changes)
+
+    def query(self, groups=None, equals=None, exists=None):
+        """Future of ``InvCache.query()``"""
+        return self._run(self.invcache.query, groups, equals, exists)
+
+
+def _nonce():
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+def _proof(secret, *nonces):
+    # Shows knowledge of secret, for this exchange of nonces only
+    if not isinstance(secret, bytes):
+        secret = (secret or '').encode('utf-8')
+    return str(hmac.new(secret, ''.join(nonces).encode('ascii'), hashlib.sha256).hexdigest())
+
+
+def _loopback(host):
+    return host in ('localhost', '::1') or host.startswith('127.')
+
+
+class _ReplicationHandler(socketserver.StreamRequestHandler):
+    """Serve one InvCacheLeader client connection, JSON-lines in both directions"""
+
+    def _send(self, message):
+        self.wfile.write("{0}\n".format(json.dumps(message)).encode('utf-8'))
+        self.wfile.flush()
+
+    def _authenticate(self):
+        # Client proves it knows the secret first, then the leader does the same.
+        nonce = _nonce()
+        self._send(dict(nonce=nonce))
+        try:
+            hello = json.loads(self.rfile.readline().decode('utf-8'))
+            proof = _proof(self.server.secret, nonce, hello['nonce'])
+            authentic = hmac.compare_digest(proof, str(hello['proof']))
+        except (ValueError, KeyError, TypeError):
+            authentic = False
+        if not authentic:
+            self._send(dict(error="Authentication failed"))
+            return False
+        self._send(dict(proof=_proof(self.server.secret, hello['nonce'], nonce)))
+        return True
+
+    def handle(self):
+        if not self._authenticate():
+            return
+        for line in iter(self.rfile.readline, b''):
+            request = json.loads(line.decode('utf-8'))
+            if request.get('op') == 'follow':
+                try:
+                    for entry in self.server.entries(request.get('since'),
+                                                     request.get('epoch')):
+                        self._send(entry)
+                except (IOError, OSError):
+                    pass  # Follower went away
+                return
+            try:
+                seq, result = self.server.perform(request.get('op'), request.get('args', []))
+            except Exception as xcept:
+                self._send(dict(error="{0}: {1}".format(xcept.__class__.__name__, xcept)))
+            else:
+                self._send(dict(seq=seq, result=result))
+
+
+class InvCacheLeader(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Apply ordered mutations to an InvCache over TCP, streaming them to followers
+
+    Every write to the cache should arrive this way (e.g. by ``--leader``), or
+    be made through the same instance.  Others are only noticed at the next
+    mutation, and sent to followers as a snapshot.  Sequence numbers count from
+    a random epoch per instance, so followers of a previous one (e.g. before
+    a restart) are also sent a snapshot.
+
+    Trust model: every connection begins with both ends proving knowledge of
+    secret, by HMAC-SHA256 of random challenges.  Anyone who knows it may read
+    and change the whole cache.  Without a secret, only loopback addresses may
+    be used, trusting every local user.  Nothing is encrypted, hostvars (e.g.
+    'ansible_ssh_pass') cross the network in cleartext, and connections aren't
+    protected after authenticating.  Across untrusted networks, listen on
+    loopback and reach it through a tunnel (e.g. ``ssh -L``).
+
+    :param invcache: InvCache instance to lead.
+    :param address: (host, port) tuple to listen on, port 0 chooses any.
+    :param secret: Shared by clients and followers, required unless address is loopback.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # Mutations retained for followers to catch up, before a snapshot is needed
+    LOG_LENGTH = 1000
+
+    # Seconds between messages to waiting followers, so disconnects are noticed
+    HEARTBEAT = 5.0
+
+    # InvCache methods clients may call, and those which mutate
+    OPERATIONS = ('gethost', 'query', 'addhost', 'updatehost', 'delhost')
+    MUTATIONS = ('addhost', 'updatehost', 'delhost')
+
+    def __init__(self, invcache, address=('127.0.0.1', 0), secret=None):
+        if not secret and not _loopback(address[0]):
+            raise ValueError("Leading on non-loopback address {0} requires a secret"
+                             "".format(address[0]))
+        socketserver.TCPServer.__init__(self, address, _ReplicationHandler)
+        self.secret = secret
+        self.invcache = invcache
+        self.epoch = _nonce()
+        self.seq = 0
+        self.log = deque(maxlen=self.LOG_LENGTH)
+        self.changes = threading.Condition()  # Protects seq and log
+        self._mutating = threading.Lock()
+        self._closed = False
+        self._version = invcache.snapshot()[1]
+        invcache.observe(self._observed)
+
+    def _observed(self, version, new_version, changed):
+        with self.changes:
+            if version == self._version:
+                entry = dict(changed=changed)
+                self._version = new_version
+            else:  # Written elsewhere, followers need everything
+                inventory, self._version = self.invcache.snapshot()
+                entry = dict(snapshot=inventory, epoch=self.epoch)
+            self.seq += 1
+            entry['seq'] = self.seq
+            self.log.append(entry)
+            self.changes.notify_all()
+
+    def perform(self, operation, args):
+        """
+        Call InvCache operation with args, in order with all other mutations
+
+        :returns: Tuple of sequence number of last mutation, and operation's result
+        """
+        if operation not in self.OPERATIONS:
+            raise ValueError("Unsupported operation '{0}'".format(operation))
+        if operation not in self.MUTATIONS:
+            result = getattr(self.invcache, operation)(*args)
+        else:
+            with self._mutating:
+                result = getattr(self.invcache, operation)(*args)
+        with self.changes:
+            return self.seq, result
+
+    def entries(self, since=None, epoch=None):
+        """
+        Yield every mutation after sequence number since, until closed
+
+        :param since: Last sequence number a follower applied, or None to start
+                      with a snapshot.
+        :param epoch: The ``epoch`` since counts from, a snapshot is sent first
+                      unless it's this instance's.
+        """
+        if epoch != self.epoch:
+            since = None
+        while True:
+            with self.changes:
+                if since == self.seq and not self._closed:
+                    self.changes.wait(self.HEARTBEAT)
+                if self._closed:
+                    return
+                if since == self.seq:
+                    entries = [dict(seq=since)]  # Heartbeat
+                elif (since is None or since > self.seq or
+                      not self.log or since < self.log[0]['seq'] - 1):
+                    # Changes after seq are idempotent, if already in the snapshot
+                    inventory = self.invcache.snapshot()[0]
+                    entries = [dict(seq=self.seq, snapshot=inventory, epoch=self.epoch)]
+                else:
+                    entries = [entry for entry in self.log if entry['seq'] > since]
+            for entry in entries:
+                yield entry
+            since = entries[-1]['seq']
+
+    def server_close(self):
+        with self.changes:
+            self._closed = True
+            self.changes.notify_all()
+        socketserver.TCPServer.server_close(self)
+
+
+def _connect(address, secret=None):
+    # Mutually authenticated connection to leader at address
+    sock = socket.create_connection(address)
+    stream = sock.makefile('rwb')
+    try:
+        challenge = json.loads(stream.readline().decode('utf-8'))
+        nonce = _nonce()
+        hello = dict(nonce=nonce, proof=_proof(secret, challenge['nonce'], nonce))
+        stream.write("{0}\n".format(json.dumps(hello)).encode('utf-8'))
+        stream.flush()
+        response = json.loads(stream.readline().decode('utf-8'))
+        if 'error' not in response and not hmac.compare_digest(
+                _proof(secret, nonce, challenge['nonce']), str(response.get('proof'))):
+            response = dict(error="Leader did not know the secret")
+    except (ValueError, KeyError, TypeError, AttributeError):
+        response = dict(error="Unexpected handshake")
+    except BaseException:
+        stream.close()
+        sock.close()
+        raise
+    if 'error' in response:
+        stream.close()
+        sock.close()
+        raise ValueError("Authenticating with leader {0} failed: {1}"
+                         "".format(address, response['error']))
+    return sock, stream
+
+
+def leader_request(address, operation, *args, **dargs):
+    """
+    Perform InvCache operation with args, on the InvCacheLeader at address
+
+    :param address: (host, port) tuple of the leader
+    :param secret: Keyword-only, the leader's secret, if any.
+    :returns: The operation's result, as decoded from JSON
+    """
+    secret = dargs.pop('secret', None)
+    if dargs:
+        raise TypeError("Unexpected keyword arguments {0}".format(list(dargs)))
+    sock, stream = _connect(address, secret)
+    try:
+        stream.write("{0}\n".format(json.dumps(dict(op=operation, args=args))).encode('utf-8'))
+        stream.flush()
+        response = json.loads(stream.readline().decode('utf-8'))
+    finally:
+        stream.close()
+        sock.close()
+    if 'error' in response:
+        raise ValueError("Leader {0} failed {1}: {2}".format(address, operation,
+                                                             response['error']))
+    return response['result']
+
+
+class InvCacheFollower(object):
+    """
+    Replicate an InvCacheLeader's cache into a local InvCache, from a thread
+
+    Reads (e.g. ``--list``) are served from the local cache as usual.
+
+    :param invcache: Local InvCache instance to replicate into.
+    :param address: (host, port) tuple of the leader
+    :param secret: The leader's secret, if any.
+    """
+
+    # Maximum seconds between reconnection attempts
+    RECONNECT = 1.0
+
+    def __init__(self, invcache, address, secret=None):
+        self.invcache = invcache
+        self.address = address
+        self.secret = secret
+        self.seq = None
+        self.epoch = None
+        self.applied = threading.Condition()  # Protects seq and epoch
+        self._closed = threading.Event()
+        self._sock = None
+        self.thread = threading.Thread(target=self._run, name='InvCacheFollower')
+        self.thread.daemon = True
+
+    def start(self):
+        """Begin replicating in the background"""
+        self.thread.start()
+
+    def close(self):
+        """Stop replicating, and wait for the thread to exit"""
+        self._closed.set()
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # Unblocks reading
+            except (IOError, OSError):
+                pass
+        self.thread.join()
+
+    def wait(self, seq, timeout=None, epoch=None):
+        """Return True once sequence number seq (of epoch) is applied, False on timeout"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.applied:
+            while (self.seq is None or self.seq < seq
+                   or epoch not in (None, self.epoch)):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.applied.wait(remaining)
+            return True
+
+    def _run(self):
+        attempt = 0
+        while not self._closed.is_set():
+            try:
+                self._follow()
+            except (IOError, OSError, ValueError):
+                pass  # Leader went away, or was never there
+            else:
+                attempt = 0
+            # Don't all reconnect at the same instant
+            self._closed.wait(random.uniform(0, min(self.RECONNECT, 0.01 * 2 ** attempt)))
+            attempt += 1
+
+    def _follow(self):
+        sock, stream = _connect(self.address, self.secret)
+        self._sock = sock
+        try:
+            with self.applied:
+                follow = dict(op='follow', since=self.seq, epoch=self.epoch)
+            stream.write("{0}\n".format(json.dumps(follow)).encode('utf-8'))
+            stream.flush()
+            for line in iter(stream.readline, b''):
+                self.apply(json.loads(line.decode('utf-8')))
+        finally:
+            self._sock = None
+            stream.close()
+            sock.close()
+
+    def apply(self, entry):
+        """Apply one entry received from the leader to the local cache"""
+        if 'snapshot' in entry:
+            self.invcache.transaction(lambda inventory: self.invcache._replace(inventory,
+                                                                               entry['snapshot']))
+        elif 'changed' in entry:
+            self.invcache.transaction(lambda inventory: self.invcache._replicate(inventory,
+                                                                                 entry['changed']),
+                                      lambda changed: changed)
+        with self.applied:
+            self.seq = entry['seq']
+            self.epoch = entry.get('epoch', self.epoch)
+            self.applied.notify_all()
+
 
 def _json_yaml(loader, name):
     sys.stderr.write("Reading {0} from standard input, ctrl-d when finished.\n"
@@ -421,6 +1543,51 @@ def stdin_parse_yaml():
     return _json_yaml(yaml_load, 'yaml')
 
 
+def _record(obj):
+    if not isinstance(obj, dict):
+        raise ValueError("Expecting dictionary of hostvars, got: {0}".format(obj))
+    hostvars = dict(obj)
+    try:
+        hostname = hostvars.pop('inventory_hostname')
+    except KeyError:
+        raise ValueError("Expecting 'inventory_hostname' key in: {0}".format(obj))
+    return (hostname, hostvars, None)
+
+
+def stream_parse_json(stream):
+    """Generate hostname, hostvars dict, and None tuples from JSON-lines records."""
+    for line in stream:
+        if line.strip():
+            yield _record(json.loads(line))
+
+
+def stream_parse_yaml(stream):
+    """Generate hostname, hostvars dict, and None tuples from YAML sequence(s) of records."""
+    # Only the pure-python composer can produce one node at a time
+    loader = yaml.SafeLoader(stream)
+    try:
+        while loader.check_node():  # another document
+            loader.get_event()  # DocumentStart
+            if loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield _record(loader.construct_document(loader.compose_node(None, None)))
+                loader.get_event()
+            else:  # Stream of single-record documents
+                obj = loader.construct_document(loader.compose_node(None, None))
+                if obj is not None:
+                    yield _record(obj)
+            loader.get_event()  # DocumentEnd
+            loader.anchors = {}
+    finally:
+        loader.dispose()
+
+
+def _address(value):
+    host, _, port = value.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+
 def main(argv=None, environ=None):
     if argv is None:  # Makes unittesting easier
         argv = sys.argv
@@ -449,6 +1616,25 @@ def main(argv=None, environ=None):
                        help="Delete <HOSTNAME> from inventory")
     group.add_argument('-r', '--reset', action="store_true", default=False,
                        help="Reset cache, removing persistent cache file.")
+    group.add_argument('-i', '--import', action="store_true", default=False,
+                       dest="import_hosts",
+                       help="Add or overwrite hosts from stream of records on stdin,"
+                            " JSON-lines or YAML (see --format), each with an"
+                            " 'inventory_hostname' key.")
+    group.add_argument('-q', '--query', action="store_true", default=False,
+                       help="Write names of hosts matching all --group and --where"
+                            " predicates to stdout, one per line.")
+    group.add_argument('-e', '--export', action="store_true", default=False,
+                       dest="export_hosts",
+                       help="Write a JSON-lines record for every host to stdout,"
+                            " suitable for --import.")
+    group.add_argument('--lead', default=None, type=_address, metavar="[HOST]:PORT",
+                       help="Until interrupted, accept --leader writes and stream them"
+                            " to --follow replicas on <HOST>:<PORT>.  Unless <HOST> is"
+                            " loopback, requires $INVCACHE_SECRET, shared by all.")
+    group.add_argument('--follow', default=None, type=_address, metavar="[HOST]:PORT",
+                       help="Until interrupted, replicate the --lead cache at"
+                            " <HOST>:<PORT> into this one.")
     # InvCache API optional
     parser.add_argument('-f', '--format', choices=('json', 'yaml'), default='json',
                         metavar="FORMAT",
@@ -456,6 +1642,26 @@ def main(argv=None, environ=None):
                              " for --add or --update <HOSTNAME>.")
     parser.add_argument('-c', '--cache', default=None, metavar="FILEPATH",
                         help="Force use of back-end cache file at <FILEPATH>")
+    parser.add_argument('--leader', default=None, type=_address, metavar="[HOST]:PORT",
+                        help="Send --add, --update, or --delete to the --lead cache"
+                             " at <HOST>:<PORT>, instead of this one.")
+    parser.add_argument('--durability', choices=InvCache.DURABILITIES, default=None,
+                        metavar="MODE",
+                        help="Write durability <MODE>, one of {0} (default from"
+                             " $INVCACHE_DURABILITY, or '{1}')."
+                             "".format(', '.join(InvCache.DURABILITIES),
+                                       InvCache.DURABILITY))
+    parser.add_argument('-g', '--group', action="append", default=[], dest="query_groups",
+                        metavar="GROUP",
+                        help="For --query, hosts must be members of <GROUP>,"
+                             " may be repeated.")
+    parser.add_argument('-w', '--where', action="append", default=[], dest="query_where",
+                        metavar="NAME[=VALUE]",
+                        help="For --query, hosts must define hostvar <NAME>, or"
+                             " have it equal to YAML <VALUE>, may be repeated.")
+    parser.add_argument('--chunk', default=InvCache.IMPORT_CHUNK, type=int, metavar="COUNT",
+                        help="Commit --import records <COUNT> at a time"
+                             " (default {0}).".format(InvCache.IMPORT_CHUNK))
 
     opts = parser.parse_args(args=argv[1:])
     if opts.debug:
@@ -469,11 +1675,24 @@ def main(argv=None, environ=None):
         invcache = InvCache(os.path.dirname(opts.cache), os.path.basename(opts.cache))
     else:
         invcache = InvCache(artifacts_dirpath(environ))
+    if opts.durability:
+        invcache.durability = opts.durability
     debug('Using cache file: {0}'.format(invcache.filepath))
     do_not_break_ansible = lambda: sys.stdout.write('\n{}\n')
     hostvars_groups = None
+    # Authenticates --lead, --leader, and --follow connections
+    secret = environ.get('INVCACHE_SECRET') or None
+    if opts.leader:
+        debug('Writing through leader: {0}:{1}'.format(*opts.leader))
+        write = lambda operation, *args: leader_request(opts.leader, operation, *args,
+                                                        secret=secret)
+    else:
+        write = lambda operation, *args: getattr(invcache, operation)(*args)
 
-    if not opts.host and not opts.list:
+    if opts.import_hosts:
+        debug("Expecting {0} format stream input".format(opts.format))
+        opts.format = globals()['stream_parse_{0}'.format(opts.format)]
+    elif opts.add or opts.update:
         debug("Expecting {0} format input".format(opts.format))
         opts.format = globals()['stdin_parse_{0}'.format(opts.format)]
 
@@ -495,18 +1714,61 @@ def main(argv=None, environ=None):
         hostvars, groups = opts.format()
         debug("Adding host {0} to groups {1} with hostvars {2}"
               "".format(opts.add, groups, hostvars))
-        hostvars_groups = invcache.addhost(opts.add, hostvars, groups)
+        hostvars_groups = write('addhost', opts.add, hostvars, groups)
     elif opts.update:
         hostvars, groups = opts.format()
         debug("Updating host {0} to groups {1} with hostvars {2}"
               "".format(opts.update, groups, hostvars))
-        hostvars_groups = invcache.updatehost(opts.update, hostvars, groups)
+        hostvars_groups = write('updatehost', opts.update, hostvars, groups)
     elif opts.delete:
         debug("Deleting host {0}".format(opts.delete))
-        hostvars_groups = invcache.delhost(opts.delete, False)  # TODO: keep_empty?
+        hostvars_groups = write('delhost', opts.delete, False)  # TODO: keep_empty?
     elif opts.reset:
         debug("Clobbering cache, removing file: {0}".format(invcache.filepath))
-        invcache.reset()
+        invcache.reset(invcache.filepath)
+    elif opts.import_hosts:
+        sys.stderr.write("Reading records from standard input, ctrl-d when finished.\n")
+        sys.stderr.flush()
+        count = invcache.importhosts(opts.format(sys.stdin), opts.chunk)
+        debug("Imported {0} hosts".format(count))
+    elif opts.lead:
+        server = InvCacheLeader(invcache, opts.lead, secret)
+        sys.stderr.write("Leading on {0}:{1}, interrupt to stop.\n"
+                         "".format(*server.server_address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif opts.follow:
+        follower = InvCacheFollower(invcache, opts.follow, secret)
+        sys.stderr.write("Following {0}:{1}, interrupt to stop.\n".format(*opts.follow))
+        follower.start()
+        try:
+            while follower.thread.is_alive():
+                follower.thread.join(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            follower.close()
+    elif opts.query:
+        equals = {}
+        exists = []
+        for predicate in opts.query_where:
+            name, equal, value = predicate.partition('=')
+            if equal:
+                equals[name] = yaml.load(value, Loader=Loader)
+            else:
+                exists.append(name)
+        debug("Querying hosts in groups {0} with hostvars {1} and defining {2}"
+              "".format(opts.query_groups, equals, exists))
+        for hostname in invcache.query(opts.query_groups, equals, exists):
+            sys.stdout.write("{0}\n".format(hostname))
+    elif opts.export_hosts:
+        debug("Exporting all hosts")
+        for record in invcache.exporthosts():
+            sys.stdout.write("{0}\n".format(json.dumps(record, sort_keys=True)))
     else:
         debug("Not sure what to do")
         do_not_break_ansible()
@@ -575,7 +1837,8 @@ class ActionModule(ActionBase):
                                    " plugin and dynamic inventory script are identical.")
         if invcachevers == 0:
             self._fail(result, "The invcache action plugin cannot function"
-                               " unless it is also present as an inventory script."
+                               " unless it is also present as an inventory plugin"
+                               " or script."
                                "\n{0}".format(USAGE))
         else:
             self._fail(result, "Unsupported version of invcache: {0},"
@@ -633,7 +1896,7 @@ class ActionModule(ActionBase):
             else:
                 result['changed'] = False  # Host didn't exist
         elif ic_op == 'reset':
-            invcache.reset()
+            invcache.reset(invcache.filepath)
             result['changed'] = True
             result['msg'] = "Static inventory reset"
         else:
@@ -661,5 +1924,91 @@ class ActionModule(ActionBase):
         return result
 
 
+class InventoryModule(BaseInventoryPlugin):
+    """Populate inventory directly from the cache, without a subprocess or JSON round-trip"""
+
+    NAME = 'invcache'
+
+    # Per cache file path: (stat details, version stamp, unexpired inventory, next expiration)
+    _generations = {}
+    _generations_lock = threading.Lock()
+
+    def verify_file(self, path):
+        return (super(InventoryModule, self).verify_file(path) and
+                os.path.basename(path) in ('invcache.yml', 'invcache.yaml'))
+
+    def _statkey(self, filepath):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime)
+
+    def _next_expiration(self, inventory):
+        next_expiration = float('inf')
+        for hostvars in inventory['_meta']['hostvars'].values():
+            try:
+                next_expiration = min(next_expiration, float(hostvars[InvCache.EXPIRES]))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return next_expiration
+
+    def generation(self, invcache):
+        """
+        Return unexpired inventory from invcache, rebuilding only when it changed
+
+        An unchanged file (by stat) isn't read, and an unchanged version stamp
+        isn't parsed.  The result is shared, and must not be modified.
+
+        :param invcache: An InvCache instance
+        :returns: Standard Ansible inventory dictionary
+        """
+        filepath = invcache.filepath
+        statkey = self._statkey(filepath)
+        with self._generations_lock:
+            previous = self._generations.get(filepath)
+        if previous is not None and time.time() >= previous[3]:
+            previous = None  # Some host expired since
+        if previous is not None and statkey is not None and statkey == previous[0]:
+            return previous[2]
+        with invcache.flocked(fcntl.LOCK_SH):
+            statkey = self._statkey(filepath)
+            raw = invcache._read_raw()
+        version = invcache.stamp(raw)
+        if previous is not None and version == previous[1]:
+            inventory = previous[2]
+        else:
+            try:
+                inventory = invcache._unexpired(json.loads(raw))
+            except ValueError:  # Empty or unparseable
+                inventory = deepcopy(invcache.DEFAULT_CACHE)
+        with self._generations_lock:
+            self._generations[filepath] = (statkey, version, inventory,
+                                           self._next_expiration(inventory))
+        return inventory
+
+    def parse(self, inventory, loader, path, cache=True):
+        super(InventoryModule, self).parse(inventory, loader, path, cache)
+        config = loader.load_from_file(path) or {}
+        cachefile = config.get('cachefile')
+        if cachefile:
+            invcache = InvCache(os.path.dirname(cachefile), os.path.basename(cachefile))
+        else:  # Same file as the script would use, ansible is sys.argv[0] here
+            invcache = InvCache(artifacts_dirpath(), InvCache.script_filename(__file__))
+        cached = self.generation(invcache)
+        for group, value in iteritems(cached):
+            if group == '_meta':
+                continue
+            self.inventory.add_group(group)
+            for hostname in value.get('hosts', []):
+                self.inventory.add_host(hostname, group=group)
+            for key, val in iteritems(value.get('vars', {})):
+                self.inventory.set_variable(group, key, val)
+        for hostname, hostvars in iteritems(cached['_meta']['hostvars']):
+            self.inventory.add_host(hostname)
+            for key, val in iteritems(hostvars):
+                self.inventory.set_variable(hostname, key, val)
+
+
 if __name__ == '__main__':
     main()
@@ -1 +1 @@
-../inventory/invcache.py
\ No newline at end of file
+../bin/invcache.py
\ No newline at end of file
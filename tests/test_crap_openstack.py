@@ -0,0 +1,478 @@
+#!/usr/bin/env python2
+
+# crap_openstack.py is python 2 only, so these are skipped under python 3.  Run them with:
+#     python2 -m unittest discover --start-directory tests --pattern test_crap_openstack.py
+
+import sys
+import os
+import json
+import tempfile
+import shutil
+import threading
+import time
+import unittest
+from glob import glob
+
+# Assumes directory structure as-is from repo. clone
+TEST_FILENAME = os.path.basename(os.path.realpath(__file__))
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+TESTS_DIR_PARENT = os.path.realpath(os.path.join(TESTS_DIR, '../'))
+
+
+@unittest.skipIf(sys.version_info[0] > 2, "crap_openstack.py is python 2 only")
+class TestCaseBase(unittest.TestCase):
+    """Exercize code from file based on TEST_FILENAME in TESTS_DIR_PARENT + SUBJECT_REL_PATH"""
+
+    # repo. relative path containing test subject python file
+    SUBJECT_REL_PATH = 'bin'
+
+    # The name of the loaded code, as if it were a real module
+    SUBJECT_NAME = TEST_FILENAME[len('test_'):].split('.', 1)[0]
+
+    # The complete path containing SUBJECT_NAME
+    SUBJECT_DIR = os.path.realpath(os.path.join(TESTS_DIR_PARENT, SUBJECT_REL_PATH))
+
+    # When non-none, reference to loaded subject as if it were a module
+    SUBJECT = None
+
+    # When non-none, complete path to unittest temporary directory
+    TEMPDIRPATH = None
+
+    # The complete path to the SUBJECT_NAME
+    for SUBJECT_PATH in glob(os.path.join(SUBJECT_DIR, '{}*'.format(SUBJECT_NAME))):
+        if os.path.isfile(SUBJECT_PATH):
+            break
+    else:
+        raise RuntimeError("Could not locate test subject: {} in {}".format(SUBJECT_NAME, SUBJECT_DIR))
+
+    if sys.version_info[0] == 2:
+        import imp
+        sys.path.insert(0, SUBJECT_DIR)  # It imports flock
+        SUBJECT = sys.modules[SUBJECT_NAME] = imp.load_source(SUBJECT_NAME, SUBJECT_PATH)
+
+    def setUp(self):
+        super(TestCaseBase, self).setUp()
+        self.TEMPDIRPATH = tempfile.mkdtemp(prefix=os.path.basename(__file__))
+
+    def tearDown(self):
+        if self.TEMPDIRPATH:  # rm -rf /tmp/test_crap_openstack.py*
+            for tempdirglob in glob('{}*'.format(self.TEMPDIRPATH)):
+                shutil.rmtree(tempdirglob, ignore_errors=True)
+
+
+class FakeRequest(object):
+    """The parts of a requests.PreparedRequest used by OpenstackREST"""
+
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+
+
+class FakeResponse(object):
+    """The parts of a requests.Response used by OpenstackREST"""
+
+    def __init__(self, method='GET', url='https://example.com/', status_code=200,
+                 content='{}', headers=None):
+        self.request = FakeRequest(method, url)
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeREST(object):
+    """Stand-in for the OpenstackREST singleton, recording requests"""
+
+    def __init__(self):
+        self.requests = []
+        self.response_obj = FakeResponse()
+        self.changed = []  # Details of servers changed since the previous poll
+        self.listed = []  # Names of servers found by name
+
+    def compute_request(self, uri, unwrap=None, method='get', post_json=None):
+        self.requests.append((method, uri, unwrap, post_json))
+        return self.changed
+
+    def server_list(self, key='name', name=None, uuid=None):
+        self.requests.append(('server_list', key, name, uuid))
+        return [listed for listed in self.listed if listed == name]
+
+    def server(self, name=None, uuid=None):
+        self.requests.append(('server', name, uuid))
+        raise ValueError("No server with ID %s" % uuid)
+
+    @staticmethod
+    def raise_if(true_condition, xception, msg):
+        if true_condition:
+            raise xception(msg)
+
+
+class TestCaseREST(TestCaseBase):
+    """Base for tests of OpenstackREST users, with a FakeREST in its place"""
+
+    def setUp(self):
+        super(TestCaseREST, self).setUp()
+        for singleton in (self.SUBJECT.OpenstackREST, self.SUBJECT.ServerPoller):
+            singleton.__clobber__()
+            self.addCleanup(singleton.__clobber__)
+        self.os_rest = self.SUBJECT.OpenstackREST._singleton = FakeREST()
+        self.poller = self.SUBJECT.ServerPoller()
+        self.poller._thread = threading.current_thread()  # Tests poll, not a thread
+
+    def changed(self, *servers):
+        """Poll, finding servers given as (uuid, name, status) changed"""
+        self.os_rest.changed = [{'id': uuid, 'name': name, 'status': status,
+                                 'OS-EXT-STS:vm_state': status.lower(),
+                                 'OS-EXT-STS:power_state': 1 if status == 'ACTIVE' else 0}
+                                for uuid, name, status in servers]
+        self.poller.poll()
+
+
+class TestServerPoller(TestCaseREST):
+    """Tests for the ServerPoller class"""
+
+    def test_changes_since(self):
+        """Polls request servers changed since the API's time of the previous one"""
+        self.poller.track('a')
+        self.assertAlmostEqual(self.poller._since, time.time() - self.poller.first_overlap,
+                               delta=1)
+        since = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.poller._since))
+        self.os_rest.response_obj.headers['Date'] = 'Mon, 19 Oct 2026 12:00:10 GMT'
+        self.changed(('a', 'one', 'BUILD'), ('b', 'one', 'ACTIVE'), ('c', 'two', 'ACTIVE'))
+        self.assertEqual(self.os_rest.requests, [
+            ('get', '/servers/detail?changes-since=%s' % since.replace(':', '%3A'),
+             'servers', None)])
+        self.assertEqual(self.poller.details('a')['status'], 'BUILD')
+        self.assertIsNone(self.poller.details('b'))  # Not tracked
+        self.assertEqual(sorted(self.poller.named('one')), ['a', 'b'])
+        self.changed(('b', 'one', 'DELETED'))
+        # Overlapping the previous poll, by the API's clock
+        self.assertEqual(self.os_rest.requests[-1][1],
+                         '/servers/detail?changes-since=2026-10-19T12%3A00%3A06Z')
+        self.assertEqual(self.poller.named('one'), ['a'])
+        self.assertEqual(self.poller.details('a')['status'], 'BUILD')  # Unchanged
+        self.assertEqual(self.poller.polls, 2)
+        self.poller.untrack('a')
+        self.assertIsNone(self.poller.details('a'))
+
+    def test_stale(self):
+        """Details not confirmed by a poll for stale_intervals are ignored"""
+        self.poller.interval = 0.05
+        self.poller.track('a')
+        self.changed(('a', 'one', 'ACTIVE'))
+        self.assertEqual(self.poller.details('a')['status'], 'ACTIVE')
+        time.sleep(self.poller.stale_intervals * self.poller.interval + 0.05)
+        self.assertIsNone(self.poller.details('a'))
+        self.changed()
+        self.assertEqual(self.poller.details('a')['status'], 'ACTIVE')
+
+    def test_wait(self):
+        """Waiters return once the next poll completes"""
+        polling = threading.Timer(0.1, self.changed)
+        polling.start()
+        self.addCleanup(polling.join)
+        start = time.time()
+        self.poller.wait(5)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(self.poller.polls, 1)
+
+
+class TestTimeoutCreate(TestCaseREST):
+    """Tests for the TimeoutCreate class"""
+
+    def setUp(self):
+        super(TestTimeoutCreate, self).setUp()
+        self.create = self.SUBJECT.TimeoutCreate.__new__(self.SUBJECT.TimeoutCreate)
+        self.create.os_rest = self.os_rest
+        self.create.server_id = 'a'
+        self.create.checks = 0
+        self.poller.track('a')
+
+    def searches(self):
+        """Number of times the API was searched for servers by name"""
+        return len([request for request in self.os_rest.requests
+                    if request[0] == 'server_list'])
+
+    def test_name_checks(self):
+        """The API is searched for servers sharing the name every name_checks"""
+        self.os_rest.listed = ['one']
+        self.assertIsNone(self.create.am_done('one', 'a'))  # Not found yet
+        self.assertEqual(self.os_rest.requests[-1], ('server', None, 'a'))
+        self.changed(('a', 'one', 'BUILD'))
+        for _ in range(2 * self.create.name_checks - 1):
+            self.assertIsNone(self.create.am_done('one', 'a'))
+        self.assertEqual(self.searches(), 2)
+        self.assertEqual([request for request in self.os_rest.requests
+                          if request[0] == 'server'], [('server', None, 'a')])  # Polled
+        self.os_rest.listed = ['one', 'one']  # Found by the next search
+        self.assertRaises(RuntimeError, self.create.am_done, 'one', 'a')
+        self.assertEqual(self.searches(), 3)
+
+    def test_polled_duplicate(self):
+        """Servers sharing the name seen by a poll are found without searching"""
+        self.changed(('a', 'one', 'BUILD'), ('b', 'one', 'BUILD'))
+        self.create.checks = 1
+        self.assertRaises(RuntimeError, self.create.am_done, 'one', 'a')
+        self.assertEqual(self.searches(), 0)
+
+    def test_active(self):
+        """The server's ID is returned once it's active and running"""
+        self.changed(('a', 'one', 'ACTIVE'))
+        self.assertEqual(self.create.am_done('one', 'a'), 'a')
+
+
+class FakeAction(object):
+    """Stand-in for a TimeoutAction, as used by schedules"""
+
+    sleep = 1
+
+
+class TestSchedules(TestCaseBase):
+    """Tests for the PollSchedule subclasses"""
+
+    @staticmethod
+    def first(schedule, count):
+        """Return the first count delays of schedule for a FakeAction"""
+        delays = schedule.delays(FakeAction())
+        return [next(delays) for _ in range(count)]
+
+    def test_default(self):
+        """Checks are evenly spaced unless --schedule chooses otherwise"""
+        dargs = self.SUBJECT.parse_args(['openstack_destroy.py', 'name'], 'destroy')
+        self.assertEqual(dargs['schedule'], 'fixed')
+        self.assertIsInstance(self.SUBJECT.TimeoutAction.schedule,
+                              self.SUBJECT.SCHEDULES[dargs['schedule']])
+
+    def test_fixed(self):
+        """Every wait is the action's sleep"""
+        self.assertEqual(self.first(self.SUBJECT.FixedSchedule(), 5), [1] * 5)
+
+    def test_backoff(self):
+        """Waits grow by factor to maximum, shortened by up to jitter"""
+        schedule = self.SUBJECT.BackoffSchedule(factor=2, maximum=5, jitter=0)
+        self.assertEqual(self.first(schedule, 6), [1, 2, 4, 5, 5, 5])
+        schedule.jitter = 0.5
+        for delay, longest in zip(self.first(schedule, 6), [1, 2, 4, 5, 5, 5]):
+            self.assertTrue(longest * 0.5 <= delay <= longest)
+
+    def test_learned(self):
+        """Checks are at quantiles of recorded durations, then fall back"""
+        filepath = os.path.join(self.TEMPDIRPATH, self.SUBJECT.DURATIONS_FILENAME)
+        schedule = self.SUBJECT.LearnedSchedule(filepath,
+                                                self.SUBJECT.FixedSchedule())
+        self.assertEqual(self.first(schedule, 3), [1, 1, 1])  # Nothing recorded
+        for duration in (10, 20, 30, 40):
+            schedule.record(FakeAction(), duration)
+        self.assertEqual(self.first(schedule, 3), [1, 1, 1])  # Too few
+        schedule.record(FakeAction(), 50.004)
+        delays = self.first(schedule, 8)
+        # Seconds after the call, less time elapsed, then the fallback's
+        expected = [10, 20, 30, 40, 40, 50, 1, 1]
+        for delay, duration in zip(delays, expected):
+            self.assertAlmostEqual(delay, duration, delta=0.1)
+        self.assertEqual(schedule.durations(), {'FakeAction': [10, 20, 30, 40, 50]})
+
+    def test_learned_persistence(self):
+        """Durations are kept in the JSON file, by action, most recent samples"""
+        filepath = os.path.join(self.TEMPDIRPATH, self.SUBJECT.DURATIONS_FILENAME)
+        schedule = self.SUBJECT.LearnedSchedule(filepath)
+        schedule.samples = 3
+        for duration in (1.111, 2, 3, 4):
+            schedule.record(FakeAction(), duration)
+        with open(filepath) as durations_file:
+            self.assertEqual(json.load(durations_file), {'FakeAction': [2, 3, 4]})
+        # Shared with other jobs, which add their own
+        self.SUBJECT.LearnedSchedule(filepath).record(self.SUBJECT.TimeoutDelete.__new__(
+            self.SUBJECT.TimeoutDelete), 5)
+        self.assertEqual(schedule.durations(), {'FakeAction': [2, 3, 4],
+                                                'TimeoutDelete': [5]})
+        self.assertEqual(sorted(os.listdir(self.TEMPDIRPATH)),
+                         [self.SUBJECT.DURATIONS_FILENAME,
+                          self.SUBJECT.DURATIONS_FILENAME + '.lock'])
+        with open(filepath, 'w') as durations_file:
+            durations_file.write('{"corrupt')
+        self.assertEqual(schedule.durations(), {})
+
+
+class FakeAuthRef(object):
+    """The parts of a keystoneauth AccessInfo used by AuthStateCache"""
+
+    def __init__(self, expires):
+        self.expires = expires
+
+    def will_expire_soon(self, stale):
+        return self.expires - time.time() < stale
+
+
+class FakeAuth(object):
+    """The parts of a keystoneauth identity plugin used by AuthStateCache"""
+
+    def __init__(self, cache_id='cache_id', expires_in=None):
+        self.cache_id = cache_id
+        self.auth_ref = None
+        self.invalidated = False
+        if expires_in is not None:
+            self.set_auth_state(json.dumps(dict(expires=time.time() + expires_in)))
+
+    def get_cache_id(self):
+        return self.cache_id
+
+    def get_auth_state(self):
+        if self.auth_ref is None:
+            return None
+        return json.dumps(dict(expires=self.auth_ref.expires))
+
+    def set_auth_state(self, state):
+        self.auth_ref = FakeAuthRef(json.loads(state)['expires'])
+
+    def invalidate(self):
+        self.invalidated = True
+        self.auth_ref = None
+
+
+class TestAuthStateCache(TestCaseBase):
+    """Tests for the AuthStateCache class"""
+
+    def setUp(self):
+        super(TestAuthStateCache, self).setUp()
+        self.filepath = os.path.join(self.TEMPDIRPATH, self.SUBJECT.AUTH_STATE_FILENAME)
+        self.cache = self.SUBJECT.AuthStateCache(self.filepath, stale=300)
+
+    def mode(self):
+        """Permission bits of the cache file"""
+        return os.stat(self.filepath).st_mode & 0o777
+
+    def test_save_load(self):
+        """Tokens are saved owner-only, and re-used by later jobs with the same credentials"""
+        auth = FakeAuth(expires_in=3600)
+        self.cache.save(auth)
+        self.assertEqual(self.mode(), 0o600)
+        self.assertEqual(os.listdir(self.TEMPDIRPATH), [self.SUBJECT.AUTH_STATE_FILENAME])
+        loaded = FakeAuth()
+        cache = self.SUBJECT.AuthStateCache(self.filepath, stale=300)
+        self.assertTrue(cache.load(loaded))
+        self.assertEqual(loaded.get_auth_state(), auth.get_auth_state())
+        os.unlink(self.filepath)
+        cache.save(loaded)  # Unchanged since loaded
+        self.assertFalse(os.path.exists(self.filepath))
+        self.assertFalse(self.cache.load(FakeAuth('other_credentials')))
+
+    def test_leftover_temp(self):
+        """Files left by a previous process with this one's ID are made owner-only"""
+        temp_filepath = '%s.%d' % (self.filepath, os.getpid())
+        with open(temp_filepath, 'w') as temp_file:
+            temp_file.write('{}')
+        os.chmod(temp_filepath, 0o644)
+        self.cache.save(FakeAuth(expires_in=3600))
+        self.assertEqual(self.mode(), 0o600)
+
+    def test_expiring(self):
+        """Tokens expiring within stale seconds are dropped, to re-authenticate"""
+        self.cache.save(FakeAuth(expires_in=200))
+        auth = FakeAuth()
+        self.assertFalse(self.cache.load(auth))
+        self.assertTrue(auth.invalidated)
+        self.assertIsNone(auth.auth_ref)
+
+    def test_mode(self):
+        """Files readable or writable by others are ignored"""
+        self.cache.save(FakeAuth(expires_in=3600))
+        for mode in (0o640, 0o604, 0o620):
+            os.chmod(self.filepath, mode)
+            self.assertEqual(self.cache.states(), {})
+            self.assertFalse(self.cache.load(FakeAuth()))
+        os.chmod(self.filepath, 0o600)
+        self.assertTrue(self.cache.load(FakeAuth()))
+
+    def test_owner(self):
+        """Files owned by other users are ignored"""
+        if os.getuid() != 0:
+            self.skipTest("Only root can give files away")
+        self.cache.save(FakeAuth(expires_in=3600))
+        os.chown(self.filepath, os.getuid() + 1, -1)
+        self.assertEqual(self.cache.states(), {})
+        self.assertFalse(self.cache.load(FakeAuth()))
+
+    def test_unsupported(self):
+        """Plugins without cache IDs always authenticate"""
+        self.cache.save(object())
+        self.assertFalse(os.path.exists(self.filepath))
+        self.assertFalse(self.cache.load(object()))
+
+
+class FakeCloud(object):
+    """The parts of an os-client-config cloud used by ServiceSessions"""
+
+    def __init__(self):
+        self.created = []
+
+    def get_session_client(self, service):
+        time.sleep(0.01)  # Long enough for threads to overlap
+        self.created.append(service)
+        return object()
+
+
+class TestServiceSessions(TestCaseBase):
+    """Tests for the ServiceSessions class"""
+
+    def test_created_once(self):
+        """Each service's session is created once, by the first thread using it"""
+        cloud = FakeCloud()
+        sessions = self.SUBJECT.ServiceSessions(cloud, ['compute', 'image'])
+        found = []
+        threads = [threading.Thread(target=lambda: found.append(sessions['compute']))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cloud.created, ['compute'])
+        self.assertEqual(set(found), set([sessions['compute']]))
+        self.assertRaises(KeyError, sessions.__getitem__, 'dns')
+        self.assertEqual(cloud.created, ['compute'])
+
+
+class TestOpenstackREST(TestCaseBase):
+    """Tests for the OpenstackREST class"""
+
+    def setUp(self):
+        super(TestOpenstackREST, self).setUp()
+        self.SUBJECT.OpenstackREST.__clobber__()
+        self.addCleanup(self.SUBJECT.OpenstackREST.__clobber__)
+        self.os_rest = self.SUBJECT.OpenstackREST(service_sessions={})
+
+    def test_history(self):
+        """Threads summarize their responses while the history is read"""
+        stop = threading.Event()
+        errors = []
+
+        def respond(number):
+            try:
+                while not stop.is_set():
+                    self.os_rest.response_obj = FakeResponse(url='https://%d/' % number)
+                    self.os_rest.response_code = 200
+                    self.os_rest.summarize(0.01)
+            except Exception as xcept:  # pylint: disable=W0703
+                errors.append(xcept)
+
+        threads = [threading.Thread(target=respond, args=(number,)) for number in range(4)]
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in range(500):
+                self.assertRaises(ValueError, self.os_rest.raise_if, True, ValueError, 'Failed')
+                history = self.os_rest.history()
+                self.assertLessEqual(len(history), self.os_rest.history_length)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(history[-1]['json'], {})
+        self.assertEqual(history[-1]['status_code'], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
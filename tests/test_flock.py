@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import tempfile
+import json
+import shutil
+import threading
+import asyncio
+import multiprocessing
+import subprocess
+import time
+from errno import ENOLCK
+import unittest
+from unittest.mock import patch
+from glob import glob
+import importlib.machinery
+
+# Assumes directory structure as-is from repo. clone
+TEST_FILENAME = os.path.basename(os.path.realpath(__file__))
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+TESTS_DIR_PARENT = os.path.realpath(os.path.join(TESTS_DIR, '../'))
+
+
+class TestCaseBase(unittest.TestCase):
+    """Exercize code from file based on TEST_FILENAME in TESTS_DIR_PARENT + SUBJECT_REL_PATH"""
+
+    # repo. relative path containing test subject python file
+    SUBJECT_REL_PATH = 'bin'
+
+    # The name of the loaded code, as if it were a real module
+    SUBJECT_NAME = TEST_FILENAME[len('test_'):].split('.',1)[0]
+
+    # The complete path containing SUBJECT_NAME
+    SUBJECT_DIR = os.path.realpath(os.path.join(TESTS_DIR_PARENT, SUBJECT_REL_PATH))
+
+    # When non-none, reference to loaded subject as if it were a module
+    SUBJECT = None
+
+    # When non-none, complete path to unittest temporary directory
+    TEMPDIRPATH = None
+
+    # Locking processes are forked, so they share the loaded subject
+    mp = multiprocessing.get_context('fork')
+
+    # The complete path to the SUBJECT_NAME
+    for SUBJECT_PATH in glob(os.path.join(SUBJECT_DIR, '{}*'.format(SUBJECT_NAME))):
+        if os.path.isfile(SUBJECT_PATH):
+            # The subject may not conform to package.module standards
+            loader = importlib.machinery.SourceFileLoader(SUBJECT_NAME, SUBJECT_PATH)
+            # After python 3.6: Need loader for files w/o any extension
+            # so loader.exec_module() can be used.
+            SUBJECT = sys.modules[SUBJECT_NAME] = loader.load_module(SUBJECT_NAME)
+            break
+    else:
+        raise RuntimeError("Could not locate test subject: {} in {}".format(SUBJECT_NAME, SUBJECT_DIR))
+
+    def setUp(self):
+        super(TestCaseBase, self).setUp()
+        self.TEMPDIRPATH = tempfile.mkdtemp(prefix=os.path.basename(__file__))
+        self.lockfilepath = os.path.join(self.TEMPDIRPATH, 'test.lock')
+
+    def tearDown(self):
+        if self.TEMPDIRPATH:  # rm -rf /tmp/test_flock.py*
+            for tempdirglob in glob('{}*'.format(self.TEMPDIRPATH)):
+                shutil.rmtree(tempdirglob, ignore_errors=True)
+
+    def fork(self, target, *args):
+        """Start target(*args) in a child process, killed if the test doesn't join it"""
+        proc = self.mp.Process(target=target, args=args)
+        proc.daemon = True
+        proc.start()
+        self.addCleanup(proc.join)
+        self.addCleanup(proc.terminate)
+        return proc
+
+    def holder(self, op, policy=None):
+        """Return events to release a lock op held by a child, once it's been acquired"""
+        ready = self.mp.Event()
+        release = self.mp.Event()
+
+        def hold():
+            lock = self.SUBJECT.Flock(self.lockfilepath, policy)
+            lock.lock(op)
+            ready.set()
+            release.wait()
+            lock.unlock()
+
+        proc = self.fork(hold)
+        self.assertTrue(ready.wait(5))
+        return release, proc
+
+    def wait_for(self, condition, timeout=5):
+        """Poll condition() until it's True, failing after timeout seconds"""
+        deadline = time.time() + timeout
+        while not condition():
+            self.assertLess(time.time(), deadline, "Timed out waiting")
+            time.sleep(0.01)
+
+    def gate_held(self):
+        """True if another process holds the lock's writer-policy gate"""
+        lock = self.SUBJECT.Flock(self.lockfilepath + '.gate')
+        try:
+            lock.lock(self.SUBJECT.LOCK_EX | self.SUBJECT.LOCK_NB)
+        except IOError:
+            return True
+        lock.unlock()
+        return False
+
+
+class TestFlock(TestCaseBase):
+    """Tests for the Flock class"""
+
+    def test_lock_timeout(self):
+        """Timing out leaves no threads, open files or waiters behind"""
+        for policy in self.SUBJECT.Flock.POLICIES:
+            with self.subTest(policy=policy):
+                release, proc = self.holder(self.SUBJECT.LOCK_EX, policy)
+                threads = threading.active_count()
+                fds = len(os.listdir('/proc/self/fd'))
+                lock = self.SUBJECT.Flock(self.lockfilepath, policy)
+                start = time.time()
+                self.assertIsNone(lock.lock_timeout(0.2, self.SUBJECT.LOCK_EX))
+                self.assertGreaterEqual(time.time() - start, 0.2)
+                self.assertLess(lock.wait_time, 2)
+                self.assertEqual(threading.active_count(), threads)
+                self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+                self.assertEqual(lock.contended_by, [(proc.pid, 'write')])
+                release.set()
+                proc.join()
+                self.assertTrue(lock.lock_timeout(5, self.SUBJECT.LOCK_EX))
+                lock.unlock()
+
+    def test_writer_preference(self):
+        """A waiting writer keeps new readers out, but only by the writer policy"""
+        for policy, excluded in ((self.SUBJECT.Flock.WRITERS, True),
+                                 (self.SUBJECT.Flock.READERS, False)):
+            with self.subTest(policy=policy):
+                release, holder = self.holder(self.SUBJECT.LOCK_SH, policy)
+                acquired = self.mp.Event()
+
+                def write():
+                    self.SUBJECT.Flock(self.lockfilepath, policy).lock(self.SUBJECT.LOCK_EX)
+                    acquired.set()
+
+                writer = self.fork(write)
+                if excluded:
+                    self.wait_for(self.gate_held)
+                else:
+                    time.sleep(0.2)  # Nothing to see, it's blocked in flock()
+                reader = self.SUBJECT.Flock(self.lockfilepath, policy)
+                if excluded:
+                    self.assertIsNone(reader.lock_timeout(0.2, self.SUBJECT.LOCK_SH))
+                else:
+                    self.assertTrue(reader.lock_timeout(0.2, self.SUBJECT.LOCK_SH))
+                    reader.unlock()
+                self.assertFalse(acquired.is_set())
+                release.set()
+                self.assertTrue(acquired.wait(5))
+                holder.join()
+                writer.join()
+
+    def test_fifo_order(self):
+        """Processes acquire in the order they arrived, readers and writers alike"""
+        policy = self.SUBJECT.Flock.FIFO
+        order = os.path.join(self.TEMPDIRPATH, 'order')
+        lock = self.SUBJECT.Flock(self.lockfilepath, policy)
+        lock.lock(self.SUBJECT.LOCK_EX)
+        ops = [self.SUBJECT.LOCK_EX, self.SUBJECT.LOCK_SH, self.SUBJECT.LOCK_EX,
+               self.SUBJECT.LOCK_SH, self.SUBJECT.LOCK_EX]
+
+        def acquire(index, op):
+            with open(order, 'a') as order_file:
+                waiter = self.SUBJECT.Flock(self.lockfilepath, policy)
+                waiter.lock(op)
+                order_file.write('%d\n' % index)
+                order_file.flush()
+                time.sleep(0.05)
+                waiter.unlock()
+
+        def tickets():
+            with open(self.lockfilepath + '.ticket') as ticketfile:
+                return int(ticketfile.read() or 0)
+
+        procs = []
+        for index, op in enumerate(ops):
+            taken = tickets()
+            procs.append(self.fork(acquire, index, op))
+            self.wait_for(lambda: tickets() > taken)
+        lock.unlock()
+        for proc in procs:
+            proc.join()
+        with open(order) as order_file:
+            self.assertEqual(order_file.read().split(), [str(i) for i in range(len(ops))])
+
+    def test_stale_lease(self):
+        """Holders not renewing are broken, and find out when they renew"""
+        holder = self.SUBJECT.Flock(self.lockfilepath, lease=0.3)
+        holder.lock(self.SUBJECT.LOCK_EX)
+        self.assertEqual(len(glob(self.lockfilepath + '.lease.*')), 1)
+        waiter = self.SUBJECT.Flock(self.lockfilepath, lease=0.3)
+        start = time.time()
+        with patch('{}.logging'.format(self.SUBJECT_NAME)):
+            self.assertTrue(waiter.lock_timeout(5, self.SUBJECT.LOCK_EX))
+            self.assertGreaterEqual(time.time() - start, 0.3)
+            with self.assertRaises(IOError) as raised:
+                holder.renew()
+        self.assertEqual(raised.exception.errno, ENOLCK)
+        self.assertTrue(holder.broken)
+        waiter.unlock()
+        holder.unlock()
+        self.assertEqual(glob(self.lockfilepath + '.lease.*'), [])
+
+    def test_renewed_lease(self):
+        """Holders renewing within their lease keep the lock"""
+        holder = self.SUBJECT.Flock(self.lockfilepath, lease=0.3)
+        holder.lock(self.SUBJECT.LOCK_EX)
+        stop = threading.Event()
+
+        def progress():
+            while not stop.wait(0.05):
+                holder.renew()
+
+        thread = threading.Thread(target=progress)
+        thread.start()
+        try:
+            waiter = self.SUBJECT.Flock(self.lockfilepath, lease=0.3)
+            self.assertIsNone(waiter.lock_timeout(0.8, self.SUBJECT.LOCK_EX))
+        finally:
+            stop.set()
+            thread.join()
+        self.assertFalse(holder.broken)
+        holder.unlock()
+
+    def test_async_acquire(self):
+        """Tasks wait on the event loop in policy order, time out, and leave when cancelled"""
+        policy = self.SUBJECT.Flock.FIFO
+        order = []
+        threads = threading.active_count()
+
+        async def acquire(index, op):
+            lock = self.SUBJECT.Flock(self.lockfilepath, policy)
+            if op == self.SUBJECT.LOCK_EX:
+                acquiring = lock.acquire_write_async(5)
+            else:
+                acquiring = lock.acquire_read_async(5)
+            async with acquiring as lockfile:
+                self.assertIsNotNone(lockfile)
+                self.assertEqual(threading.active_count(), threads)
+                order.append(index)
+                await asyncio.sleep(0.05)
+
+        async def in_order():
+            tasks = []
+            for index, op in enumerate([self.SUBJECT.LOCK_EX, self.SUBJECT.LOCK_SH,
+                                        self.SUBJECT.LOCK_EX, self.SUBJECT.LOCK_SH]):
+                tasks.append(asyncio.ensure_future(acquire(index, op)))
+                await asyncio.sleep(0.02)
+            await asyncio.gather(*tasks)
+
+        with patch.object(sys, 'path', [self.SUBJECT_DIR] + sys.path):  # For async_flock
+            asyncio.run(in_order())
+        self.assertEqual(order, [0, 1, 2, 3])
+
+        release, proc = self.holder(self.SUBJECT.LOCK_EX)
+        waiter = self.SUBJECT.Flock(self.lockfilepath, policy)
+
+        async def timeout():
+            async with waiter.acquire_write_async(0.1) as lockfile:
+                return lockfile
+
+        with patch('async_flock.logging'):
+            self.assertIsNone(asyncio.run(timeout()))
+
+        async def cancelled():
+            async def wait():
+                async with waiter.acquire_write_async() as lockfile:
+                    order.append(lockfile)
+
+            task = asyncio.ensure_future(wait())
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            release.set()
+            await asyncio.sleep(0.3)
+
+        asyncio.run(cancelled())
+        proc.join()
+        self.assertEqual(order, [0, 1, 2, 3])
+        self.assertFalse(self.SUBJECT.Flock(self.lockfilepath).is_locked)
+        self.assertEqual(glob(self.lockfilepath + '.[0-9]*'), [])  # Left the queue
+
+        release, proc = self.holder(self.SUBJECT.LOCK_SH, self.SUBJECT.Flock.WRITERS)
+        writer = self.SUBJECT.Flock(self.lockfilepath, self.SUBJECT.Flock.WRITERS)
+
+        async def gated():
+            async def wait():
+                async with writer.acquire_write_async():
+                    pass
+
+            task = asyncio.ensure_future(wait())
+            await asyncio.sleep(0.1)
+            self.assertTrue(self.gate_held())  # Keeping new readers out
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertFalse(self.gate_held())
+
+        asyncio.run(gated())
+        release.set()
+        proc.join()
+
+    def test_telemetry(self):
+        """Context managers record acquisitions and timeouts as JSON-lines events"""
+        release, proc = self.holder(self.SUBJECT.LOCK_SH)
+        lock = self.SUBJECT.Flock(self.lockfilepath)
+        lock.telemetry = True
+        with patch('{}.logging'.format(self.SUBJECT_NAME)):
+            with lock.timeout_acquire_write(0.1) as lockfile:
+                self.assertIsNone(lockfile)
+        with lock.acquire_read() as lockfile:
+            time.sleep(0.05)
+        release.set()
+        proc.join()
+        with open(self.lockfilepath + '.jsonl') as events:
+            timedout, acquired = [json.loads(line) for line in events]
+        for event in timedout, acquired:
+            self.assertEqual(event['lock'], self.lockfilepath)
+            self.assertEqual(event['pid'], os.getpid())
+            self.assertRegex(event['caller'], r'^test_flock\.py:\d+ test_telemetry$')
+        self.assertEqual((timedout['mode'], timedout['timeout'], timedout['timedout']),
+                         ('write', 0.1, True))
+        self.assertIsNone(timedout['hold'])
+        self.assertGreaterEqual(timedout['wait'], 0.1)
+        self.assertEqual(timedout['holders'], [[proc.pid, 'read']])
+        self.assertEqual((acquired['mode'], acquired['timeout'], acquired['timedout']),
+                         ('read', None, False))
+        self.assertGreaterEqual(acquired['hold'], 0.05)
+        self.assertIsNone(acquired['holders'])
+
+    def test_holders(self):
+        """holders() lists processes holding the lock, without trying to acquire it"""
+        lock = self.SUBJECT.Flock(self.lockfilepath)
+        self.assertEqual(lock.holders(), [])
+        release, proc = self.holder(self.SUBJECT.LOCK_SH)
+        with patch.object(self.SUBJECT.Flock, 'lock') as mock_lock:
+            self.assertEqual(lock.holders(), [(proc.pid, 'read')])
+            self.assertTrue(lock.is_locked)
+            self.assertFalse(mock_lock.called)
+        release.set()
+        proc.join()
+        self.assertEqual(lock.holders(), [])
+        lock.proc_locks = os.path.join(self.TEMPDIRPATH, 'nonexistent')
+        self.assertIsNone(lock.holders())
+
+
+class TestLockManager(TestCaseBase):
+    """Tests for the LockManager class"""
+
+    def test_stripe_ordering(self):
+        """Names are locked once per stripe, in stripe order whatever the name order"""
+        manager = self.SUBJECT.LockManager(self.TEMPDIRPATH, 'test_', stripes=8)
+        names = ['server_%d' % number for number in range(6, 0, -1)]
+        stripes = sorted(set(manager.stripe(name) for name in names))
+        self.assertEqual(manager.stripe(names[0]), manager.stripe(names[0]))
+        self.assertTrue(all(0 <= stripe < 8 for stripe in stripes))
+        locked = []
+        original = self.SUBJECT.Flock.lock
+
+        def lock(flock_obj, op):
+            locked.append(flock_obj._lockfile.name)
+            return original(flock_obj, op)
+
+        with patch.object(self.SUBJECT.Flock, 'lock', autospec=True, side_effect=lock):
+            with manager.acquire_write(*names) as held:
+                self.assertEqual([flock_obj._lockfile.name for flock_obj in held], locked)
+        self.assertEqual(locked, [manager._stripepath(stripe) for stripe in stripes])
+
+    def test_cleanup(self):
+        """Idle lock files are removed, unless FIFO waiters still hold tickets"""
+        manager = self.SUBJECT.LockManager(self.TEMPDIRPATH, 'test_', stripes=1,
+                                           policy=self.SUBJECT.Flock.FIFO)
+        with manager.acquire_write('name'):
+            pass
+        path = manager.lockfilepath('name')
+        self.assertEqual(manager.cleanup(), [])  # Not idle
+        queued = path + '.7'
+        open(queued, 'w').close()
+        self.assertEqual(manager.cleanup(0), [])
+        os.unlink(queued)
+        self.assertEqual(manager.cleanup(0), [path])
+        self.assertEqual(os.listdir(self.TEMPDIRPATH), [])
+
+
+class TestMain(TestCaseBase):
+    """Tests for running flock.py"""
+
+    def run_subject(self, *args):
+        """Return standard output of the subject run with args"""
+        return subprocess.check_output([sys.executable, self.SUBJECT_PATH] + list(args),
+                                       universal_newlines=True, timeout=60)
+
+    def test_report(self):
+        """--report summarizes wait and hold percentiles, and contending holders"""
+        events = [dict(caller='a.py:1 f', mode='write', pid=200, wait=0.5, hold=1.0,
+                       timedout=False, holders=[[100, 'read']]),
+                  dict(caller='a.py:1 f', mode='write', pid=201, wait=0.1, hold=2.0,
+                       timedout=False, holders=None),
+                  dict(caller='a.py:1 f', mode='write', pid=202, wait=3.0, hold=None,
+                       timedout=True, holders=[[100, 'read']]),
+                  dict(caller='b.py:2 g', mode='read', pid=100, wait=0.0, hold=0.25,
+                       timedout=False, holders=None)]
+        with open(self.lockfilepath + '.jsonl', 'w') as jsonl:
+            for event in events:
+                event.update(time=time.time(), lock=self.lockfilepath, timeout=None)
+                jsonl.write(json.dumps(event) + '\n')
+        self.assertEqual(self.run_subject('--report', self.lockfilepath).splitlines(), [
+            '{} write lock by a.py:1 f: 2 acquired, 1 timed out'.format(self.lockfilepath),
+            '    wait p50 0.5000s p95 3.0000s p99 3.0000s max 3.0000s',
+            '    hold p50 2.0000s p95 2.0000s p99 2.0000s max 2.0000s',
+            '    waited 2 times on read lock of pid 100 (b.py:2 g)',
+            '{} read lock by b.py:2 g: 1 acquired, 0 timed out'.format(self.lockfilepath),
+            '    wait p50 0.0000s p95 0.0000s p99 0.0000s max 0.0000s',
+            '    hold p50 0.2500s p95 0.2500s p99 0.2500s max 0.2500s'])
+
+    def test_parse_args(self):
+        """Options default to a 5 second run of 20 processes, and distributions are checked"""
+        options = self.SUBJECT._parse_args([])
+        self.assertEqual((options.processes, options.writers, options.seconds, options.policy,
+                          options.backend, options.report),
+                         (20, 0.1, 5.0, None, 'file', None))
+        options = self.SUBJECT._parse_args(['-p', '3', '-w', '0.5', '-s', '0.5', '--hold',
+                                            'exp:0.01', '--think', 'fixed:0', '--policy',
+                                            'fifo', '--lockfile', self.lockfilepath])
+        self.assertEqual((options.processes, options.writers, options.seconds, options.policy,
+                          options.hold, options.think, options.lockfile),
+                         (3, 0.5, 0.5, 'fifo', 'exp:0.01', 'fixed:0', self.lockfilepath))
+        self.assertEqual(self.SUBJECT._distribution('fixed:0.25')(), 0.25)
+        self.assertTrue(1 <= self.SUBJECT._distribution('uniform:1,2')() <= 2)
+        for spec in ('fixed', 'uniform:1', 'exp:0', 'exp:x', 'normal:1'):
+            with self.subTest(spec=spec):
+                self.assertRaises(ValueError, self.SUBJECT._distribution, spec)
+                with patch('sys.stderr'), self.assertRaises(SystemExit):
+                    self.SUBJECT._parse_args(['--hold', spec])
+
+    def test_benchmark(self):
+        """A short run of every policy reports on readers, writers, starvation and CPU"""
+        options = self.SUBJECT._parse_args(['-p', '3', '-w', '0.3', '-s', '0.3', '--hold',
+                                            'fixed:0.001', '--think', 'fixed:0.001',
+                                            '--lockfile', self.lockfilepath])
+        for policy in self.SUBJECT.Flock.POLICIES:
+            with self.subTest(policy=policy), patch('{}.logging'.format(self.SUBJECT_NAME)):
+                lines = self.SUBJECT._benchmark(options, policy)
+                self.assertEqual(lines[0], 'file backend, {} policy: 3 processes (1 writing),'
+                                 ' 0.3s, hold fixed:0.001, think fixed:0.001'.format(policy))
+                for line, name in zip(lines[1:3], ('read', 'write')):
+                    self.assertRegex(line, r'^ +{} locks: +[1-9]\d* acquired, +[\d.]+/s,'
+                                     r' wait p50 [\d.]+s p99 [\d.]+s max [\d.]+s$'.format(name))
+                self.assertRegex(lines[3], r'^    writer starvation: longest wait [\d.]+s,'
+                                 r' 0 of 1 writers never acquired$')
+                self.assertRegex(lines[4], r'^    waiter CPU: [\d.]+s over [\d.]+s waiting,'
+                                 r' [\d.]+us per acquisition$')
+                self.assertEqual(len(lines), 5)
+
+    def test_main(self):
+        """Running it benchmarks the chosen policy, and removes the files it used"""
+        output = self.run_subject('-p', '2', '-s', '0.2', '--policy', 'writer',
+                                  '--lockfile', self.lockfilepath)
+        self.assertEqual(len(output.splitlines()), 5)
+        self.assertTrue(output.startswith('file backend, writer policy: 2 processes'))
+        self.assertEqual(os.listdir(self.TEMPDIRPATH), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
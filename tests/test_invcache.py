@@ -6,12 +6,16 @@ import tempfile
 import fcntl
 import json
 import shutil
+import signal
 import subprocess
+import threading
+import asyncio
+import time
 from errno import ESRCH
 from io import StringIO, SEEK_SET
 from contextlib import contextmanager, redirect_stdout, redirect_stderr
 import unittest
-from unittest.mock import MagicMock, patch, mock_open, call, create_autospec, ANY
+from unittest.mock import MagicMock, patch, mock_open, call, create_autospec, ANY, DEFAULT
 from glob import glob
 import importlib.machinery
 from pdb import Pdb
@@ -31,6 +35,9 @@ class TestCaseBase(unittest.TestCase):
     # When non-None, the file-like object returned by mock_open()
     cachefile = None
 
+    # When non-None, the contents of index files written through mock_open(), by path
+    indexfiles = None
+
     # When non-None, a stand-in for fcntl module
     mock_fcntl = None
 
@@ -75,6 +82,8 @@ class TestCaseBase(unittest.TestCase):
         self.MockOpen.reset_mock()
         self.MockOpen.return_value = self.cachefile = StringIO()
         self.cachefile.close = MagicMock()
+        self.MockOpen.side_effect = self.mock_open
+        self.indexfiles = {}
         self.mock_fcntl.reset_mock()
         for attr in dir(fcntl):
             mockattr = MagicMock(spec=getattr(fcntl, attr), spec_set=True)
@@ -85,6 +94,18 @@ class TestCaseBase(unittest.TestCase):
         self.SUBJECT.InvCache.reset()
 
 
+    def mock_open(self, filepath, mode='r'):
+        """Stand-in for open(), index files are kept apart from cachefile"""
+        if not filepath.endswith(self.SUBJECT.InvCache.INDEX_SUFFIX):
+            return DEFAULT  # cachefile
+        if mode == 'r':
+            if filepath not in self.indexfiles:
+                raise FileNotFoundError(filepath)
+            return StringIO(self.indexfiles[filepath])
+        indexfile = StringIO()
+        indexfile.close = lambda: self.indexfiles.__setitem__(filepath, indexfile.getvalue())
+        return indexfile
+
     def setUp(self):
         super(TestCaseBase, self).setUp()
         self._pdb = Pdb()
@@ -253,6 +274,25 @@ class TestToolFunctions(TestCaseBase):
             self.reset()
         sys.stderr.write('\n')
 
+    def test_stream_parse(self):
+        """Verify JSON-lines and YAML record streams produce identical records"""
+        yaml_stream = StringIO("---\n\n"
+                               "- inventory_hostname: foo\n"
+                               "  ansible_host: foo_1\n"
+                               "  join_groups: [tested]\n\n"
+                               "- inventory_hostname: bar\n"
+                               "  ansible_host: bar_1\n")
+        json_stream = StringIO('{"inventory_hostname": "foo", "ansible_host": "foo_1",'
+                               ' "join_groups": ["tested"]}\n'
+                               '\n'
+                               '{"inventory_hostname": "bar", "ansible_host": "bar_1"}\n')
+        expected = [('foo', dict(ansible_host='foo_1', join_groups=['tested']), None),
+                    ('bar', dict(ansible_host='bar_1'), None)]
+        self.assertEqual(list(self.SUBJECT.stream_parse_yaml(yaml_stream)), expected)
+        self.assertEqual(list(self.SUBJECT.stream_parse_json(json_stream)), expected)
+        self.assertRaises(ValueError, list,
+                          self.SUBJECT.stream_parse_json(StringIO('{"foo": "bar"}\n')))
+
 
 class TestInvCache(TestCaseBase):
     """Tests for the InvCache class"""
@@ -261,7 +301,42 @@ class TestInvCache(TestCaseBase):
         """Verify InvCache initialization behavior"""
         invcache = self.SUBJECT.InvCache()
         self.MockOpen.assert_called_with(os.path.join(self.TEMPDIRPATH, 'bar'), 'a+')
-        self.assertDictEqual(invcache.DEFAULT_CACHE, json.loads(self.cachefile.getvalue()))
+        # Opening (or reading) never writes
+        self.assertEqual(self.cachefile.getvalue(), '')
+        self.assertDictEqual(invcache.DEFAULT_CACHE, json.loads(str(invcache)))
+        self.assertEqual(self.cachefile.getvalue(), '')
+        self.validate_mock_fcntl()
+
+    def test_validation(self):
+        """Verify untrusted caches are validated on read, and changes on write"""
+        invcache = self.SUBJECT.InvCache()
+        invcache.addhost('foobar', dict(answer=42))
+        written = json.loads(self.cachefile.getvalue())
+        with patch.object(invcache, '_validate') as mock_validate:
+            invcache.gethost('foobar')
+            self.assertFalse(mock_validate.called)  # Trusted
+            invcache.updatehost('foobar', dict(question=None))
+            mock_validate.assert_called_once_with(ANY, {'foobar': ANY})
+            # Another process trusts it by the index file's stamp, --list is what was read
+            invcache._verified.clear()
+            invcache.gethost('foobar')
+            mock_validate.assert_called_once_with(ANY, {'foobar': ANY})
+            with patch.object(invcache, '_parse') as mock_parse:
+                self.assertEqual(str(invcache), self.cachefile.getvalue())
+                self.assertFalse(mock_parse.called)
+        # Corrupt, but parseable and the current version
+        corrupt = json.loads(self.cachefile.getvalue())
+        corrupt['_meta']['hostvars']['foobar']['answer'] = 24
+        invcache._write_raw(json.dumps(corrupt))
+        with patch.object(invcache, '_validate') as mock_validate:
+            self.assertEqual(invcache.gethost('foobar')[0]['answer'], 24)
+            mock_validate.assert_called_once_with(ANY)
+        written['_meta']['hostvars']['localhost']['invcachevers'] = 0
+        written['subjects'] = dict(hosts='foobar')
+        invcache._write_raw(json.dumps(written))
+        self.assertRaises(ValueError, invcache.gethost, 'foobar')
+        self.assertRaises(ValueError, invcache._validate,
+                          dict(subjects=dict(hosts=[], vars={})))
         self.validate_mock_fcntl()
 
     def test_reset(self):
@@ -301,8 +376,9 @@ class TestInvCache(TestCaseBase):
         self.assertIn('all', geted[1])
         self.assertIn('subjects', geted[1])
         #self.SUBJECT.os.unlink.assert_called_once_with(os.path.join(self.TEMPDIRPATH, 'bar'))
-        self.SUBJECT.os.unlink.assert_called_once_with(filepath)
-        self.assertDictEqual(invcache.DEFAULT_CACHE, json.loads(self.cachefile.getvalue()))
+        self.SUBJECT.os.unlink.assert_has_calls([call(filepath), call(filepath + '.index')])
+        self.assertDictEqual(invcache.DEFAULT_CACHE,
+                             json.loads(self.cachefile.getvalue()))
 
     def test_updategetdelhost(self):
         """Verify invcache.gethost() == invcache.updatehost() == invcache.delhost()"""
@@ -338,6 +414,304 @@ class TestInvCache(TestCaseBase):
 
         self.validate_mock_fcntl()
 
+    def test_commit_conflict(self):
+        """Verify invcache.commit() refuses to clobber changes made since snapshot()"""
+        invcache = self.SUBJECT.InvCache()
+        inventory, version = invcache.snapshot()
+        self.assertEqual(version, invcache.stamp(self.cachefile.getvalue()))
+        invcache.addhost('foobar')
+        inventory['_meta']['hostvars']['snafu'] = {}
+        self.assertIsNone(invcache.commit(inventory, version))
+        self.assertTrue(invcache.gethost('foobar'))
+        self.assertIsNone(invcache.gethost('snafu'))
+        inventory, version = invcache.snapshot()
+        self.assertTrue(invcache.commit(inventory, version))
+        self.validate_mock_fcntl()
+
+    def test_transaction_retry(self):
+        """Verify invcache.transaction() re-applies mutator after a conflicting write"""
+        invcache = self.SUBJECT.InvCache()
+        calls = []
+
+        def mutator(inventory):
+            calls.append(len(calls))
+            if len(calls) == 1:  # Sneak in a conflicting write
+                invcache.addhost('snafu')
+            return self.SUBJECT.InvCache._addhost(invcache, inventory, 'foobar')
+
+        hostvars, groups = invcache.transaction(mutator)
+        self.assertEqual(calls, [0, 1])
+        self.assertEqual(hostvars, {})
+        self.assertIn('subjects', groups)
+        self.assertTrue(invcache.gethost('foobar'))
+        self.assertTrue(invcache.gethost('snafu'))
+        with patch.object(invcache, '_attempt', return_value=(False, None)):
+            self.assertRaises(RuntimeError, invcache.transaction, mutator)
+        self.validate_mock_fcntl()
+
+    def test_instance_per_cachefile(self):
+        """Verify one instance exists per cache file, and reset() can target just one"""
+        invcache = self.SUBJECT.InvCache()
+        self.assertIs(invcache, self.SUBJECT.InvCache())
+        other = self.SUBJECT.InvCache(os.path.join(self.TEMPDIRPATH, 'other'))
+        self.assertIsNot(invcache, other)
+        self.assertNotEqual(invcache.filepath, other.filepath)
+        self.SUBJECT.InvCache.reset(other.filepath)
+        self.assertIs(invcache, self.SUBJECT.InvCache())
+        self.assertIsNot(other, self.SUBJECT.InvCache(os.path.join(self.TEMPDIRPATH, 'other')))
+        self.validate_mock_fcntl()
+
+    def test_threaded_addhost(self):
+        """Verify concurrent threads sharing an instance don't lose updates"""
+        invcache = self.SUBJECT.InvCache()
+
+        def add_hosts(thread_num):
+            for host_num in range(10):
+                invcache.addhost('host{0}_{1}'.format(thread_num, host_num))
+
+        threads = [threading.Thread(target=add_hosts, args=(thread_num,))
+                   for thread_num in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        inventory, _ = invcache.snapshot()
+        self.assertEqual(len(inventory['_meta']['hostvars']), 8 * 10 + 1)
+        self.assertEqual(len(inventory['subjects']['hosts']), 8 * 10)
+        self.validate_mock_fcntl()
+
+    def test_async_addhost(self):
+        """Verify concurrent coroutines sharing an AsyncInvCache don't lose updates"""
+
+        async def add_hosts():
+            aic = await self.SUBJECT.AsyncInvCache.open()
+            await asyncio.gather(*[aic.addhost('host{0}'.format(num), dict(num=num))
+                                   for num in range(50)])
+            await aic.updatehost('host7', dict(lucky=True))
+            return aic, await aic.gethost('host7')
+
+        aic, (hostvars, groups) = asyncio.run(add_hosts())
+        self.assertIs(aic.invcache, self.SUBJECT.InvCache())
+        self.assertIs(aic.executor, self.SUBJECT.AsyncInvCache.lock_executor())
+        self.assertDictEqual(hostvars, dict(num=7, lucky=True))
+        inventory, _ = aic.invcache.snapshot()
+        self.assertEqual(len(inventory['subjects']['hosts']), 50)
+        self.validate_mock_fcntl()
+
+    def test_replication(self):
+        """Verify an InvCacheFollower replicates mutations made through an InvCacheLeader"""
+        cachefiles = {}
+
+        def mock_open(filepath, mode='r'):
+            if filepath.endswith(self.SUBJECT.InvCache.INDEX_SUFFIX):
+                return self.mock_open(filepath, mode)
+            cachefile = cachefiles.setdefault(filepath, StringIO())
+            cachefile.close = MagicMock()
+            return cachefile
+
+        self.MockOpen.side_effect = mock_open
+        invcache = self.SUBJECT.InvCache(os.path.join(self.TEMPDIRPATH, 'leader'))
+        invcache.addhost('before', dict(answer=42))  # Not through the leader
+        leader = self.SUBJECT.InvCacheLeader(invcache)
+        threading.Thread(target=leader.serve_forever).start()
+        follower_dirpath = os.path.join(self.TEMPDIRPATH, 'follower')
+        follower = self.SUBJECT.InvCacheFollower(self.SUBJECT.InvCache(follower_dirpath),
+                                                 leader.server_address)
+        try:
+            follower.start()
+            request = lambda *args: self.SUBJECT.leader_request(leader.server_address, *args)
+            request('addhost', 'foobar', dict(ttl=60), ['subjects', 'tested'])
+            request('updatehost', 'before', dict(question=None))
+            request('addhost', 'foobaz')
+            request('delhost', 'foobaz')
+            self.assertRaises(ValueError, request, 'reset')
+            self.assertRaises(ValueError, self.SUBJECT.leader_request, leader.server_address,
+                              'delhost', 'foobar', secret='guessed')
+            self.assertTrue(follower.wait(leader.seq, timeout=10, epoch=leader.epoch))
+        finally:
+            follower.close()
+            leader.shutdown()
+            leader.server_close()
+        self.assertEqual(leader.seq, 4)
+        self.assertRaises(ValueError, self.SUBJECT.InvCacheLeader, invcache, ('0.0.0.0', 0))
+        replica = follower.invcache.snapshot()[0]
+        inventory = leader.invcache.snapshot()[0]
+        self.assertDictEqual(replica['_meta']['hostvars']['localhost'],
+                             follower.invcache.DEFAULT_CACHE['_meta']['hostvars']['localhost'])
+        del replica['_meta']['hostvars']['localhost']
+        del inventory['_meta']['hostvars']['localhost']
+        self.assertDictEqual(replica['_meta'], inventory['_meta'])
+        self.assertDictEqual(replica['_meta']['hostvars']['before'],
+                             dict(answer=42, question=None))
+        self.assertEqual(sorted(replica), sorted(inventory))
+        for group in inventory:
+            if group != '_meta':
+                self.assertEqual(sorted(replica[group]['hosts']), sorted(inventory[group]['hosts']))
+        self.validate_mock_fcntl()
+
+    def test_import_export(self):
+        """Verify invcache.importhosts() in chunks matches addhost(), and exporthosts() round-trips"""
+        invcache = self.SUBJECT.InvCache()
+        invcache.addhost('foobar', dict(stale=True), ['tested'])
+        records = [('host{0}'.format(num), dict(num=num, join_groups=['tested']), None)
+                   for num in range(10)]
+        records.append(('foobar', dict(answer=42), None))
+        self.assertEqual(invcache.importhosts(iter(records), chunk_size=3), 11)
+        self.assertDictEqual(invcache.gethost('host3')[0], dict(num=3))
+        self.assertEqual(sorted(invcache.gethost('host3')[1]), ['all', 'subjects', 'tested'])
+        self.assertDictEqual(invcache.gethost('foobar')[0], dict(answer=42))
+        self.assertNotIn('tested', invcache.gethost('foobar')[1])
+        exported = sorted(invcache.exporthosts(), key=lambda record: record['inventory_hostname'])
+        self.assertEqual(len(exported), 11)
+        self.assertDictEqual(exported[-1], dict(inventory_hostname='host9', num=9,
+                                                join_groups=['subjects', 'tested']))
+        before = invcache.snapshot()[0]
+        invcache.importhosts(self.SUBJECT._record(record) for record in exported)
+        after = invcache.snapshot()[0]
+        for group in before:
+            if group != '_meta':
+                self.assertEqual(sorted(before[group]['hosts']), sorted(after[group]['hosts']))
+        self.assertDictEqual(before['_meta'], after['_meta'])
+        self.validate_mock_fcntl()
+
+    def test_query(self):
+        """Verify invcache.query() matches predicates, updating indexes incrementally"""
+        invcache = self.SUBJECT.InvCache()
+        invcache.addhost('one', dict(cloud_group='openstack', subject_created=True,
+                                     flavor='m1.small'), ['subjects', 'tested'])
+        invcache.addhost('two', dict(cloud_group='openstack', subject_created=False))
+        invcache.addhost('three', dict(cloud_group='docker', subject_created=True,
+                                       flavor='m1.small'), ['subjects', 'tested'])
+        self.assertEqual(invcache.query(), ['localhost', 'one', 'three', 'two'])
+        self.assertEqual(invcache.query(['tested']), ['one', 'three'])
+        self.assertEqual(invcache.query(equals=dict(cloud_group='openstack',
+                                                    subject_created=True)), ['one'])
+        self.assertEqual(invcache.query(['subjects'], exists=['flavor']), ['one', 'three'])
+        self.assertEqual(invcache.query(equals=dict(flavor='m1.small'),
+                                        exists=['subject_created']), ['one', 'three'])
+        self.assertEqual(invcache.query(['nonexistent']), [])
+        with patch.object(invcache, '_buildindex') as mock_buildindex:
+            invcache.updatehost('two', dict(subject_created=True))
+            invcache.delhost('one')
+            invcache.importhosts([('four', dict(cloud_group='openstack',
+                                                subject_created=True), ['tested'])])
+            self.assertEqual(invcache.query(['tested'], dict(cloud_group='openstack',
+                                                              subject_created=True)),
+                             ['four'])
+            self.assertEqual(invcache.query(equals=dict(subject_created=True)),
+                             ['four', 'three', 'two'])
+            self.assertFalse(mock_buildindex.called)
+        # Indexes are stored beside the cache, for other instances and processes
+        self.assertEqual(sorted(json.loads(self.cachefile.getvalue())['_meta']),
+                         ['hostvars'])
+        header, index = self.indexfiles[invcache.indexpath].splitlines()
+        self.assertEqual(json.loads(header)['version'], invcache.snapshot()[1])
+        index = json.loads(index)
+        self.assertEqual(sorted(index['vars']['subject_created']['true']),
+                         ['four', 'three', 'two'])
+        self.assertNotIn('one', index['hosts'])
+        with patch.object(invcache, '_buildindex') as mock_buildindex:
+            self.assertEqual(invcache.query(['tested']), ['four', 'three'])
+            self.assertFalse(mock_buildindex.called)
+        self.validate_mock_fcntl()
+
+    def test_expiration(self):
+        """Verify ttl becomes expires_at, expired hosts are hidden then collected"""
+        invcache = self.SUBJECT.InvCache()
+        now = time.time()
+        with patch('time.time', return_value=now):
+            hostvars, _ = invcache.addhost('transient', dict(ttl=60), ['subjects', 'doomed'])
+        self.assertDictEqual(hostvars, dict(expires_at=now + 60))
+        self.assertIsNotNone(invcache.gethost('transient'))
+        invcache.addhost('expired', dict(expires_at=1), ['doomed'])
+        self.assertIsNone(invcache.gethost('expired'))
+        self.assertNotIn('expired', str(invcache))
+        self.assertNotIn('expired', invcache.query())
+        # Any write collects expired hosts, and groups left empty
+        with patch('time.time', return_value=now + 61):
+            invcache.addhost('permanent')
+        inventory = invcache.snapshot()[0]
+        self.assertEqual(sorted(inventory['_meta']['hostvars']), ['localhost', 'permanent'])
+        self.assertNotIn('doomed', inventory)
+        self.assertNotIn('transient', inventory['subjects']['hosts'])
+        # Only expiring hosts are ever examined
+        invcache.importhosts(('host{0}'.format(num), {}, None) for num in range(100))
+        with patch.object(invcache, '_expired') as mock_expired:
+            invcache.addhost('another')
+            self.assertFalse(mock_expired.called)
+        self.validate_mock_fcntl()
+
+    def test_durability(self):
+        """Verify fsync() happens per durability mode"""
+        invcache = self.SUBJECT.InvCache()
+        self.assertEqual(invcache.durability, 'none')
+        self.assertRaises(ValueError, setattr, invcache, 'durability', 'sometimes')
+        with patch.object(invcache, '_fsync') as mock_fsync:
+            invcache.addhost('foobar')
+            self.assertFalse(mock_fsync.called)
+            invcache.durability = 'always'
+            invcache.addhost('foobar')
+            invcache.addhost('foobaz')
+            self.assertEqual(mock_fsync.call_count, 2)
+        invcache.durability = 'batch'
+        invcache.BATCH_INTERVAL = 60
+        with patch.object(invcache, '_fsync') as mock_fsync:
+            invcache._synced = time.time()
+            invcache.addhost('foobar')
+            invcache.addhost('foobaz')
+            self.assertFalse(mock_fsync.called)  # Until interval passes, or exit
+            self.assertIsNotNone(invcache._timer)
+            invcache._timer.cancel()
+            self.SUBJECT.InvCache._sync_all()
+            mock_fsync.assert_called_once_with()
+        self.validate_mock_fcntl()
+
+    def test_durability_always(self):
+        """Verify 'always' durability replaces the cache file, never writing it in-place"""
+        self.MockOpen.side_effect = open  # Real files
+        self.addCleanup(setattr, self.MockOpen, 'side_effect', None)
+        invcache = self.SUBJECT.InvCache(self.TEMPDIRPATH)
+        invcache.durability = 'always'
+        invcache.addhost('foobar')
+        inode = os.stat(invcache.filepath).st_ino
+        with patch('{}.os.fsync'.format(self.SUBJECT_NAME), wraps=os.fsync) as mock_fsync:
+            invcache.addhost('foobaz')
+            self.assertEqual(mock_fsync.call_count, 3)  # New file, cache file, directory
+        self.assertNotEqual(os.stat(invcache.filepath).st_ino, inode)
+        self.assertEqual(os.fstat(invcache.cachefile.fileno()).st_ino,
+                         os.stat(invcache.filepath).st_ino)
+        self.assertEqual(sorted(os.listdir(self.TEMPDIRPATH)), ['bar', 'bar.index'])
+        with patch('{}.os.rename'.format(self.SUBJECT_NAME), side_effect=OSError):
+            self.assertRaises(OSError, invcache.addhost, 'snafu')
+        self.assertTrue(invcache.gethost('foobar'))
+        self.assertTrue(invcache.gethost('foobaz'))
+        self.assertIsNone(invcache.gethost('snafu'))
+        self.validate_mock_fcntl()
+
+    def test_inventory_plugin(self):
+        """Verify InventoryModule populates inventory, rebuilding only for new generations"""
+        from ansible.inventory.data import InventoryData
+        invcache = self.SUBJECT.InvCache()
+        invcache.addhost('foobar', dict(answer=42), ['subjects', 'tested'])
+        plugin = self.SUBJECT.InventoryModule()
+        self.SUBJECT.InventoryModule._generations.clear()
+        loader = MagicMock()
+        loader.load_from_file.return_value = dict(plugin='invcache',
+                                                  cachefile=invcache.filepath)
+        inventory = InventoryData()
+        plugin.parse(inventory, loader, 'invcache.yml')
+        self.assertEqual(inventory.get_host('foobar').vars['answer'], 42)
+        self.assertIn('foobar', [host.name for host in inventory.groups['tested'].get_hosts()])
+        self.assertEqual(inventory.get_host('localhost').vars['invcachefile'], invcache.filepath)
+        with patch.object(invcache, '_unexpired') as mock_unexpired:
+            plugin.parse(InventoryData(), loader, 'invcache.yml')
+            self.assertFalse(mock_unexpired.called)
+        invcache.delhost('foobar')
+        inventory = InventoryData()
+        plugin.parse(inventory, loader, 'invcache.yml')
+        self.assertIsNone(inventory.get_host('foobar'))
+        self.validate_mock_fcntl()
+
 
 class TestMain(TestCaseBase):
     """Tests for the ``main()`` function"""
@@ -404,5 +778,78 @@ class TestMain(TestCaseBase):
         self.assertTrue(self.exit_code)
         self.assertRegex(self.fake_stderr.getvalue(), r'usage:')
 
+    def test_query(self):
+        """--query lists hostnames matching --group and --where predicates"""
+        invcache = self.SUBJECT.InvCache(self.TEMPDIRPATH)
+        invcache.addhost('one', dict(cloud_group='openstack', subject_created=True))
+        invcache.addhost('two', dict(cloud_group='openstack'))
+        invcache.addhost('three', dict(cloud_group='docker', subject_created=True))
+        argv = [self.SUBJECT_PATH, '--query', '--group', 'subjects',
+                '--where', 'cloud_group=openstack', '--where', 'subject_created']
+        with redirect_stdout(self.fake_stdout), redirect_stderr(self.fake_stderr):
+            self.SUBJECT.main(argv, {})
+        self.assertEqual(self.fake_stdout.getvalue(), "one\n")
+
+    def start(self, *args):
+        """Return a process running the subject with args, killed after the test"""
+        proc = subprocess.Popen([sys.executable, self.SUBJECT_PATH] + list(args),
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        self.addCleanup(proc.stderr.close)
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+        return proc
+
+    def wait_hosts(self, cachefile, hostnames):
+        """Fail unless cachefile holds exactly hostnames within 10 seconds"""
+        deadline = time.time() + 10
+        while True:
+            try:
+                with open(cachefile) as cache:
+                    found = sorted(json.load(cache)['_meta']['hostvars'])
+            except (IOError, ValueError):  # Not yet written, or being written
+                found = None
+            if found == sorted(hostnames + ['localhost']):
+                return
+            self.assertLess(time.time(), deadline, "{0} has {1}".format(cachefile, found))
+            time.sleep(0.05)
+
+    def test_lead_follow(self):
+        """--follow processes replicate a --lead process, resyncing when it restarts"""
+        cachefile = os.path.join(self.TEMPDIRPATH, 'leader.json')
+        leader = self.start('--cache', cachefile, '--lead', '127.0.0.1:0')
+        for line in leader.stderr:  # After any warnings from Ansible
+            if line.startswith('Leading on '):
+                address = self.SUBJECT._address(line.split()[2].rstrip(','))
+                break
+        else:
+            self.fail("Leader exited")
+        followers = dict((os.path.join(self.TEMPDIRPATH, 'follower{0}.json'.format(num)),
+                          None) for num in range(2))
+        for follower_cachefile in followers:
+            followers[follower_cachefile] = self.start(
+                '--cache', follower_cachefile, '--follow', '{0}:{1}'.format(*address))
+        request = lambda *args: self.SUBJECT.leader_request(address, *args)
+        request('addhost', 'one', {}, ['tested'])
+        request('addhost', 'two')
+        for follower_cachefile in followers:
+            self.wait_hosts(follower_cachefile, ['one', 'two'])
+        # Followers miss the restart, and more mutations than they've applied
+        for follower in followers.values():
+            os.kill(follower.pid, signal.SIGSTOP)
+        leader.kill()
+        leader.wait()
+        leader = self.start('--cache', cachefile, '--lead', '{0}:{1}'.format(*address))
+        for line in leader.stderr:
+            if line.startswith('Leading on '):
+                break
+        request('delhost', 'one')
+        request('addhost', 'three')
+        request('addhost', 'four')
+        for follower in followers.values():
+            os.kill(follower.pid, signal.SIGCONT)
+        for follower_cachefile in followers:
+            self.wait_hosts(follower_cachefile, ['two', 'three', 'four'])
+
 if __name__ == '__main__':
     unittest.main()